@@ -0,0 +1,140 @@
+# plot_lod.py
+import numpy as np
+
+# Error máximo tolerado al simplificar, en píxeles de pantalla
+MAX_ERROR_PX = 1.0
+
+
+def _axes_pixel_size(ax):
+    """Tamaño de un píxel en unidades de datos (x, y) según los límites actuales del eje."""
+    bbox = ax.get_window_extent()
+    width_px = max(bbox.width, 1.0)
+    height_px = max(bbox.height, 1.0)
+    x0, x1 = ax.get_xlim()
+    y0, y1 = ax.get_ylim()
+    return abs(x1 - x0) / width_px, abs(y1 - y0) / height_px
+
+
+def grid_thin_indices(x, y, cell):
+    """Índices de los puntos que cambian de celda (tamaño cell) respecto al anterior.
+
+    Pasada vectorizada previa a Douglas-Peucker: en sesiones largas el tag pasa mucho tiempo casi
+    quieto y esos puntos consecutivos no aportan nada a la escala de la tolerancia.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= 2 or cell <= 0:
+        return np.arange(n)
+    with np.errstate(invalid='ignore'):
+        qx = np.floor(x / cell)
+        qy = np.floor(y / cell)
+    changed = np.ones(n, dtype=bool)
+    # NaN != NaN, así que los cortes de línea y sus vecinos se conservan siempre
+    changed[1:] = (qx[1:] != qx[:-1]) | (qy[1:] != qy[:-1])
+    changed[:-1] |= changed[1:] # Conserva también el último punto de cada celda
+    changed[-1] = True
+    return np.flatnonzero(changed)
+
+
+def douglas_peucker_indices(x, y, tolerance):
+    """Índices (ordenados) de los puntos que conserva Douglas-Peucker con la tolerancia dada.
+
+    Trabaja por tramos finitos: los NaN se conservan como separadores para que la línea se corte.
+    En cada pasada procesa a la vez todos los segmentos pendientes con numpy, así que el coste en
+    Python depende de la profundidad de la subdivisión y no del número de puntos.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n)
+    finite = np.isfinite(x) & np.isfinite(y)
+    keep = ~finite # Los NaN se mantienen como cortes de línea
+    # Tramos contiguos de puntos finitos
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], finite.astype(np.int8), [0]))))
+    firsts = edges[::2]
+    lasts = edges[1::2] - 1
+    keep[firsts] = True
+    keep[lasts] = True
+    while len(firsts):
+        lengths = lasts - firsts - 1
+        active = lengths > 0
+        firsts, lasts, lengths = firsts[active], lasts[active], lengths[active]
+        if not len(firsts):
+            break
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        seg = np.repeat(np.arange(len(firsts)), lengths)
+        idx = np.arange(lengths.sum()) - offsets[seg] + firsts[seg] + 1
+        x0, y0 = x[firsts][seg], y[firsts][seg]
+        dx = (x[lasts] - x[firsts])[seg]
+        dy = (y[lasts] - y[firsts])[seg]
+        seg_len = np.hypot(dx, dy)
+        px = x[idx] - x0
+        py = y[idx] - y0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.where(seg_len > 0, np.abs(dy * px - dx * py) / seg_len, np.hypot(px, py))
+        seg_max = np.maximum.reduceat(dist, offsets)
+        # Primer punto de cada segmento que alcanza el máximo
+        hits = np.flatnonzero(dist == seg_max[seg])
+        _, first_hit = np.unique(seg[hits], return_index=True)
+        splits = idx[hits[first_hit]]
+        split = seg_max > tolerance
+        splits = splits[split]
+        keep[splits] = True
+        firsts = np.concatenate((firsts[split], splits))
+        lasts = np.concatenate((splits, lasts[split]))
+    return np.flatnonzero(keep)
+
+
+class TrajectoryLOD:
+    """Versiones precalculadas (Douglas-Peucker) de una trayectoria XY a varios niveles de zoom.
+
+    El nivel k tiene tolerancia base_tolerance * factor**k. level_for_axes elige el más grueso cuyo
+    error no supera MAX_ERROR_PX píxeles con los límites actuales, así que el coste de dibujo
+    depende de la resolución de pantalla y no de la duración de la sesión.
+    """
+
+    def __init__(self, x, y, base_tolerance=None, num_levels=10, factor=2.0):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        if base_tolerance is None:
+            finite = np.isfinite(self.x) & np.isfinite(self.y)
+            extent = max(np.ptp(self.x[finite]) if finite.any() else 0.0,
+                         np.ptp(self.y[finite]) if finite.any() else 0.0, 1e-6)
+            base_tolerance = extent / 4000.0
+        self.tolerances = [base_tolerance * factor ** k for k in range(num_levels)]
+        self.levels = []
+        # Cada nivel se simplifica a partir del anterior: con factor 2 el error acumulado queda por
+        # debajo de 2x la tolerancia del nivel, que sigue siendo subpíxel con MAX_ERROR_PX = 1
+        indices = grid_thin_indices(self.x, self.y, base_tolerance / 2.0)
+        for tol in self.tolerances:
+            kept = douglas_peucker_indices(self.x[indices], self.y[indices], tol)
+            indices = indices[kept]
+            self.levels.append(indices)
+
+    def level_for_axes(self, ax, max_error_px=MAX_ERROR_PX):
+        """Nivel a usar con los límites actuales (-1 = resolución completa)."""
+        px_x, px_y = _axes_pixel_size(ax)
+        budget = max_error_px * min(px_x, px_y)
+        level = -1
+        for k, tol in enumerate(self.tolerances):
+            if tol <= budget:
+                level = k
+        return level
+
+    def indices(self, level, upto=None):
+        """Índices del nivel, opcionalmente solo hasta el frame 'upto' (incluido, siempre presente)."""
+        idx = np.arange(len(self.x)) if level < 0 else self.levels[level]
+        if upto is None:
+            return idx
+        idx = idx[:np.searchsorted(idx, upto, side='right')]
+        if len(idx) == 0 or idx[-1] != upto:
+            idx = np.append(idx, upto)
+        return idx
+
+    def data_for_axes(self, ax, upto=None):
+        """(x, y) a dibujar con los límites actuales del eje."""
+        idx = self.indices(self.level_for_axes(ax), upto)
+        return self.x[idx], self.y[idx]
+
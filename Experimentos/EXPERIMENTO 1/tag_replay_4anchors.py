@@ -10,6 +10,8 @@ from scipy.optimize import minimize
 import datetime
 import time
 
+from plot_lod import TrajectoryLOD
+
 class TagReplay:
     def __init__(self):
         # Configuración del espacio experimental (3.45m x 5.1m)
@@ -212,6 +214,10 @@ class TagReplay:
             
             self.positions = positions
             self.total_frames = len(positions)
+            # Niveles de detalle de la trayectoria (se calculan una vez; update solo elige nivel y recorta)
+            if positions:
+                traj = np.array([p['position'] for p in positions], dtype=float)
+                self.trajectory_lod = TrajectoryLOD(traj[:, 0], traj[:, 1])
             
             # Verificar si se pudieron calcular posiciones
             if self.total_frames == 0:
@@ -399,9 +405,8 @@ class TagReplay:
         # Actualizar marcador de posición
         self.position_marker.set_data([x], [y])
         
-        # Recolectar todos los puntos hasta el cuadro actual para la trayectoria
-        traj_x = [self.positions[i]['position'][0] for i in range(frame + 1)]
-        traj_y = [self.positions[i]['position'][1] for i in range(frame + 1)]
+        # Trayectoria hasta el cuadro actual, simplificada según el zoom actual del eje
+        traj_x, traj_y = self.trajectory_lod.data_for_axes(self.ax, upto=frame)
         self.trajectory_line.set_data(traj_x, traj_y)
         
         # Actualizar círculos de distancia
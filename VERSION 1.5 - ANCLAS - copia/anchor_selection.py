@@ -0,0 +1,257 @@
+# anchor_selection.py
+import argparse
+import time
+
+import numpy as np
+
+from position_solvers import (DEFAULT_TAG_HEIGHT, MIN_DISTANCE_M, SOLVER_CONFIG_FILE, get_solver, load_field_settings,
+                              load_tag_heights)
+
+# --- Configuración ---
+DEFAULT_MAX_ANCHORS = 6      # K: anclas por epoch como mucho (field_settings.max_anchors; 0 = todas)
+GRID_RESOLUTION_M = 0.5      # Celda de la tabla de DOP precalculada
+GRID_MARGIN_M = 1.0          # La tabla cubre la extensión de las anclas +- este margen
+MIN_RSSI_DBM = -100.0        # Anclas con señal por debajo de esto no se eligen...
+RSSI_MARGIN_DB = 15.0        # ...ni las que quedan más de esto por debajo de la mejor del epoch
+MIN_SELECTED = 3             # Si el filtro de señal deja menos, se ignora para ese epoch
+RANGE_SCALE_M = 10.0         # El error de rango crece con la distancia: peso 1 / (1 + (r / escala)^2) en el DOP
+
+
+def _trace_inverse_2x2(m):
+    """traza(M^-1) de matrices 2x2 (..., 2, 2); inf si M es singular."""
+    a, b, c = m[..., 0, 0], m[..., 0, 1], m[..., 1, 1]
+    det = a * c - b * b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(det > 1e-12, (a + c) / det, np.inf)
+
+
+def dop_order(points_xy, anchor_positions, tag_height=DEFAULT_TAG_HEIGHT, range_scale_m=RANGE_SCALE_M):
+    """Orden voraz de anclas por HDOP en cada punto. Devuelve (order (P, A), hdop (P, A)).
+
+    Con la altura del tag fija (como fixed_height_2_5d) la geometría es 2D: cada ancla aporta la
+    componente horizontal del vector unitario tag -> ancla, ponderada por lo que empeora el rango con
+    la distancia (range_scale_m; None = sin ponderar). Se empieza por el par con menor HDOP y se añade
+    cada vez el ancla que más lo reduce; hdop[:, k] es el HDOP con las k + 1 primeras.
+    """
+    anchors = np.asarray(anchor_positions, dtype=np.float64)
+    points = np.asarray(points_xy, dtype=np.float64)
+    num_points, num_anchors = len(points), len(anchors)
+    diff = points[:, None, :] - anchors[None, :, :2]
+    ranges = np.sqrt(np.sum(diff ** 2, axis=2) + (tag_height - anchors[None, :, 2]) ** 2)
+    unit = diff / np.maximum(ranges, 1e-9)[:, :, None]
+    outer = unit[:, :, :, None] * unit[:, :, None, :]  # (P, A, 2, 2)
+    if range_scale_m:
+        outer = outer / (1.0 + (ranges / range_scale_m) ** 2)[:, :, None, None]
+
+    order = np.zeros((num_points, num_anchors), dtype=np.int64)
+    hdop = np.full((num_points, num_anchors), np.inf)
+    rows = np.arange(num_points)
+    if num_anchors < 2:
+        return order, hdop
+    first, second = np.triu_indices(num_anchors, 1)
+    pair_info = outer[:, first] + outer[:, second]
+    best = np.argmin(_trace_inverse_2x2(pair_info), axis=1)
+    order[:, 0], order[:, 1] = first[best], second[best]
+    info = pair_info[rows, best]
+    hdop[:, 1] = np.sqrt(_trace_inverse_2x2(info))
+    used = np.zeros((num_points, num_anchors), dtype=bool)
+    used[rows, order[:, 0]] = used[rows, order[:, 1]] = True
+    for step in range(2, num_anchors):
+        candidate = info[:, None] + outer
+        score = np.where(used, np.inf, _trace_inverse_2x2(candidate))
+        pick = np.argmin(score, axis=1)
+        order[:, step] = pick
+        used[rows, pick] = True
+        info = candidate[rows, pick]
+        hdop[:, step] = np.sqrt(_trace_inverse_2x2(info))
+    return order, hdop
+
+
+class AnchorSelector:
+    """Elige como mucho K anclas por epoch para que el coste del solver no crezca con la instalación.
+
+    La geometría se precalcula una vez: una rejilla sobre el campo con, en cada celda, el orden voraz
+    de anclas por HDOP (dop_order). Por epoch se estima dónde está el tag (centroide de las anclas
+    ponderado por 1/d^2), se descartan las anclas con mala señal (por debajo de min_rssi_dbm o a más
+    de rssi_margin_db de la mejor) y se toman las K primeras de la celda entre las que quedan.
+    Todo son operaciones sobre arrays (E, A): el coste por epoch es fijo.
+    La geometría depende de la altura del tag: como fixed_height_2_5d se usa field_settings.tag_heights
+    por tag (o tag_height), con una rejilla por altura; tag_height fija una sola para todos.
+    """
+
+    def __init__(self, anchor_positions, max_anchors=None, tag_height=None, config_file=SOLVER_CONFIG_FILE,
+                 resolution_m=GRID_RESOLUTION_M, min_rssi_dbm=MIN_RSSI_DBM, rssi_margin_db=RSSI_MARGIN_DB):
+        settings = load_field_settings(config_file)
+        self.config_file = config_file
+        self.anchor_ids = sorted(int(aid) for aid in anchor_positions)
+        self.anchors = np.array([anchor_positions[aid] for aid in self.anchor_ids], dtype=np.float64).reshape(-1, 3)
+        self.max_anchors = int(settings.get('max_anchors', DEFAULT_MAX_ANCHORS) if max_anchors is None else max_anchors)
+        self.fixed_height = tag_height
+        self.tag_height, self.tag_heights = ((float(tag_height), {}) if tag_height is not None
+                                             else load_tag_heights(config_file))
+        self.min_rssi_dbm = min_rssi_dbm
+        self.rssi_margin_db = rssi_margin_db
+        self.epochs = 0
+        self.trimmed = 0 # Epochs en los que se descartó alguna ancla que respondía
+        self.active = 0 < self.max_anchors < len(self.anchor_ids)
+        if not self.active:
+            return
+        self.origin = self.anchors[:, :2].min(axis=0) - GRID_MARGIN_M
+        extent = self.anchors[:, :2].max(axis=0) + GRID_MARGIN_M - self.origin
+        self.resolution_m = resolution_m
+        self.shape = np.maximum(np.ceil(extent / resolution_m).astype(np.int64), 1)
+        self.build_time_s = 0.0
+        self._ranks = {} # altura del tag -> rank[celda, ancla]: posición del ancla en el orden de la celda
+        self._rank_for(self.tag_height)
+
+    def _rank_for(self, height):
+        """Tabla de rangos para una altura del tag (se calcula la primera vez que hace falta)."""
+        rank = self._ranks.get(height)
+        if rank is None:
+            start = time.perf_counter()
+            gx, gy = np.meshgrid(np.arange(self.shape[0]), np.arange(self.shape[1]), indexing='ij')
+            centers = self.origin + (np.column_stack([gx.ravel(), gy.ravel()]) + 0.5) * self.resolution_m
+            order, _ = dop_order(centers, self.anchors, height)
+            rank = self._ranks[height] = np.empty_like(order)
+            np.put_along_axis(rank, order, np.arange(order.shape[1])[None, :], axis=1)
+            self.build_time_s += time.perf_counter() - start
+        return rank
+
+    def height_of(self, tag_id=None):
+        """Altura (m) del tag con la que se ordenan sus anclas."""
+        return self.tag_heights.get(int(tag_id), self.tag_height) if tag_id is not None else self.tag_height
+
+    def settings(self):
+        """Parámetros que cambian la selección (para claves de caché); None si se usan todas las anclas."""
+        if not self.active:
+            return None
+        return {'max_anchors': self.max_anchors, 'tag_height': self.tag_height,
+                'tag_heights': sorted(self.tag_heights.items()), 'resolution_m': self.resolution_m,
+                'min_rssi_dbm': self.min_rssi_dbm, 'rssi_margin_db': self.rssi_margin_db}
+
+    def _cells(self, xy):
+        index = np.floor((xy - self.origin) / self.resolution_m).astype(np.int64)
+        index = np.clip(index, 0, self.shape - 1)
+        return index[:, 0] * self.shape[1] + index[:, 1]
+
+    def select_batch(self, distances, rssi=None, tag_ids=None):
+        """Máscara (E, A) de anclas a usar. distances en metros (NaN = sin lectura), columnas en anchor_ids.
+
+        tag_ids (E,) elige la altura de cada epoch (tag_heights); sin él se usa la altura por defecto.
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            valid = distances > MIN_DISTANCE_M
+        if not self.active:
+            return valid
+        self.epochs += len(distances)
+        candidates = valid
+        if rssi is not None:
+            signal = np.where(valid, np.asarray(rssi, dtype=np.float64), np.nan)
+            with np.errstate(invalid='ignore'):
+                best = np.fmax.reduce(signal, axis=1) # Ignora NaN (RSSI desconocido)
+                weak = (signal < self.min_rssi_dbm) | (signal < best[:, None] - self.rssi_margin_db)
+            good = valid & ~weak
+            candidates = np.where((good.sum(axis=1) >= MIN_SELECTED)[:, None], good, valid)
+        # Posición aproximada: centroide de las anclas ponderado por 1/d^2 (las más cercanas pesan más)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(valid, 1.0 / np.maximum(distances, MIN_DISTANCE_M) ** 2, 0.0)
+        total = weights.sum(axis=1)
+        approx = (weights @ self.anchors[:, :2]) / np.where(total > 0, total, 1.0)[:, None]
+        cells = self._cells(approx)
+        if tag_ids is None or not self.tag_heights:
+            rank = self._rank_for(self.tag_height)[cells]
+        else:
+            unique_tags, inverse = np.unique(np.asarray(tag_ids), return_inverse=True)
+            heights = np.array([self.height_of(tag) for tag in unique_tags.tolist()], dtype=np.float64)[inverse]
+            rank = np.empty((len(cells), len(self.anchor_ids)), dtype=np.intp)
+            for height in np.unique(heights):
+                rows = heights == height
+                rank[rows] = self._rank_for(float(height))[cells[rows]]
+        key = np.where(candidates, rank, rank.shape[1] + rank)
+        picked = np.argsort(key, axis=1, kind='stable')[:, :self.max_anchors]
+        mask = np.zeros_like(valid)
+        np.put_along_axis(mask, picked, True, axis=1)
+        mask &= candidates
+        self.trimmed += int(np.count_nonzero(mask.sum(axis=1) < valid.sum(axis=1)))
+        return mask
+
+    def select_map(self, responding_distances, rssi=None, tag_id=None):
+        """Para un solo epoch: dict ancla -> distancia (m) (y ancla -> RSSI). Devuelve el set de anclas a usar."""
+        if not self.active or len(responding_distances) <= self.max_anchors:
+            return set(responding_distances)
+        row = np.array([[responding_distances.get(aid, np.nan) for aid in self.anchor_ids]])
+        signal = None if rssi is None else np.array([[rssi.get(aid, np.nan) for aid in self.anchor_ids]])
+        mask = self.select_batch(row, signal, None if tag_id is None else [tag_id])[0]
+        return {aid for aid, keep in zip(self.anchor_ids, mask) if keep}
+
+    def summary(self):
+        if not self.active:
+            return f"todas las anclas ({len(self.anchor_ids)}, K={self.max_anchors})"
+        return (f"K={self.max_anchors} de {len(self.anchor_ids)} anclas, {self.trimmed} de {self.epochs} epochs recortados "
+                f"(tabla DOP {self.shape[0]}x{self.shape[1]} en {self.build_time_s * 1000:.0f} ms)")
+
+
+def court_anchors(num_anchors, length=28.0, width=15.0, height=2.0):
+    """Anclas repartidas por el perímetro de una pista (para el benchmark)."""
+    t = np.arange(num_anchors) / num_anchors * 2 * (length + width)
+    x = np.where(t < length, t, np.where(t < length + width, length, np.where(t < 2 * length + width,
+                                                                              2 * length + width - t, 0.0)))
+    y = np.where(t < length, 0.0, np.where(t < length + width, t - length, np.where(t < 2 * length + width,
+                                                                                  width, 2 * (length + width) - t)))
+    return np.column_stack([x, y, np.full(num_anchors, height)])
+
+
+def benchmark(anchor_counts=(4, 8, 12, 16), num_epochs=500, max_anchors=DEFAULT_MAX_ANCHORS, solver_name='fixed_height_2_5d',
+              noise_m=0.05, dropout=0.1):
+    """Coste y error del solver con todas las anclas frente a las K elegidas, según crece la instalación."""
+    rng = np.random.default_rng(0)
+    solver = get_solver(solver_name)
+    print(f"Solver {solver_name}, {num_epochs} epochs, ruido {noise_m * 100:.0f} cm (+ NLOS que crece con la distancia), "
+          f"{dropout * 100:.0f}% lecturas perdidas")
+    for count in anchor_counts:
+        anchors = court_anchors(count)
+        anchor_map = {10 * (i + 1): pos for i, pos in enumerate(anchors)}
+        points = np.column_stack([rng.uniform(1, 27, num_epochs), rng.uniform(1, 14, num_epochs), np.zeros(num_epochs)])
+        true_ranges = np.linalg.norm(points[:, None, :] - anchors[None, :, :], axis=2)
+        # Las anclas lejanas tienen peor señal y más error (sesgo NLOS positivo)
+        rssi = -60.0 - 20.0 * np.log10(np.maximum(true_ranges, 0.1)) + rng.normal(0, 2, true_ranges.shape)
+        distances = true_ranges + rng.normal(0, noise_m, true_ranges.shape) + rng.exponential(0.01 * true_ranges)
+        distances[rng.random(distances.shape) < dropout] = np.nan
+        selector = AnchorSelector(anchor_map, max_anchors=max_anchors, tag_height=0.0)
+        for label, use_selector in (('todas', False), (f'K={max_anchors}', True)):
+            start = time.perf_counter()
+            d = distances
+            if use_selector:
+                d = np.where(selector.select_batch(distances, rssi), distances, np.nan)
+            positions, _ = solver.solve_batch(d, anchors)
+            elapsed = time.perf_counter() - start
+            error = np.linalg.norm(positions[:, :2] - points[:, :2], axis=1)
+            print(f"  {count:2d} anclas, {label:5s}: {elapsed / num_epochs * 1e6:7.1f} µs/epoch, "
+                  f"error p50/p90 {np.nanmedian(error) * 100:5.1f}/{np.nanquantile(error, 0.9) * 100:5.1f} cm, "
+                  f"sin posición {np.isnan(error).mean() * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Selección de las K mejores anclas por epoch (DOP precalculado + señal).')
+    parser.add_argument('--config', default=SOLVER_CONFIG_FILE, help='Config de anclas.')
+    parser.add_argument('--max-anchors', type=int, default=None, help='K (por defecto field_settings.max_anchors o 6).')
+    parser.add_argument('--at', type=float, nargs=2, metavar=('X', 'Y'), default=None,
+                        help='Muestra el orden de anclas por HDOP en ese punto.')
+    parser.add_argument('--benchmark', action='store_true', help='Compara coste y error con 4-16 anclas sintéticas.')
+    parser.add_argument('--solver', nargs='+', default=['fixed_height_2_5d', 'tag_z0_2d'], help='Solvers del benchmark.')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for name in args.solver:
+            benchmark(max_anchors=args.max_anchors or DEFAULT_MAX_ANCHORS, solver_name=name)
+        raise SystemExit(0)
+    from post_process_data import load_anchor_map
+
+    anchor_map = load_anchor_map(args.config)
+    selector = AnchorSelector(anchor_map, max_anchors=args.max_anchors, config_file=args.config)
+    print(f"{len(anchor_map)} anclas en {args.config}: {selector.summary()}")
+    if args.at:
+        order, hdop = dop_order(np.array([args.at]), selector.anchors, selector.tag_height)
+        for k, (index, value) in enumerate(zip(order[0], hdop[0])):
+            print(f"  {k + 1:2d}. ancla {selector.anchor_ids[index]:4d}  HDOP con las {k + 1} primeras: {value:.2f}")
@@ -0,0 +1,202 @@
+# binary_records.py
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# --- Configuración ---
+BINARY_TOPIC = "uwb/tag/logs/bin"   # Topic de los lotes binarios (el CSV sigue en uwb/tag/logs)
+BATCH_MAGIC = 0xB5                  # Primer byte de un lote binario (un CSV siempre empieza por un dígito)
+BATCH_VERSION = 1
+FILE_MAGIC = b'UWBB'                # Cabecera de los logs binarios (.bin) del receptor
+BINARY_SUFFIX = '.bin'
+
+# Registro de ancho fijo, little-endian y sin relleno (19 bytes frente a ~35 del CSV).
+# En el firmware equivale a un struct __attribute__((packed)) con los mismos campos:
+#   uint16_t tag_id; uint32_t timestamp_ms; uint16_t anchor_id; float raw_cm; float filtered_cm;
+#   int16_t rssi_cdbm; uint8_t status;
+RECORD_DTYPE = np.dtype([
+    ('tag_id', '<u2'),
+    ('timestamp_ms', '<u4'),      # millis() (unsigned long en el ESP32)
+    ('anchor_id', '<u2'),
+    ('raw_cm', '<f4'),
+    ('filtered_cm', '<f4'),
+    ('rssi_cdbm', '<i2'),         # Centésimas de dBm (el CSV lleva 2 decimales)
+    ('status', 'u1'),
+])
+# Cabecera de lote: magic, versión y número de registros
+BATCH_HEADER_DTYPE = np.dtype([('magic', 'u1'), ('version', 'u1'), ('count', '<u2')])
+MAX_BATCH_RECORDS = 65535
+
+
+def is_binary_payload(payload):
+    """True si el payload MQTT (bytes) es un lote binario."""
+    return len(payload) >= BATCH_HEADER_DTYPE.itemsize and payload[0] == BATCH_MAGIC
+
+
+def pack_records(tag_ids, timestamps_ms, anchor_ids, raw_cm, filtered_cm, rssi_dbm, status=1):
+    """Array estructurado RECORD_DTYPE a partir de columnas (escalares o arrays)."""
+    shape = np.broadcast_shapes(*(np.shape(col) for col in (tag_ids, timestamps_ms, anchor_ids, raw_cm,
+                                                              filtered_cm, rssi_dbm, status)))
+    records = np.empty(shape[0] if shape else 1, dtype=RECORD_DTYPE)
+    records['tag_id'] = tag_ids
+    records['timestamp_ms'] = timestamps_ms
+    records['anchor_id'] = anchor_ids
+    records['raw_cm'] = raw_cm
+    records['filtered_cm'] = filtered_cm
+    records['rssi_cdbm'] = np.round(np.asarray(rssi_dbm, dtype=np.float64) * 100.0)
+    records['status'] = status
+    return records
+
+
+def encode_batch(records):
+    """Codificador de referencia: cabecera + registros tal cual, listo para publicar."""
+    records = np.asarray(records, dtype=RECORD_DTYPE)
+    if len(records) > MAX_BATCH_RECORDS:
+        raise ValueError(f"Un lote admite como mucho {MAX_BATCH_RECORDS} registros ({len(records)} recibidos).")
+    header = np.array([(BATCH_MAGIC, BATCH_VERSION, len(records))], dtype=BATCH_HEADER_DTYPE)
+    return header.tobytes() + records.tobytes()
+
+
+def decode_batch(payload):
+    """Devuelve los registros del lote (vista de solo lectura sobre el payload, sin copias)."""
+    header = np.frombuffer(payload, dtype=BATCH_HEADER_DTYPE, count=1)[0]
+    if header['magic'] != BATCH_MAGIC or header['version'] != BATCH_VERSION:
+        raise ValueError(f"Lote binario no reconocido (magic {header['magic']:#x}, versión {header['version']}).")
+    count = int(header['count'])
+    expected = BATCH_HEADER_DTYPE.itemsize + count * RECORD_DTYPE.itemsize
+    if len(payload) != expected:
+        raise ValueError(f"Lote binario truncado o con basura: {len(payload)} bytes, se esperaban {expected}.")
+    return np.frombuffer(payload, dtype=RECORD_DTYPE, count=count, offset=BATCH_HEADER_DTYPE.itemsize)
+
+
+def record_payload_bytes(payload):
+    """Bytes de los registros de un lote, sin la cabecera (lo que se guarda en el log .bin)."""
+    return memoryview(payload)[BATCH_HEADER_DTYPE.itemsize:]
+
+
+def records_to_tuples(records):
+    """(tag_id, timestamp_ms, anchor_id, filtered_cm, rssi) por registro, como parse_log_payload."""
+    return list(zip(records['tag_id'].tolist(), records['timestamp_ms'].tolist(), records['anchor_id'].tolist(),
+                    records['filtered_cm'].astype(np.float64).tolist(), (records['rssi_cdbm'] / 100.0).tolist()))
+
+
+def records_to_csv_lines(records):
+    """Líneas CSV con el formato del firmware, para quien solo entienda texto."""
+    return [f"{t},{ts},{a},{raw:.2f},{filt:.2f},{rssi:.2f},{st}" for t, ts, a, raw, filt, rssi, st in zip(
+        records['tag_id'].tolist(), records['timestamp_ms'].tolist(), records['anchor_id'].tolist(),
+        records['raw_cm'].tolist(), records['filtered_cm'].tolist(), (records['rssi_cdbm'] / 100.0).tolist(),
+        records['status'].tolist())]
+
+
+def open_binary_log(path):
+    """Abre un log .bin nuevo (cabecera FILE_MAGIC + versión) para añadir registros."""
+    handle = open(path, 'wb')
+    handle.write(FILE_MAGIC + bytes([BATCH_VERSION]))
+    handle.flush()
+    return handle
+
+
+def read_binary_log(path):
+    """Registros de un log .bin como array estructurado (memmap: no se lee hasta usarlo)."""
+    header_size = len(FILE_MAGIC) + 1
+    with open(path, 'rb') as f:
+        header = f.read(header_size)
+    if header[:len(FILE_MAGIC)] != FILE_MAGIC or header[-1] != BATCH_VERSION:
+        raise ValueError(f"{path} no es un log binario UWB (versión {BATCH_VERSION}).")
+    num_records = (os.path.getsize(path) - header_size) // RECORD_DTYPE.itemsize
+    if num_records == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    # Un registro a medio escribir al final se ignora
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=header_size, shape=(num_records,))
+
+
+def binary_log_to_frame(path, usecols=None):
+    """DataFrame con las columnas canónicas de uwb_loader a partir de un log .bin."""
+    return records_to_frame(read_binary_log(path), usecols)
+
+
+def records_to_frame(records, usecols=None):
+    """DataFrame con las columnas canónicas de uwb_loader a partir de registros RECORD_DTYPE."""
+    columns = {
+        'TagID': records['tag_id'],
+        'Timestamp(ms)': records['timestamp_ms'].astype(np.int64),
+        'AnchorID': records['anchor_id'],
+        'RawDistance(cm)': records['raw_cm'],
+        'FilteredDistance(cm)': records['filtered_cm'],
+        'RSSI(dBm)': (records['rssi_cdbm'] / 100.0).astype(np.float32),
+        'AnchorStatus': pd.Categorical(records['status']),
+    }
+    wanted = usecols or list(columns)
+    return pd.DataFrame({col: np.asarray(columns[col]) if col != 'AnchorStatus' else columns[col]
+                         for col in wanted if col in columns})
+
+
+def convert_csv_log(input_file, output_file):
+    """Convierte un log crudo CSV en un log .bin (para pruebas sin hardware)."""
+    from uwb_loader import coerce_raw_columns, drop_invalid_rows, read_raw_log
+
+    df = drop_invalid_rows(coerce_raw_columns(read_raw_log(input_file, usecols=[
+        'TagID', 'Timestamp(ms)', 'AnchorID', 'RawDistance(cm)', 'FilteredDistance(cm)', 'RSSI(dBm)', 'AnchorStatus'])))
+    records = pack_records(df['TagID'], df['Timestamp(ms)'], df['AnchorID'],
+                           df['RawDistance(cm)'] if 'RawDistance(cm)' in df else df['FilteredDistance(cm)'],
+                           df['FilteredDistance(cm)'], df['RSSI(dBm)'] if 'RSSI(dBm)' in df else 0.0,
+                           pd.to_numeric(df['AnchorStatus'].astype(str), errors='coerce').fillna(1).astype(np.uint8)
+                           if 'AnchorStatus' in df else 1)
+    with open_binary_log(output_file) as f:
+        f.write(records.tobytes())
+    print(f"{len(records)} registros: {os.path.getsize(input_file)} bytes CSV -> {os.path.getsize(output_file)} bytes binario")
+
+
+def benchmark(num_records=200000, batch_size=50):
+    """Compara tamaño y coste de parseo CSV (parse_log_payload) frente a lotes binarios."""
+    from live_engine import parse_log_payload
+
+    rng = np.random.default_rng(0)
+    records = pack_records(rng.integers(1, 9, num_records), 60000 + np.arange(num_records) * 6,
+                           np.tile([10, 20, 30, 40], num_records // 4 + 1)[:num_records],
+                           rng.uniform(50, 600, num_records), rng.uniform(50, 600, num_records),
+                           rng.uniform(-95, -60, num_records))
+    lines = records_to_csv_lines(records)
+    batches = [encode_batch(records[i:i + batch_size]) for i in range(0, num_records, batch_size)]
+    csv_bytes = sum(len(line) for line in lines)
+    bin_bytes = sum(len(batch) for batch in batches)
+
+    t0 = time.perf_counter()
+    parsed = [parse_log_payload(line) for line in lines]
+    t_csv = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    decoded = [decode_batch(batch) for batch in batches]
+    t_bin = time.perf_counter() - t0
+    assert sum(len(d) for d in decoded) == len(parsed) == num_records
+
+    print(f"{num_records} registros (lotes binarios de {batch_size}):")
+    print(f"  CSV:     {csv_bytes / num_records:.1f} bytes/registro, parseo {t_csv * 1e9 / num_records:.0f} ns/registro")
+    print(f"  Binario: {bin_bytes / num_records:.1f} bytes/registro, decodificación {t_bin * 1e9 / num_records:.0f} ns/registro")
+    print(f"  Reducción: {csv_bytes / bin_bytes:.1f}x en bytes, {t_csv / t_bin:.0f}x en tiempo de parseo")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Formato binario compacto para los registros de rango tag -> host.')
+    parser.add_argument('--convert', nargs=2, metavar=('CSV', 'BIN'), help='Convierte un log crudo CSV a binario.')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N', help='Mide tamaño y parseo con N registros sintéticos.')
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.convert:
+        convert_csv_log(*args.convert)
+    elif args.benchmark:
+        benchmark(args.benchmark, args.batch_size)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Ida y vuelta mínima del formato
+            path = os.path.join(tmp_dir, 'roundtrip.bin')
+            records = pack_records([1, 2], [60039, 60045], [10, 20], [101.34, 107.44], [100.82, 108.42], [-81.5, -79.25])
+            batch = encode_batch(records)
+            with open_binary_log(path) as f:
+                f.write(record_payload_bytes(batch))
+            print(records_to_csv_lines(decode_batch(batch)))
+            print(binary_log_to_frame(path))
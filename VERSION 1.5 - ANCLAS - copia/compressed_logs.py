@@ -0,0 +1,163 @@
+# compressed_logs.py
+import argparse
+import gzip
+import io
+import os
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError: # zstd es opcional: sin el paquete solo se manejan .csv y .csv.gz
+    zstandard = None
+
+# --- Configuración ---
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+LOG_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+FLUSH_INTERVAL_S = 1.0   # Cada vez que se vacía el compresor se pierde algo de ratio: como mucho 1 vez por segundo
+
+
+def compression_of(path):
+    """'gzip', 'zstd' o None según la extensión."""
+    for compression, suffix in COMPRESSIONS.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_log_suffix(path):
+    """Quita .gz/.zst y luego la extensión: 'uwb_log_x.csv.gz' -> 'uwb_log_x'."""
+    compression = compression_of(path)
+    if compression:
+        path = path[:-len(COMPRESSIONS[compression])]
+    return os.path.splitext(path)[0]
+
+
+def log_patterns(pattern):
+    """Un patrón '*.csv' más sus variantes comprimidas, para glob."""
+    if pattern.endswith('.csv'):
+        return [pattern, pattern + '.gz', pattern + '.zst']
+    return [pattern]
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ImportError("Los archivos .zst necesitan el paquete 'zstandard' (pip install zstandard).")
+
+
+def open_log(path, mode='rt'):
+    """Abre un log .csv, .csv.gz o .csv.zst para lectura en streaming ('rt' o 'rb')."""
+    compression = compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, mode, newline='') if 't' in mode else gzip.open(path, mode)
+    if compression == 'zstd':
+        _require_zstd()
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8', newline='') if 't' in mode else stream
+    return open(path, mode, newline='') if 't' in mode else open(path, mode)
+
+
+class CompressedLogWriter:
+    """Escritura de texto comprimida con vaciados periódicos.
+
+    flush() solo vacía el compresor (Z_SYNC_FLUSH / bloque zstd) si han pasado FLUSH_INTERVAL_S desde
+    el anterior, así el receptor puede seguir llamándolo en cada escritura sin destrozar el ratio, y
+    quien lea el archivo mientras crece (log_follower.py) ve los datos con ese retraso como mucho.
+    """
+
+    def __init__(self, path, compression, flush_interval_s=FLUSH_INTERVAL_S):
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        self._last_flush = time.monotonic()
+        if compression == 'gzip':
+            self._binary = gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+            self._flush_binary = self._binary.flush
+        elif compression == 'zstd':
+            _require_zstd()
+            self._binary = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'), closefd=True)
+            self._flush_binary = lambda: self._binary.flush(zstandard.FLUSH_BLOCK)
+        else:
+            raise ValueError(f"Compresión desconocida: {compression}")
+
+    @property
+    def closed(self):
+        return self._binary.closed
+
+    def write(self, text):
+        self._binary.write(text.encode('utf-8'))
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_flush >= self.flush_interval_s:
+            self._flush_binary()
+            self._last_flush = now
+
+    def close(self):
+        if not self._binary.closed:
+            self._flush_binary()
+            self._binary.close()
+
+
+def open_log_writer(path, compression=None):
+    """Archivo de log para escribir texto: normal o CompressedLogWriter."""
+    if compression:
+        return CompressedLogWriter(path, compression)
+    return open(path, 'w')
+
+
+class StreamDecompressor:
+    """Descompresión incremental de un archivo comprimido que sigue creciendo.
+
+    feed(bytes nuevos del disco) devuelve los bytes de texto nuevos. El estado del descompresor no
+    se puede guardar: para reanudar se vuelve a descomprimir desde el inicio descartando skip bytes.
+    """
+
+    def __init__(self, compression, skip=0):
+        if compression == 'gzip':
+            self._decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        else:
+            _require_zstd()
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        self.skip = skip
+
+    def feed(self, data):
+        out = self._decompressor.decompress(data)
+        if self.skip:
+            dropped = min(self.skip, len(out))
+            out = out[dropped:]
+            self.skip -= dropped
+        return out
+
+
+def compress_file(path, compression, remove=True):
+    """Comprime un log cerrado (p. ej. para archivar los antiguos). Devuelve la ruta nueva."""
+    target = path + COMPRESSIONS[compression]
+    with open(path, 'rb') as src:
+        if compression == 'gzip':
+            with gzip.open(target, 'wb', compresslevel=GZIP_LEVEL) as dst:
+                while chunk := src.read(1 << 20):
+                    dst.write(chunk)
+        else:
+            _require_zstd()
+            with open(target, 'wb') as dst:
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst)
+    if remove:
+        os.remove(path)
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Comprime logs UWB crudos cerrados (.csv -> .csv.gz / .csv.zst).')
+    parser.add_argument('files', nargs='+', help='Logs .csv a comprimir.')
+    parser.add_argument('--compression', choices=sorted(COMPRESSIONS), default='zstd' if zstandard else 'gzip')
+    parser.add_argument('--keep', action='store_true', help='No borrar el .csv original.')
+    args = parser.parse_args()
+
+    for path in args.files:
+        start = time.perf_counter()
+        size = os.path.getsize(path)
+        target = compress_file(path, args.compression, remove=not args.keep)
+        print(f"{path} -> {target}: {size} -> {os.path.getsize(target)} bytes "
+              f"({size / max(os.path.getsize(target), 1):.1f}x, {time.perf_counter() - start:.2f} s)")
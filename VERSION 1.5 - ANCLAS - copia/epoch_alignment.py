@@ -0,0 +1,183 @@
+# epoch_alignment.py
+import numpy as np
+import pandas as pd
+
+from jitter_buffer import RESET_GAP_MS
+
+# Hueco máximo (ms) para interpolar/extrapolar la serie de un ancla. El tag recorre las 4 anclas
+# cada ~50 ms (una cada ~6 ms + pausa), así que 100 ms cubre un ciclo perdido.
+DEFAULT_MAX_GAP_MS = 100
+
+
+def align_series(sample_t, sample_v, query_t, max_gap_ms=DEFAULT_MAX_GAP_MS, causal=False):
+    """Lleva la serie de un ancla (sample_t ordenado, sample_v (M, V)) a los instantes query_t.
+
+    - causal=False (offline): interpola entre la muestra anterior y la siguiente si ambas están a
+      <= max_gap_ms; si solo una lo está, mantiene su valor.
+    - causal=True (tiempo real): solo usa el pasado; extrapola linealmente con las dos últimas
+      muestras (si están a <= max_gap_ms entre sí) o mantiene la última.
+    Devuelve (Q, V) con NaN donde no hay datos suficientemente recientes.
+    """
+    sample_t = np.asarray(sample_t, dtype=np.int64)
+    sample_v = np.asarray(sample_v, dtype=np.float64).reshape(len(sample_t), -1)
+    query_t = np.asarray(query_t, dtype=np.int64)
+    num_samples, num_values = sample_v.shape
+    out = np.full((len(query_t), num_values), np.nan)
+    if num_samples == 0 or len(query_t) == 0:
+        return out
+
+    right = np.searchsorted(sample_t, query_t, side='right')
+    prev = np.clip(right - 1, 0, num_samples - 1)
+    age_prev = query_t - sample_t[prev]
+    prev_ok = (right >= 1) & (age_prev <= max_gap_ms)
+
+    if causal:
+        before = np.clip(prev - 1, 0, num_samples - 1)
+        dt = (sample_t[prev] - sample_t[before]).astype(np.float64)
+        two_ok = prev_ok & (prev >= 1) & (dt > 0) & (dt <= max_gap_ms)
+        hold = prev_ok & ~two_ok
+        out[hold] = sample_v[prev[hold]]
+        if np.any(two_ok):
+            v0 = sample_v[before[two_ok]]
+            v1 = sample_v[prev[two_ok]]
+            t1 = sample_t[prev[two_ok]].astype(np.float64)[:, None]
+            t = query_t[two_ok].astype(np.float64)[:, None]
+            out[two_ok] = v1 + (v1 - v0) / dt[two_ok][:, None] * (t - t1)
+        return out
+
+    nxt = np.clip(right, 0, num_samples - 1)
+    gap_next = sample_t[nxt] - query_t
+    next_ok = (right < num_samples) & (gap_next <= max_gap_ms)
+    exact = prev_ok & (age_prev == 0)
+    both = prev_ok & next_ok & ~exact
+    only_prev = prev_ok & ~next_ok & ~exact
+    only_next = next_ok & ~prev_ok
+    out[exact | only_prev] = sample_v[prev[exact | only_prev]]
+    out[only_next] = sample_v[nxt[only_next]]
+    if np.any(both):
+        t0 = sample_t[prev[both]].astype(np.float64)[:, None]
+        t1 = sample_t[nxt[both]].astype(np.float64)[:, None]
+        frac = (query_t[both].astype(np.float64)[:, None] - t0) / (t1 - t0)
+        v0 = sample_v[prev[both]]
+        out[both] = v0 + frac * (sample_v[nxt[both]] - v0)
+    return out
+
+
+def align_tag_ranges(timestamps, anchor_ids, values, max_gap_ms=DEFAULT_MAX_GAP_MS, causal=False):
+    """Alinea todas las anclas de un tag a cada instante de medida.
+
+    timestamps/anchor_ids: (N,) registros de un solo tag ordenados por tiempo; values: (N, V).
+    Devuelve (epoch_ts, anchors, aligned) con un epoch por timestamp único de medida y aligned (E, A, V).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    anchor_ids = np.asarray(anchor_ids, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), -1)
+    epoch_ts = np.unique(timestamps)
+    anchors = np.unique(anchor_ids)
+    aligned = np.full((len(epoch_ts), len(anchors), values.shape[1]), np.nan)
+    for a, anchor_id in enumerate(anchors):
+        mask = anchor_ids == anchor_id
+        aligned[:, a, :] = align_series(timestamps[mask], values[mask], epoch_ts, max_gap_ms, causal)
+    return epoch_ts, anchors, aligned
+
+
+def build_aligned_epochs(df, value_cols, max_gap_ms=DEFAULT_MAX_GAP_MS, causal=False):
+    """Equivalente a la tabla pivotada de process_uwb_log, pero con una fila por medida.
+
+    df: registros crudos con 'TagID', 'Timestamp(ms)', 'AnchorID' y value_cols. Si tiene 'SessionID'
+    (session_segments.py) se alinea cada sesión por separado y la salida conserva la columna.
+    Las columnas de salida siguen el mismo formato ('FilteredDistance_10', 'RSSI_10', ...).
+    """
+    frames = []
+    all_anchors = np.unique(df['AnchorID'].to_numpy()).astype(np.int64)
+    group_col = 'SessionID' if 'SessionID' in df.columns else 'TagID'
+    df = df.sort_values([group_col, 'Timestamp(ms)'], kind='stable')
+    for group_id, group in df.groupby(group_col, sort=True):
+        epoch_ts, anchors, aligned = align_tag_ranges(
+            group['Timestamp(ms)'].to_numpy(), group['AnchorID'].to_numpy(),
+            group[value_cols].to_numpy(dtype=np.float64), max_gap_ms, causal)
+        data = {'Timestamp(ms)': epoch_ts,
+                'TagID': np.full(len(epoch_ts), int(group['TagID'].iloc[0]), dtype=np.int64)}
+        if group_col == 'SessionID':
+            data['SessionID'] = np.full(len(epoch_ts), int(group_id), dtype=np.int64)
+        for v, val in enumerate(value_cols):
+            name = val.replace("(cm)", "").replace("(dBm)", "")
+            for anchor_id in all_anchors:
+                column = np.full(len(epoch_ts), np.nan)
+                where = np.flatnonzero(anchors == anchor_id)
+                if where.size:
+                    column = aligned[:, where[0], v]
+                data[f'{name}_{int(anchor_id)}'] = column
+        frames.append(pd.DataFrame(data))
+    if not frames:
+        return pd.DataFrame(columns=['Timestamp(ms)', 'TagID'])
+    return pd.concat(frames, ignore_index=True).sort_values(['Timestamp(ms)', 'TagID'], kind='stable').reset_index(drop=True)
+
+
+class StreamingEpochBuilder:
+    """Versión en tiempo real (causal) de la alineación: un epoch por cada medida recibida.
+
+    Guarda las dos últimas muestras por (tag, ancla) y extrapola cada ancla al instante de la medida
+    recién llegada, con la misma aritmética que align_series(causal=True).
+    Un salto atrás de más de reset_gap_ms (el tag se reinició y millis() volvió a empezar) borra la
+    historia del tag; los saltos atrás pequeños son medidas desordenadas y se ignoran.
+    """
+
+    def __init__(self, max_gap_ms=DEFAULT_MAX_GAP_MS, reset_gap_ms=RESET_GAP_MS):
+        self.max_gap_ms = max_gap_ms
+        self.reset_gap_ms = reset_gap_ms
+        self.resets = 0
+        self._history = {} # tag_id -> {anchor_id: [(t0, v0), (t1, v1)]}
+
+    def reset(self, tag_id=None):
+        if tag_id is None:
+            self._history.clear()
+        else:
+            self._history.pop(tag_id, None)
+
+    def get_state(self):
+        """Historia serializable a JSON (para checkpoints): {tag: {ancla: [[t, [valores]], ...]}}."""
+        return {str(tag_id): {str(anchor_id): [[t, list(v)] for t, v in samples]
+                              for anchor_id, samples in anchors.items()}
+                for tag_id, anchors in self._history.items()}
+
+    def set_state(self, state):
+        """Restaura la historia guardada con get_state."""
+        self._history = {int(tag_id): {int(anchor_id): [(int(t), tuple(float(x) for x in v)) for t, v in samples]
+                                       for anchor_id, samples in anchors.items()}
+                         for tag_id, anchors in state.items()}
+
+    def add(self, tag_id, timestamp_ms, anchor_id, values):
+        """Añade una medida (values: tupla de floats, p. ej. (distancia, rssi)) y devuelve el epoch
+        alineado en timestamp_ms como {anchor_id: tupla de valores}."""
+        values = tuple(float(v) for v in values)
+        anchors = self._history.get(tag_id)
+        if anchors and timestamp_ms < max((s[-1][0] for s in anchors.values() if s), default=timestamp_ms) - self.reset_gap_ms:
+            # Nueva vida del tag: la historia anterior es de otro reloj
+            self.reset(tag_id)
+            self.resets += 1
+        anchors = self._history.setdefault(tag_id, {})
+        samples = anchors.setdefault(anchor_id, [])
+        if samples and timestamp_ms < samples[-1][0]:
+            return self.epoch_at(tag_id, timestamp_ms) # Muestra antigua fuera de orden: no altera la historia
+        samples.append((timestamp_ms, values))
+        if len(samples) > 2:
+            del samples[0]
+        return self.epoch_at(tag_id, timestamp_ms)
+
+    def epoch_at(self, tag_id, timestamp_ms):
+        """Epoch extrapolado causalmente en timestamp_ms con lo recibido hasta ahora."""
+        epoch = {}
+        for anchor_id, samples in self._history.get(tag_id, {}).items():
+            t1, v1 = samples[-1]
+            age = timestamp_ms - t1
+            if age < 0 or age > self.max_gap_ms:
+                continue
+            if len(samples) == 2:
+                t0, v0 = samples[0]
+                dt = t1 - t0
+                if 0 < dt <= self.max_gap_ms:
+                    epoch[anchor_id] = tuple(b + (b - a) / float(dt) * float(timestamp_ms - t1) for a, b in zip(v0, v1))
+                    continue
+            epoch[anchor_id] = v1
+        return epoch
@@ -0,0 +1,322 @@
+# http_collector.py
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import time
+
+from log_receiver_opt import EXPECTED_HEADER, LOG_DIR
+
+# --- Configuración ---
+DATA_PATH = "/data"           # Endpoint JSON del firmware (getDataJson en dw3000_wireless_opt.ino)
+MIN_INTERVAL_S = 0.05         # Intervalo mínimo de sondeo por tag (datos cambiando)
+MAX_INTERVAL_S = 2.0          # Intervalo máximo (tag parado o caído)
+MIN_TIMEOUT_S = 0.2
+MAX_TIMEOUT_S = 3.0
+TIMEOUT_RTT_FACTOR = 4.0      # Timeout = factor x RTT medio (acotado)
+MAX_IN_FLIGHT = 32            # Peticiones simultáneas máximas entre todos los tags
+FLUSH_INTERVAL_S = 0.2        # Cada cuánto se vuelcan a disco las líneas pendientes
+MILLIS_MASK = 0xFFFFFFFF      # Timestamp_ms imita el millis() uint32 del firmware (vuelve a 0 igual)
+
+
+class KeepAliveConnection:
+    """Conexión HTTP/1.1 persistente a un tag (el ESP32 mantiene el socket entre peticiones)."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.connects = 0
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        """GET path; devuelve (status, body bytes). Reabre la conexión si el servidor la cerró."""
+        for attempt in range(2):
+            if self.writer is None:
+                await self._connect()
+            try:
+                self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n\r\n".encode('ascii'))
+                await self.writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt == 1:
+                    raise
+        raise ConnectionError("Sin respuesta")
+
+    async def _read_response(self):
+        status_line = await self.reader.readuntil(b'\r\n')
+        parts = status_line.split(None, 2)
+        if len(parts) < 2:
+            raise ConnectionError(f"Línea de estado inválida: {status_line!r}")
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readuntil(b'\r\n')
+                    break
+                body += await self.reader.readexactly(size + 2)
+                del body[-2:]
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+            self.close()
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+
+def parse_data_json(tag_id, body, timestamp_ms):
+    """Convierte la respuesta de /data en {anchor_id: línea CSV} con el formato del receptor MQTT.
+
+    /data solo da la distancia filtrada (Kalman) y la potencia: se usa la misma distancia como cruda
+    y Anchor_Status = 1 si la distancia es > 0 (el firmware pone 0 cuando el ancla no responde).
+    """
+    data = json.loads(body)
+    lines = {}
+    for anchor in data.get('anchors', []):
+        anchor_id = int(anchor['id'])
+        dist = float(anchor.get('dist', 0.0))
+        rssi = float(anchor.get('rssi', -100.0))
+        status = 1 if dist > 0 else 0
+        lines[anchor_id] = (dist, rssi, f"{tag_id},{timestamp_ms},{anchor_id},{dist:.2f},{dist:.2f},{rssi:.2f},{status}")
+    return lines
+
+
+class TagPoller:
+    """Sondeo adaptativo de un tag.
+
+    - Si alguna ancla cambia, el intervalo se acorta (hasta MIN_INTERVAL_S); si no, se alarga.
+    - Tras un error se dobla el intervalo (hasta MAX_INTERVAL_S) y se reabre la conexión.
+    - El timeout sigue al RTT medio (media exponencial) del propio tag.
+    Solo se escriben las anclas cuya lectura cambió desde el sondeo anterior (una línea por medida).
+    /data no da el millis() del tag: Timestamp_ms son los ms (time.monotonic()) desde clock_start,
+    el arranque del recolector, con el mismo significado y tamaño que el millis() del receptor MQTT.
+    """
+
+    def __init__(self, tag_id, host, port, sink, semaphore, clock_start=None):
+        self.tag_id = tag_id
+        self.clock_start = time.monotonic() if clock_start is None else clock_start
+        self.connection = KeepAliveConnection(host, port)
+        self.sink = sink
+        self.semaphore = semaphore
+        self.interval = MIN_INTERVAL_S
+        self.rtt_ewma = None
+        self.last_values = {}
+        self.polls = 0
+        self.errors = 0
+        self.records = 0
+
+    @property
+    def timeout(self):
+        if self.rtt_ewma is None:
+            return MAX_TIMEOUT_S
+        return min(MAX_TIMEOUT_S, max(MIN_TIMEOUT_S, TIMEOUT_RTT_FACTOR * self.rtt_ewma))
+
+    def millis(self):
+        """ms desde clock_start como uint32, igual que millis() en el tag."""
+        return int((time.monotonic() - self.clock_start) * 1000) & MILLIS_MASK
+
+    async def poll_once(self):
+        async with self.semaphore:
+            start = time.perf_counter()
+            status, body = await asyncio.wait_for(self.connection.get(DATA_PATH), timeout=self.timeout)
+            rtt = time.perf_counter() - start
+        self.polls += 1
+        self.rtt_ewma = rtt if self.rtt_ewma is None else 0.8 * self.rtt_ewma + 0.2 * rtt
+        if status != 200:
+            raise ConnectionError(f"HTTP {status}")
+        changed = []
+        for anchor_id, (dist, rssi, line) in parse_data_json(self.tag_id, body, self.millis()).items():
+            if self.last_values.get(anchor_id) != (dist, rssi):
+                self.last_values[anchor_id] = (dist, rssi)
+                changed.append(line)
+        self.sink.extend(changed)
+        self.records += len(changed)
+        return bool(changed)
+
+    async def run(self):
+        while True:
+            try:
+                changed = await self.poll_once()
+                self.interval = max(MIN_INTERVAL_S, self.interval * 0.7) if changed else min(MAX_INTERVAL_S, self.interval * 1.25)
+            except (asyncio.TimeoutError, OSError, ValueError) as e:
+                self.errors += 1
+                self.connection.close()
+                self.interval = min(MAX_INTERVAL_S, self.interval * 2)
+                if self.errors == 1 or self.errors % 50 == 0:
+                    print(f"Advertencia: Tag {self.tag_id} ({self.connection.host}:{self.connection.port}): {e!r}")
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1)) # Jitter para no sincronizar tags
+
+
+class HttpCollector:
+    """Sondea /data de muchos tags a la vez y escribe las medidas en un log CSV como el del receptor MQTT."""
+
+    def __init__(self, tags, log_dir=LOG_DIR, max_in_flight=MAX_IN_FLIGHT):
+        self.tags = tags # {tag_id: (host, port)}
+        self.log_dir = log_dir
+        self.max_in_flight = max_in_flight
+        self.pending_lines = []
+        self.pollers = []
+        self.log_file = None
+        self.lines_written = 0
+
+    def _open_log(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        timestamp_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.log_file = os.path.join(self.log_dir, f"uwb_log_http_{timestamp_str}.csv")
+        handle = open(self.log_file, 'w')
+        handle.write(EXPECTED_HEADER + '\n')
+        handle.flush()
+        print(f"Opened new log file: {self.log_file}")
+        return handle
+
+    async def _flush_loop(self, handle):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_S)
+            self._flush(handle)
+
+    def _flush(self, handle):
+        if self.pending_lines:
+            lines = self.pending_lines[:]
+            del self.pending_lines[:] # Misma lista compartida con los TagPoller
+            handle.write(''.join(line + '\n' for line in lines))
+            handle.flush()
+            self.lines_written += len(lines)
+
+    async def run(self, duration=None):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        clock_start = time.monotonic() # Origen de Timestamp_ms (como el arranque del tag para millis())
+        self.pollers = [TagPoller(tag_id, host, port, self.pending_lines, semaphore, clock_start)
+                        for tag_id, (host, port) in sorted(self.tags.items())]
+        handle = self._open_log()
+        tasks = [asyncio.create_task(poller.run()) for poller in self.pollers]
+        tasks.append(asyncio.create_task(self._flush_loop(handle)))
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for poller in self.pollers:
+                poller.connection.close()
+            self._flush(handle)
+            handle.close()
+
+    def summary(self):
+        lines = [f"Líneas escritas: {self.lines_written} en {self.log_file}"]
+        for p in self.pollers:
+            rtt_ms = p.rtt_ewma * 1000 if p.rtt_ewma is not None else float('nan')
+            lines.append(f"  Tag {p.tag_id}: {p.polls} sondeos, {p.records} medidas, {p.errors} errores, "
+                         f"{p.connection.connects} conexiones, intervalo {p.interval * 1000:.0f} ms, RTT {rtt_ms:.1f} ms")
+        return '\n'.join(lines)
+
+
+# --- Tags emulados (servidor local de pruebas) ---
+
+async def start_emulated_tag(tag_id, port, host='127.0.0.1', anchor_ids=(10, 20, 30, 40), update_hz=20.0):
+    """Servidor HTTP keep-alive que imita /data de un tag moviéndose en círculo."""
+    anchors = {10: (0.0, 1.10), 20: (0.0, 4.55), 30: (3.45, 3.50), 40: (3.45, 0.66)}
+    start = time.monotonic()
+
+    def body():
+        t = math.floor((time.monotonic() - start) * update_hz) / update_hz # El tag solo mide a update_hz
+        x = 1.7 + math.cos(t + tag_id)
+        y = 2.5 + 1.5 * math.sin(t + tag_id)
+        doc = {'battery': 100.0, 'anchors': [], 'position': {'x': round(x, 3), 'y': round(y, 3)}}
+        for aid in anchor_ids:
+            ax, ay = anchors.get(aid, (0.0, 0.0))
+            doc['anchors'].append({'id': aid, 'dist': round(math.hypot(x - ax, y - ay) * 100, 2), 'rssi': -80.0})
+        return json.dumps(doc).encode('utf-8')
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                payload = body() if request.startswith(b'GET /data') else b'{}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: "
+                             + str(len(payload)).encode('ascii') + b"\r\n\r\n" + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass # Cliente desconectado o emulador cerrándose
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def run_emulated(num_tags, duration, log_dir, base_port=0):
+    servers = []
+    tags = {}
+    for i in range(num_tags):
+        server = await start_emulated_tag(i + 1, base_port + i if base_port else 0)
+        servers.append(server)
+        tags[i + 1] = ('127.0.0.1', server.sockets[0].getsockname()[1])
+    collector = HttpCollector(tags, log_dir=log_dir)
+    try:
+        await collector.run(duration)
+    finally:
+        for server in servers:
+            server.close()
+        await asyncio.sleep(0.1) # Dejar que los manejadores vean el cierre de las conexiones
+    return collector
+
+
+def parse_tag_arg(value):
+    """'ID=HOST[:PORT]' -> (id, (host, port))."""
+    tag_str, _, address = value.partition('=')
+    host, _, port = address.partition(':')
+    if not tag_str or not host:
+        raise argparse.ArgumentTypeError(f"Formato esperado ID=HOST[:PUERTO], recibido '{value}'")
+    return int(tag_str), (host, int(port) if port else 80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recolector asíncrono de /data de los tags (HTTP keep-alive).')
+    parser.add_argument('--tag', action='append', type=parse_tag_arg, default=[],
+                        help='Tag a sondear como ID=HOST[:PUERTO] (repetible), p. ej. --tag 1=192.168.1.50')
+    parser.add_argument('--log-dir', default=LOG_DIR)
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--duration', type=float, default=None, help='Segundos de captura (por defecto, hasta Ctrl+C).')
+    parser.add_argument('--emulate', type=int, default=0,
+                        help='Levanta N tags emulados en local y los sondea (prueba sin hardware).')
+    args = parser.parse_args()
+
+    if args.emulate:
+        collector = asyncio.run(run_emulated(args.emulate, args.duration or 10.0, args.log_dir))
+        print(collector.summary())
+    elif not args.tag:
+        parser.error("Indica al menos un --tag o usa --emulate N")
+    else:
+        collector = HttpCollector(dict(args.tag), log_dir=args.log_dir, max_in_flight=args.max_in_flight)
+        try:
+            asyncio.run(collector.run(args.duration))
+        except KeyboardInterrupt:
+            print("\nRecolector detenido por el usuario (Ctrl+C).")
+        print(collector.summary())
@@ -0,0 +1,195 @@
+# jitter_buffer.py
+import argparse
+import heapq
+import random
+import time
+from collections import deque
+
+from receiver_metrics import MetricsRegistry
+
+# --- Configuración ---
+DEFAULT_LATENCY_MS = 150   # Cuánto se retiene un registro esperando a los que lleguen desordenados
+RESET_GAP_MS = 10000       # Un timestamp tan anterior a lo ya liberado indica que el tag se reinició (millis())
+POLL_INTERVAL_S = 0.05     # Cada cuánto liberar por tiempo de espera cuando un tag deja de publicar
+
+
+class _TagState:
+    __slots__ = ('heap', 'max_ts', 'watermark', 'held_keys', 'released_keys', 'released_order')
+
+    def __init__(self):
+        self.heap = []               # (timestamp, anchor, seq, llegada, item)
+        self.max_ts = None           # Mayor timestamp recibido
+        self.watermark = None        # Timestamp del último registro liberado
+        self.held_keys = set()
+        self.released_keys = set()   # Claves liberadas recientemente (para distinguir duplicado de tardío)
+        self.released_order = deque()
+
+
+class JitterBuffer:
+    """Buffer de reordenación por tag con presupuesto de latencia.
+
+    Cada registro (tag, timestamp, ancla) se retiene hasta que el tag ha publicado algo
+    latency_ms más reciente o hasta que lleva latency_ms esperando en el host. Se liberan en
+    orden de timestamp por tag; los duplicados (misma clave) se descartan y los que llegan
+    después de haber liberado un timestamp posterior se cuentan como tardíos y se descartan.
+    No es thread-safe: quien lo comparta entre hilos debe protegerlo con un lock.
+    """
+
+    def __init__(self, latency_ms=DEFAULT_LATENCY_MS, registry=None, prefix='uwb', clock=time.monotonic):
+        self.latency_ms = latency_ms
+        self.latency_s = latency_ms / 1000.0
+        self.clock = clock
+        self.tags = {}
+        self._seq = 0
+        self.received = 0
+        self.released = 0
+        self.duplicates = 0
+        self.late_drops = 0
+        self.reordered = 0
+        self.resets = 0
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.duplicate_counter = r.counter(f'{prefix}_jitter_duplicates_total', 'Registros duplicados descartados.', ('tag',))
+        self.late_counter = r.counter(f'{prefix}_jitter_late_drops_total', 'Registros que llegaron tras el presupuesto de latencia.', ('tag',))
+        self.reordered_counter = r.counter(f'{prefix}_jitter_reordered_total', 'Registros llegados desordenados y reordenados.', ('tag',))
+        r.gauge(f'{prefix}_jitter_held_records', 'Registros retenidos en el buffer.', func=self.held)
+
+    def held(self):
+        return sum(len(state.heap) for state in self.tags.values())
+
+    def push(self, tag_id, timestamp_ms, anchor_id, item, now=None):
+        """Añade un registro. Devuelve la lista de items liberados (en orden de timestamp por tag)."""
+        now = self.clock() if now is None else now
+        state, released = self._insert(tag_id, timestamp_ms, anchor_id, item, now)
+        return released + self._release(state, now)
+
+    def push_many(self, tag_ids, timestamps_ms, anchor_ids, items, now=None):
+        """Añade un lote (p. ej. un lote binario) con una sola lectura del reloj y una liberación por tag.
+
+        Todos los registros del lote llegaron a la vez, así que liberar al final da el mismo orden
+        que push uno a uno.
+        """
+        now = self.clock() if now is None else now
+        released = []
+        touched = {}
+        for tag_id, timestamp_ms, anchor_id, item in zip(tag_ids, timestamps_ms, anchor_ids, items):
+            touched[tag_id], reset_released = self._insert(tag_id, timestamp_ms, anchor_id, item, now)
+            released.extend(reset_released)
+        for state in touched.values():
+            released.extend(self._release(state, now))
+        return released
+
+    def _insert(self, tag_id, timestamp_ms, anchor_id, item, now):
+        """Retiene un registro (o lo descarta si es duplicado o tardío). Devuelve (estado del tag, liberados por reinicio)."""
+        self.received += 1
+        state = self.tags.get(tag_id)
+        if state is None:
+            state = self.tags[tag_id] = _TagState()
+        key = (timestamp_ms, anchor_id)
+        released = []
+        if state.watermark is not None and timestamp_ms < state.watermark - RESET_GAP_MS:
+            # millis() ha vuelto atrás: nueva vida del tag. Se entrega lo retenido y se empieza de cero.
+            released.extend(self._pop_until(state, None))
+            self.tags[tag_id] = state = _TagState()
+            self.resets += 1
+        if key in state.held_keys or key in state.released_keys:
+            self.duplicates += 1
+            self.duplicate_counter.inc(tag=tag_id)
+            return state, released
+        if state.watermark is not None and timestamp_ms < state.watermark:
+            self.late_drops += 1
+            self.late_counter.inc(tag=tag_id)
+            return state, released
+        if state.max_ts is not None and timestamp_ms < state.max_ts:
+            self.reordered += 1
+            self.reordered_counter.inc(tag=tag_id)
+        state.max_ts = timestamp_ms if state.max_ts is None else max(state.max_ts, timestamp_ms)
+        heapq.heappush(state.heap, (timestamp_ms, anchor_id, self._seq, now, item))
+        self._seq += 1
+        state.held_keys.add(key)
+        return state, released
+
+    def poll(self, now=None):
+        """Libera lo que ha agotado su tiempo de espera en todos los tags (llamar periódicamente)."""
+        now = self.clock() if now is None else now
+        released = []
+        for state in self.tags.values():
+            if state.heap:
+                released.extend(self._release(state, now))
+        return released
+
+    def flush(self):
+        """Libera todo lo retenido (fin de sesión)."""
+        released = []
+        for state in self.tags.values():
+            released.extend(self._pop_until(state, None))
+        return released
+
+    def _release(self, state, now):
+        # Se libera hasta el mayor timestamp que ya no puede recibir predecesores a tiempo:
+        # el del propio tag menos el presupuesto, o el de cualquier registro que ya esperó demasiado.
+        cutoff = state.max_ts - self.latency_ms
+        expired_before = now - self.latency_s
+        for timestamp_ms, _, _, arrival, _ in state.heap:
+            if arrival <= expired_before and timestamp_ms > cutoff:
+                cutoff = timestamp_ms
+        return self._pop_until(state, cutoff)
+
+    def _pop_until(self, state, cutoff):
+        released = []
+        heap = state.heap
+        while heap and (cutoff is None or heap[0][0] <= cutoff):
+            timestamp_ms, anchor_id, _, _, item = heapq.heappop(heap)
+            key = (timestamp_ms, anchor_id)
+            state.held_keys.discard(key)
+            state.released_keys.add(key)
+            state.released_order.append(key)
+            state.watermark = timestamp_ms
+            released.append(item)
+        # Las claves liberadas solo hacen falta mientras un duplicado aún podría llegar
+        horizon = (state.watermark or 0) - 2 * self.latency_ms
+        while state.released_order and state.released_order[0][0] < horizon:
+            state.released_keys.discard(state.released_order.popleft())
+        self.released += len(released)
+        return released
+
+    def summary(self):
+        return (f"recibidos {self.received}, liberados {self.released}, duplicados {self.duplicates}, "
+                f"tardíos descartados {self.late_drops}, reordenados {self.reordered}, reinicios {self.resets}")
+
+
+def self_test(num_records=20000, latency_ms=DEFAULT_LATENCY_MS, num_tags=4, jitter_ms=80, dup_rate=0.05, seed=0):
+    """Simula llegadas con retraso aleatorio y duplicados y comprueba el orden de salida."""
+    rng = random.Random(seed)
+    arrivals = []
+    for i in range(num_records):
+        tag_id = i % num_tags + 1
+        timestamp_ms = 60000 + (i // num_tags) * 6
+        record = (tag_id, timestamp_ms, 10 * (i % 4 + 1))
+        # El tag publica en timestamp_ms; la red añade entre 0 y jitter_ms de retraso
+        arrivals.append(((timestamp_ms + rng.uniform(0, jitter_ms)) / 1000.0, record))
+        if rng.random() < dup_rate:
+            arrivals.append(((timestamp_ms + rng.uniform(0, jitter_ms)) / 1000.0, record))
+    arrivals.sort(key=lambda a: a[0])
+    buffer = JitterBuffer(latency_ms)
+    output = []
+    start = time.perf_counter()
+    for arrival, (tag_id, timestamp_ms, anchor_id) in arrivals:
+        output.extend(buffer.poll(arrival))
+        output.extend(buffer.push(tag_id, timestamp_ms, anchor_id, (tag_id, timestamp_ms, anchor_id), now=arrival))
+    output.extend(buffer.flush())
+    elapsed = time.perf_counter() - start
+    in_order = all(all(a[1] <= b[1] for a, b in zip(seq, seq[1:]))
+                   for seq in ([r for r in output if r[0] == t] for t in range(1, num_tags + 1)))
+    print(f"{len(arrivals)} llegadas en {elapsed:.3f} s ({len(arrivals) / elapsed:.0f} registros/s)")
+    print(f"  {buffer.summary()}")
+    print(f"  Salida: {len(output)} registros, {len(set(output))} únicos, ordenada por tag: {'sí' if in_order else 'NO'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Auto-test del buffer de reordenación por tag.')
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=int, default=DEFAULT_LATENCY_MS)
+    parser.add_argument('--network-jitter-ms', type=float, default=80, help='Retraso de red máximo simulado.')
+    args = parser.parse_args()
+    self_test(args.records, args.latency_ms, jitter_ms=args.network_jitter_ms)
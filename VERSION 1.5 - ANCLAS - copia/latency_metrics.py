@@ -0,0 +1,313 @@
+# latency_metrics.py
+import argparse
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from jitter_buffer import RESET_GAP_MS
+from receiver_metrics import MetricsRegistry
+from session_segments import MILLIS_WRAP, WRAP_MARGIN_MS
+
+# --- Configuración ---
+LATENCY_TOPIC_FMT = "uwb/latency/{}"        # Percentiles por etapa en JSON (uno por componente: receiver, engine)
+PROBE_TOPIC_FMT = "uwb/latency/probe/{}"    # Eco propio a través del broker (uno por cliente)
+PROBE_INTERVAL_S = 1.0                      # Cada cuánto se manda un eco al broker
+REPORT_INTERVAL_S = 5.0                     # Cada cuánto se publican los percentiles
+WINDOW_SAMPLES = 4096                       # Los percentiles se calculan sobre las últimas N muestras de cada etapa
+CLOCK_HALF_LIFE_S = 120.0                   # Memoria de la regresión de reloj (olvido exponencial, en tiempo del tag)
+MIN_FIT_SPAN_S = 30.0                       # Hasta tener tanta historia se asume deriva 0 (pendiente 1)
+FLOOR_WINDOW_S = 30.0                       # El camino más rápido (retardo mínimo) se busca en los últimos N s
+QUANTILES = (0.5, 0.9, 0.99)
+STAGE_RADIO_TO_BROKER = 'radio_to_broker'
+STAGE_BROKER_TO_RECEIVER = 'broker_to_receiver'
+STAGE_RECEIVER_TO_POSITION = 'receiver_to_position'
+STAGES = (STAGE_RADIO_TO_BROKER, STAGE_BROKER_TO_RECEIVER, STAGE_RECEIVER_TO_POSITION)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def arrival_time(msg):
+    """Instante (time.monotonic) en que paho leyó el mensaje del socket; ahora si no lo trae."""
+    return getattr(msg, 'timestamp', 0.0) or time.monotonic()
+
+
+class ClockSync:
+    """Offset y deriva del millis() de un tag respecto al reloj monotónico del host.
+
+    Regresión lineal en streaming llegada = a + b * millis con olvido exponencial (mínimos
+    cuadrados ponderados, CLOCK_HALF_LIFE_S de vida media): b - 1 es la deriva del cristal del tag.
+    El residuo de cada medida es su retardo respecto a la recta; su mínimo en FLOOR_WINDOW_S es el
+    camino más rápido. Sin relojes sincronizados el retardo absoluto tag->host no es observable:
+    update() devuelve el retardo por encima de ese mínimo (cola, reintentos Wi-Fi, broker).
+    Un salto atrás de millis() de más de RESET_GAP_MS (reinicio del tag) empieza de cero.
+    """
+
+    __slots__ = ('half_life_s', 'samples', 'resets', '_origin', '_last_ms', '_wraps', '_sums', '_floor',
+                 '_first_x', '_fit')
+
+    def __init__(self, half_life_s=CLOCK_HALF_LIFE_S):
+        self.half_life_s = half_life_s
+        self.samples = 0
+        self.resets = 0
+        self._origin = None
+
+    def _restart(self, device_ms, arrival_s):
+        self._origin = (device_ms, arrival_s)  # Se resta para que las sumas no pierdan precisión
+        self._last_ms = device_ms
+        self._wraps = 0
+        self._sums = [0.0, 0.0, 0.0, 0.0, 0.0]  # w, Σx, Σy, Σxx, Σxy
+        self._floor = deque()                   # (x, residuo) con residuos crecientes: mínimo deslizante
+        self._first_x = 0.0
+        self._fit = (0.0, 1.0)
+
+    def update(self, device_ms, arrival_s):
+        """Añade una medida (millis() del tag, llegada en segundos monotónicos). Devuelve el retardo extra (s)."""
+        if self._origin is None:
+            self._restart(device_ms, arrival_s)
+        elif device_ms < self._last_ms - RESET_GAP_MS:
+            if self._last_ms >= MILLIS_WRAP - WRAP_MARGIN_MS and device_ms < WRAP_MARGIN_MS:
+                self._wraps += 1 # Vuelta de millis(): mismo reloj
+            else:
+                self.resets += 1
+                self._restart(device_ms, arrival_s)
+        self._last_ms = device_ms
+        self.samples += 1
+        x = (device_ms + self._wraps * MILLIS_WRAP - self._origin[0]) / 1000.0
+        y = arrival_s - self._origin[1]
+
+        sums = self._sums
+        last_x = self._last_x()
+        decay = 0.5 ** ((x - last_x) / self.half_life_s) if x > last_x else 1.0
+        sums[:] = [sums[0] * decay + 1.0, sums[1] * decay + x, sums[2] * decay + y,
+                   sums[3] * decay + x * x, sums[4] * decay + x * y]
+        w, sx, sy, sxx, sxy = sums
+        slope = 1.0
+        if x - self._first_x >= MIN_FIT_SPAN_S:
+            var = w * sxx - sx * sx
+            if var > 0:
+                slope = (w * sxy - sx * sy) / var
+        intercept = (sy - slope * sx) / w
+        self._fit = (intercept, slope)
+        residual = y - (intercept + slope * x)
+
+        floor = self._floor
+        while floor and floor[-1][1] >= residual:
+            floor.pop()
+        floor.append((x, residual))
+        while floor[0][0] < x - FLOOR_WINDOW_S:
+            floor.popleft()
+        return max(residual - floor[0][1], 0.0)
+
+    def _last_x(self):
+        return self._floor[-1][0] if self._floor else 0.0
+
+    @property
+    def drift_ppm(self):
+        """Deriva del reloj del tag (ppm): positiva si el tag va más despacio que el host."""
+        return (self._fit[1] - 1.0) * 1e6 if self._origin is not None else 0.0
+
+    @property
+    def offset_s(self):
+        """Hora monotónica del host menos millis() del tag en la última medida (incluye el retardo mínimo)."""
+        if self._origin is None:
+            return 0.0
+        intercept, slope = self._fit
+        x = self._last_x()
+        floor = self._floor[0][1] if self._floor else 0.0
+        host = self._origin[1] + intercept + slope * x + floor
+        return host - (self._origin[0] / 1000.0 + x)
+
+
+class LatencyMonitor:
+    """Latencias por etapa (histograma Prometheus + percentiles recientes) y relojes de los tags.
+
+    Etapas: radio_to_broker (retardo extra tag -> host estimado con ClockSync), broker_to_receiver
+    (mitad del eco por el broker, BrokerProbe) y receiver_to_position (llegada -> posición publicada).
+    Es thread-safe: lo usan a la vez el callback de MQTT y los hilos del buffer de reordenación.
+    """
+
+    def __init__(self, registry=None, prefix='uwb', window=WINDOW_SAMPLES):
+        self.registry = registry or MetricsRegistry()
+        self.clocks = {}
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self._lock = threading.Lock()
+        r = self.registry
+        self.histogram = r.histogram(f'{prefix}_latency_seconds', 'Latencia por etapa del camino tag -> posición.',
+                                     LATENCY_BUCKETS, ('stage',))
+        self.quantile_gauge = r.gauge(f'{prefix}_latency_quantile_seconds',
+                                      f'Percentiles de las últimas {window} muestras por etapa.', ('stage', 'quantile'))
+        self.offset_gauge = r.gauge(f'{prefix}_clock_offset_seconds', 'Reloj monotónico del host menos millis() del tag.', ('tag',))
+        self.drift_gauge = r.gauge(f'{prefix}_clock_drift_ppm', 'Deriva estimada del reloj del tag (ppm).', ('tag',))
+
+    def observe(self, stage, seconds):
+        self.histogram.observe(seconds, stage=stage)
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def record_arrival(self, tag_id, device_ms, arrival_s):
+        """Medida recibida: actualiza el reloj del tag y observa radio_to_broker. Devuelve el retardo extra (s)."""
+        with self._lock:
+            clock = self.clocks.get(tag_id)
+            if clock is None:
+                clock = self.clocks[tag_id] = ClockSync()
+            excess = clock.update(device_ms, arrival_s)
+            self.samples[STAGE_RADIO_TO_BROKER].append(excess)
+        self.histogram.observe(excess, stage=STAGE_RADIO_TO_BROKER)
+        return excess
+
+    def record_arrivals(self, tag_ids, timestamps_ms, arrival_s):
+        """Lote binario: todas las medidas llegaron en el mismo mensaje."""
+        for tag_id, device_ms in zip(tag_ids, timestamps_ms):
+            self.record_arrival(tag_id, device_ms, arrival_s)
+
+    def snapshot(self):
+        """Percentiles por etapa y relojes por tag (dict serializable). Actualiza también los gauges."""
+        with self._lock:
+            stages = {stage: np.fromiter(values, dtype=float, count=len(values)) for stage, values in self.samples.items()}
+            clocks = {tag_id: {'offset_s': clock.offset_s, 'drift_ppm': clock.drift_ppm, 'samples': clock.samples,
+                               'resets': clock.resets} for tag_id, clock in self.clocks.items()}
+        report = {'stages': {}, 'clocks': {str(tag_id): info for tag_id, info in clocks.items()}}
+        for stage, values in stages.items():
+            if len(values) == 0:
+                continue
+            entry = {'count': int(len(values))}
+            for q, value in zip(QUANTILES, np.quantile(values, QUANTILES)):
+                entry[f'p{round(q * 100):d}'] = float(value)
+                self.quantile_gauge.set(float(value), stage=stage, quantile=str(q))
+            report['stages'][stage] = entry
+        for tag_id, info in clocks.items():
+            self.offset_gauge.set(info['offset_s'], tag=tag_id)
+            self.drift_gauge.set(info['drift_ppm'], tag=tag_id)
+        return report
+
+    def summary(self):
+        return format_report(self.snapshot())
+
+
+def format_report(report):
+    """Texto de una línea por etapa y por tag a partir de snapshot() (o del JSON publicado)."""
+    lines = []
+    for stage in STAGES:
+        entry = report['stages'].get(stage)
+        if entry:
+            percentiles = ', '.join(f"{k}={entry[k] * 1000:.1f} ms" for k in entry if k.startswith('p'))
+            lines.append(f"{stage}: {percentiles} ({entry['count']} muestras)")
+    for tag_id, info in sorted(report['clocks'].items()):
+        lines.append(f"tag {tag_id}: offset {info['offset_s']:.3f} s, deriva {info['drift_ppm']:+.1f} ppm "
+                     f"({info['samples']} medidas, {info['resets']} reinicios)")
+    return '\n'.join(lines) if lines else 'sin muestras'
+
+
+class BrokerProbe:
+    """Mide broker -> cliente con un eco: publica su reloj monotónico en un topic propio y espera la vuelta.
+
+    Un mismo reloj en los dos extremos hace que el RTT sea exacto; la etapa broker_to_receiver es RTT/2.
+    """
+
+    def __init__(self, client, client_name, monitor):
+        self.client = client
+        self.topic = PROBE_TOPIC_FMT.format(client_name)
+        self.monitor = monitor
+
+    def subscribe(self):
+        self.client.subscribe(self.topic)
+
+    def send(self):
+        self.client.publish(self.topic, repr(time.monotonic()))
+
+    def handle(self, msg, arrival_s):
+        """True si msg era nuestro eco (y ya está contado); False si es otro mensaje."""
+        if msg.topic != self.topic:
+            return False
+        try:
+            sent = float(msg.payload.decode('ascii'))
+        except ValueError:
+            return True
+        self.monitor.observe(STAGE_BROKER_TO_RECEIVER, max(arrival_s - sent, 0.0) / 2.0)
+        return True
+
+
+def start_latency_reporter(client, monitor, probe, component, report_interval_s=REPORT_INTERVAL_S):
+    """Hilo que manda un eco cada PROBE_INTERVAL_S y publica snapshot() en uwb/latency/<component>."""
+    topic = LATENCY_TOPIC_FMT.format(component)
+
+    def loop():
+        next_report = time.monotonic() + report_interval_s
+        while True:
+            time.sleep(PROBE_INTERVAL_S)
+            if not client.is_connected():
+                continue
+            probe.send()
+            if time.monotonic() >= next_report:
+                next_report += report_interval_s
+                client.publish(topic, json.dumps(monitor.snapshot()))
+
+    thread = threading.Thread(target=loop, name='latency-report', daemon=True)
+    thread.start()
+    return thread
+
+
+def watch(broker, port):
+    """Muestra los percentiles que publican el receptor y el motor (uwb/latency/<componente>)."""
+    import paho.mqtt.client as mqtt
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(LATENCY_TOPIC_FMT.format('+'))
+        print(f"Escuchando {LATENCY_TOPIC_FMT.format('+')} en {broker}:{port}")
+
+    def on_message(client, userdata, msg):
+        try:
+            report = json.loads(msg.payload)
+        except ValueError:
+            return
+        print(f"--- {msg.topic.rsplit('/', 1)[-1]} ({time.strftime('%H:%M:%S')}) ---")
+        print(format_report(report))
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker, port, 60)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def simulate(duration_s=600, rate_hz=50, drift_ppm=40.0, offset_s=1234.5, base_delay_s=0.004, jitter_s=0.008):
+    """Stream sintético con deriva, offset y retardos conocidos: comprueba ClockSync y el coste por medida."""
+    rng = np.random.default_rng(0)
+    n = int(duration_s * rate_hz)
+    device_ms = np.arange(n) * (1000 // rate_hz) + 5000
+    true_host = offset_s + device_ms / 1000.0 * (1 + drift_ppm * 1e-6)
+    excess = rng.exponential(jitter_s, n)
+    excess[rng.random(n) < 0.01] += 0.2 # Reintentos Wi-Fi ocasionales
+    arrivals = true_host + base_delay_s + excess
+    monitor = LatencyMonitor()
+    start = time.perf_counter()
+    measured = np.array([monitor.record_arrival(1, int(ms), float(t)) for ms, t in zip(device_ms, arrivals)])
+    elapsed = time.perf_counter() - start
+    clock = monitor.clocks[1]
+    tail = slice(n // 2, None) # Tras converger
+    error = measured[tail] - excess[tail]
+    print(f"{n} medidas en {elapsed * 1000:.0f} ms ({elapsed / n * 1e6:.1f} us/medida)")
+    real_offset = true_host[-1] + base_delay_s - device_ms[-1] / 1000.0 # Con la deriva acumulada y el retardo mínimo
+    print(f"Deriva: {clock.drift_ppm:+.1f} ppm (real {drift_ppm:+.1f}); offset: {clock.offset_s:.4f} s (real {real_offset:.4f} s)")
+    print(f"Retardo extra p50/p99: {np.median(measured[tail]) * 1000:.1f}/{np.quantile(measured[tail], 0.99) * 1000:.1f} ms "
+          f"(real {np.median(excess[tail]) * 1000:.1f}/{np.quantile(excess[tail], 0.99) * 1000:.1f} ms), "
+          f"error medio {np.mean(error) * 1000:+.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Latencias por etapa publicadas por el receptor y el motor en tiempo real.')
+    parser.add_argument('--broker', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--simulate', type=float, default=0, metavar='S',
+                        help='Comprueba la estimación de reloj con S segundos de medidas sintéticas (sin broker).')
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate(args.simulate)
+    else:
+        watch(args.broker, args.port)
@@ -0,0 +1,283 @@
+# live_dashboard.py
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from live_engine import BROKER_ADDRESS, BROKER_PORT, LOG_TOPIC, LivePositionEngine, load_engine_anchor_positions
+
+# --- Configuración ---
+HTTP_HOST = "0.0.0.0"
+HTTP_PORT = 8080
+MAX_FPS = 10                         # Frames por segundo máximos enviados a los navegadores
+POSITION_TOPIC = "uwb/tag/+/position" # Posiciones publicadas por live_engine.py
+CLIENT_QUEUE_SIZE = 32               # Frames pendientes por cliente antes de considerarlo lento
+KEEPALIVE_S = 15.0                   # Comentario SSE periódico para que proxies/navegador no corten
+COORD_DECIMALS = 3
+
+
+class PositionHub:
+    """Última posición de cada tag. Las actualizaciones entre dos frames se fusionan por tag."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {} # tag_id -> [x, y, z, timestamp_ms]
+        self._dirty = set()
+        self.updates_in = 0
+
+    def update(self, position):
+        """Recibe un dict como los de LivePositionEngine: tag_id, timestamp_ms, x, y, z."""
+        entry = [round(float(position['x']), COORD_DECIMALS), round(float(position['y']), COORD_DECIMALS),
+                 round(float(position.get('z', 0.0)), COORD_DECIMALS), int(position.get('timestamp_ms', 0))]
+        tag_id = str(position['tag_id'])
+        with self._lock:
+            self._latest[tag_id] = entry
+            self._dirty.add(tag_id)
+            self.updates_in += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._latest)
+
+    def take_delta(self):
+        """Tags que cambiaron desde el frame anterior (solo su último valor), o {} si ninguno."""
+        with self._lock:
+            delta = {tag_id: self._latest[tag_id] for tag_id in self._dirty}
+            self._dirty.clear()
+        return delta
+
+
+class DashboardBroadcaster:
+    """Envía a todos los clientes SSE un único delta por frame, a como mucho max_fps frames por segundo.
+
+    El mensaje se serializa una vez por frame y se comparte entre clientes; un cliente cuya cola se
+    llena (navegador lento) pierde sus frames pendientes y recibe una foto completa para resincronizarse.
+    """
+
+    def __init__(self, hub, max_fps=MAX_FPS):
+        self.hub = hub
+        self.frame_interval = 1.0 / max_fps
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.frames_out = 0
+        self.resyncs = 0
+
+    @staticmethod
+    def encode(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+    def snapshot_message(self):
+        return self.encode('snapshot', {'t': int(time.time() * 1000), 'tags': self.hub.snapshot()})
+
+    def add_client(self):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        client.put(self.snapshot_message())
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def remove_client(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def num_clients(self):
+        with self._lock:
+            return len(self._clients)
+
+    def _publish(self, message):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # Vaciar y resincronizar con el estado completo en vez de acumular retraso
+                while True:
+                    try:
+                        client.get_nowait()
+                    except queue.Empty:
+                        break
+                client.put_nowait(self.snapshot_message())
+                self.resyncs += 1
+
+    def run(self):
+        next_frame = time.perf_counter()
+        while not self._stop.is_set():
+            next_frame += self.frame_interval
+            delta = self.hub.take_delta()
+            if delta:
+                self._publish(self.encode('delta', {'t': int(time.time() * 1000), 'u': delta}))
+                self.frames_out += 1
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_frame = time.perf_counter() # Vamos tarde: no intentar recuperar frames
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='dashboard-frames', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>UWB en vivo</title>
+<style>body{font-family:sans-serif;margin:0;background:#f4f4f4}#info{padding:6px 10px}canvas{background:#fff;display:block;margin:0 auto}</style>
+</head><body><div id="info">Conectando...</div><canvas id="c" width="700" height="900"></canvas>
+<script>
+const cfg = __CONFIG__;
+const tags = {};
+const c = document.getElementById('c'), ctx = c.getContext('2d'), info = document.getElementById('info');
+const xs = cfg.anchors.map(a => a[1]), ys = cfg.anchors.map(a => a[2]);
+const minX = Math.min(...xs) - 0.5, maxX = Math.max(...xs) + 0.5, minY = Math.min(...ys) - 0.5, maxY = Math.max(...ys) + 0.5;
+const s = Math.min(c.width / (maxX - minX), c.height / (maxY - minY));
+const px = x => (x - minX) * s, py = y => c.height - (y - minY) * s;
+const colors = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#a65628'];
+let dirty = true;
+function draw() {
+  if (dirty) {
+    dirty = false;
+    ctx.clearRect(0, 0, c.width, c.height);
+    ctx.fillStyle = '#555';
+    for (const [id, x, y] of cfg.anchors) { ctx.fillRect(px(x) - 6, py(y) - 6, 12, 12); ctx.fillText(id, px(x) + 8, py(y) - 8); }
+    Object.keys(tags).sort().forEach((id, i) => {
+      const [x, y] = tags[id];
+      ctx.fillStyle = colors[i % colors.length];
+      ctx.beginPath(); ctx.arc(px(x), py(y), 8, 0, 2 * Math.PI); ctx.fill();
+      ctx.fillText('Tag ' + id, px(x) + 10, py(y) + 4);
+    });
+    info.textContent = Object.keys(tags).length + ' tags';
+  }
+  requestAnimationFrame(draw);
+}
+const es = new EventSource('/events');
+es.addEventListener('snapshot', e => { const m = JSON.parse(e.data); for (const k in tags) delete tags[k]; Object.assign(tags, m.tags); dirty = true; });
+es.addEventListener('delta', e => { Object.assign(tags, JSON.parse(e.data).u); dirty = true; });
+es.onerror = () => { info.textContent = 'Reconectando...'; };
+requestAnimationFrame(draw);
+</script></body></html>
+"""
+
+
+def start_dashboard_server(broadcaster, anchor_positions, host=HTTP_HOST, port=HTTP_PORT):
+    """Servidor HTTP en un hilo daemon: '/' (página), '/events' (SSE) y '/snapshot' (JSON)."""
+    config = {'anchors': [[aid, pos[0], pos[1]] for aid, pos in sorted(anchor_positions.items())],
+              'max_fps': round(1.0 / broadcaster.frame_interval, 1)}
+    page = DASHBOARD_HTML.replace('__CONFIG__', json.dumps(config)).encode('utf-8')
+
+    class _DashboardHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_body(self, content_type, body):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/':
+                self._send_body('text/html; charset=utf-8', page)
+            elif path == '/snapshot':
+                self._send_body('application/json', json.dumps(broadcaster.hub.snapshot()).encode('utf-8'))
+            elif path == '/events':
+                self._stream_events()
+            else:
+                self.send_error(404)
+
+        def _stream_events(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            client = broadcaster.add_client()
+            try:
+                while True:
+                    try:
+                        message = client.get(timeout=KEEPALIVE_S)
+                    except queue.Empty:
+                        message = b': keepalive\n\n'
+                    self.wfile.write(message)
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                broadcaster.remove_client(client)
+
+        def log_message(self, format, *args):
+            pass # Silenciar el log por petición
+
+    server = ThreadingHTTPServer((host, port), _DashboardHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='dashboard-http', daemon=True)
+    thread.start()
+    print(f"Panel en vivo en http://{host}:{server.server_address[1]}/ (máx. {config['max_fps']} fps)")
+    return server
+
+
+def run_mqtt_source(hub, broker, port, compute=False, anchor_positions=None):
+    """Alimenta el hub desde MQTT: posiciones de live_engine.py o, con compute=True, los logs crudos
+    calculando la posición en este mismo proceso."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(client_id=f"live-dashboard-{os.getpid()}-{time.time()}")
+    engine = LivePositionEngine(anchor_positions, on_position=hub.update) if compute else None
+    topic = LOG_TOPIC if compute else POSITION_TOPIC
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(topic)
+            print(f"Panel suscrito a {topic} en {broker}:{port}")
+        else:
+            print(f"Fallo al conectar, código de error: {rc}")
+
+    def on_message(client, userdata, msg):
+        try:
+            payload = msg.payload.decode("utf-8")
+            if engine is not None:
+                engine.process_payload(payload)
+            else:
+                hub.update(json.loads(payload))
+        except Exception as e:
+            print(f"Error procesando mensaje MQTT: {e}")
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker, port, 60)
+    client.loop_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Panel web en vivo: empuja las posiciones de todos los tags por SSE.')
+    parser.add_argument('--broker', default=BROKER_ADDRESS)
+    parser.add_argument('--port', type=int, default=BROKER_PORT)
+    parser.add_argument('--http-host', default=HTTP_HOST)
+    parser.add_argument('--http-port', type=int, default=HTTP_PORT)
+    parser.add_argument('--max-fps', type=float, default=MAX_FPS, help='Frames por segundo máximos hacia los navegadores.')
+    parser.add_argument('--compute', action='store_true',
+                        help=f'Calcular posiciones aquí a partir de {LOG_TOPIC} en vez de leer {POSITION_TOPIC}.')
+    args = parser.parse_args()
+
+    anchor_positions = load_engine_anchor_positions()
+    hub = PositionHub()
+    broadcaster = DashboardBroadcaster(hub, max_fps=args.max_fps)
+    broadcaster.start()
+    start_dashboard_server(broadcaster, anchor_positions, args.http_host, args.http_port)
+    try:
+        run_mqtt_source(hub, args.broker, args.port, compute=args.compute, anchor_positions=anchor_positions)
+    except KeyboardInterrupt:
+        print("\nPanel detenido por el usuario (Ctrl+C).")
+    finally:
+        broadcaster.stop()
+        print(f"Actualizaciones recibidas: {hub.updates_in}, frames enviados: {broadcaster.frames_out}, "
+              f"resincronizaciones: {broadcaster.resyncs}")
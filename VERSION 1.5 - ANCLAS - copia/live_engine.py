@@ -0,0 +1,234 @@
+# live_engine.py
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from binary_records import BINARY_TOPIC, decode_batch, is_binary_payload, records_to_tuples
+from epoch_alignment import DEFAULT_MAX_GAP_MS, StreamingEpochBuilder
+from jitter_buffer import DEFAULT_LATENCY_MS, POLL_INTERVAL_S, JitterBuffer
+from latency_metrics import (REPORT_INTERVAL_S, STAGE_RECEIVER_TO_POSITION, BrokerProbe, LatencyMonitor, arrival_time,
+                             start_latency_reporter)
+from receiver_metrics import MetricsRegistry, start_metrics_server
+from position_solvers import available_solvers, get_solver
+from anchor_selection import AnchorSelector
+from post_process_data import ANCHOR_CONFIG_FILE, load_anchor_map
+from session_segments import SessionState
+
+# --- Configuración ---
+BROKER_ADDRESS = "127.0.0.1"
+BROKER_PORT = 1883
+LOG_TOPIC = "uwb/tag/logs"                 # Topic donde los tags publican las medidas CSV
+POSITION_TOPIC_FMT = "uwb/tag/{}/position" # Topic donde se publican las posiciones calculadas
+NUM_LOG_FIELDS = 7                         # Tag_ID,Timestamp_ms,Anchor_ID,Raw,Filtered,Signal,Status
+MIN_DISTANCE_M = 0.01                      # Igual que process_uwb_log: distancias <= 1 cm no son válidas
+METRICS_HOST = "127.0.0.1"                 # Interfaz del endpoint de métricas (solo local)
+
+
+def parse_log_payload(payload_str):
+    """Convierte una línea CSV del tag en (tag_id, timestamp_ms, anchor_id, filtered_cm, rssi). None si no es válida."""
+    fields = payload_str.strip().split(',')
+    if len(fields) != NUM_LOG_FIELDS:
+        return None
+    try:
+        return int(fields[0]), int(fields[1]), int(fields[2]), float(fields[4]), float(fields[5])
+    except ValueError:
+        return None
+
+
+class LivePositionEngine:
+    """Calcula una posición por cada medida de rango recibida, alineando las anclas en tiempo real.
+
+    Las sesiones (reinicios del tag, huecos, vueltas de millis()) se siguen como en session_segments.py:
+    al empezar una sesión se borra la historia del tag y las anclas se alinean con el reloj desenrollado.
+    """
+
+    def __init__(self, anchor_positions, max_gap_ms=DEFAULT_MAX_GAP_MS, on_position=None, solver=None, max_anchors=None):
+        self.anchor_positions = {int(aid): list(pos) for aid, pos in anchor_positions.items()}
+        self.builder = StreamingEpochBuilder(max_gap_ms=max_gap_ms)
+        self.sessions = SessionState()
+        self.solver = get_solver(solver, ANCHOR_CONFIG_FILE) # Por nombre; None = field_settings.solver
+        # Como mucho K anclas por medida (None = field_settings.max_anchors, 0 = todas)
+        self.selector = AnchorSelector(self.anchor_positions, max_anchors, config_file=ANCHOR_CONFIG_FILE)
+        self.on_position = on_position
+        self.records_in = 0
+        self.positions_out = 0
+
+    def process_record(self, tag_id, timestamp_ms, anchor_id, distance_cm, rssi=np.nan):
+        """Procesa una medida y devuelve un dict con la posición (o None si no hay suficientes anclas)."""
+        self.records_in += 1
+        session_id, unwrapped_ms, reason = self.sessions.advance(tag_id, timestamp_ms)
+        if reason:
+            self.builder.reset(tag_id)
+        epoch = self.builder.add(tag_id, unwrapped_ms, anchor_id, (distance_cm, rssi))
+        responding_distances = {}
+        responding_rssi = {}
+        for aid, (dist_cm, signal) in epoch.items():
+            dist_m = dist_cm / 100.0
+            if aid in self.anchor_positions and dist_m > MIN_DISTANCE_M:
+                responding_distances[aid] = dist_m
+                responding_rssi[aid] = signal
+        if len(responding_distances) < 3:
+            return None
+        selected = self.selector.select_map(responding_distances, responding_rssi, tag_id)
+        responding_distances = {aid: d for aid, d in responding_distances.items() if aid in selected}
+        responding_positions = {aid: self.anchor_positions[aid] for aid in responding_distances}
+        pos_3d = self.solver.solve_map(responding_distances, responding_positions, tag_id=tag_id)
+        if pos_3d is None:
+            return None
+        position = {
+            'tag_id': tag_id,
+            'session_id': session_id,
+            'timestamp_ms': timestamp_ms,
+            'x': float(pos_3d[0]), 'y': float(pos_3d[1]), 'z': float(pos_3d[2]),
+            'anchors': len(responding_distances),
+        }
+        self.positions_out += 1
+        if self.on_position:
+            self.on_position(position)
+        return position
+
+    def process_payload(self, payload_str):
+        """Procesa una línea CSV tal como llega por MQTT."""
+        record = parse_log_payload(payload_str)
+        if record is None:
+            return None
+        return self.process_record(*record)
+
+
+def load_engine_anchor_positions(config_file=ANCHOR_CONFIG_FILE):
+    return load_anchor_map(config_file)
+
+
+def run_mqtt(engine, broker, port, jitter_ms=DEFAULT_LATENCY_MS, position_writer=None,
+             latency_report_s=REPORT_INTERVAL_S, registry=None):
+    """Suscribe el motor al topic de logs y publica cada posición en uwb/tag/<id>/position.
+
+    Con jitter_ms > 0 las medidas pasan antes por un JitterBuffer: llegan al motor en orden de
+    timestamp por tag y sin duplicados, a cambio de jitter_ms de latencia como mucho.
+    Con position_writer (sqlite_store.BatchWriter sobre 'positions') cada posición se guarda también.
+    Con latency_report_s > 0 se miden las latencias por etapa (latency_metrics.py), incluida la de
+    llegada -> posición publicada, y se publican en uwb/latency/engine cada latency_report_s.
+    """
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(client_id=f"live-engine-{os.getpid()}-{time.time()}")
+    jitter_buffer = JitterBuffer(jitter_ms, registry=registry, prefix='uwb_engine') if jitter_ms > 0 else None
+    jitter_lock = threading.Lock()
+    latency = LatencyMonitor(registry=registry, prefix='uwb_engine') if latency_report_s > 0 else None
+    probe = BrokerProbe(client, f"live-engine-{os.getpid()}", latency) if latency else None
+
+    def process_released(items):
+        # Cada item es (medida, llegada): la hora de llegada viaja con la medida por el buffer
+        for record, arrival in items:
+            if engine.process_record(*record) is not None and latency:
+                latency.observe(STAGE_RECEIVER_TO_POSITION, time.monotonic() - arrival)
+
+    def jitter_poll_loop():
+        while True:
+            time.sleep(POLL_INTERVAL_S)
+            with jitter_lock:
+                process_released(jitter_buffer.poll())
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(LOG_TOPIC)
+            client.subscribe(BINARY_TOPIC)
+            if probe:
+                probe.subscribe()
+            print(f"Motor en tiempo real suscrito a {LOG_TOPIC} y {BINARY_TOPIC} en {broker}:{port}")
+        else:
+            print(f"Fallo al conectar, código de error: {rc}")
+
+    def on_message(client, userdata, msg):
+        arrival = arrival_time(msg)
+        if probe and probe.handle(msg, arrival):
+            return
+        try:
+            if is_binary_payload(msg.payload):
+                records = records_to_tuples(decode_batch(msg.payload))
+            else:
+                record = parse_log_payload(msg.payload.decode("utf-8"))
+                records = [record] if record is not None else []
+            if latency:
+                for record in records:
+                    latency.record_arrival(record[0], record[1], arrival)
+            if jitter_buffer is None:
+                process_released([(record, arrival) for record in records])
+                return
+            with jitter_lock:
+                for record in records:
+                    process_released(jitter_buffer.push(record[0], record[1], record[2], (record, arrival)))
+        except Exception as e:
+            print(f"Error procesando mensaje MQTT: {e}")
+
+    def publish_position(position):
+        client.publish(POSITION_TOPIC_FMT.format(position['tag_id']), json.dumps(position))
+        if position_writer is not None:
+            position_writer.add([(position['tag_id'], position['timestamp_ms'], int(time.time() * 1000),
+                                  position['x'], position['y'], position['z'], position_writer.source_id)])
+
+    engine.on_position = publish_position
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker, port, 60)
+    if jitter_buffer is not None:
+        threading.Thread(target=jitter_poll_loop, name='jitter-poll', daemon=True).start()
+    if latency:
+        start_latency_reporter(client, latency, probe, 'engine', latency_report_s)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        print("\nMotor detenido por el usuario (Ctrl+C).")
+    finally:
+        if jitter_buffer is not None:
+            with jitter_lock:
+                process_released(jitter_buffer.flush())
+            print(f"Buffer de reordenación: {jitter_buffer.summary()}")
+        if latency:
+            print(f"Latencias:\n{latency.summary()}")
+        if position_writer is not None:
+            position_writer.flush()
+        client.disconnect()
+        print(f"Medidas procesadas: {engine.records_in}, posiciones publicadas: {engine.positions_out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Motor de posicionamiento en tiempo real (una posición por medida).')
+    parser.add_argument('--broker', default=BROKER_ADDRESS)
+    parser.add_argument('--port', type=int, default=BROKER_PORT)
+    parser.add_argument('--max-gap-ms', type=int, default=DEFAULT_MAX_GAP_MS,
+                        help='Antigüedad máxima (ms) de la última medida de un ancla para extrapolarla.')
+    parser.add_argument('--jitter-ms', type=int, default=DEFAULT_LATENCY_MS,
+                        help='Retención (ms) para reordenar por tag y quitar duplicados (0 para desactivar).')
+    parser.add_argument('--sqlite', default=None, metavar='DB', help='Guardar también las posiciones en una base SQLite.')
+    parser.add_argument('--solver', choices=available_solvers(), default=None,
+                        help='Solver de posición (position_solvers.py; por defecto field_settings.solver o multilateration_3d).')
+    parser.add_argument('--max-anchors', type=int, default=None,
+                        help='Anclas por medida como mucho, elegidas por DOP y señal (por defecto field_settings.max_anchors o 6; 0 = todas).')
+    parser.add_argument('--latency-report-s', type=float, default=REPORT_INTERVAL_S,
+                        help='Publicar percentiles de latencia por etapa en uwb/latency/engine cada N s (0 para no medir).')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Puerto del endpoint HTTP de métricas Prometheus (latencias y buffer; 0 para desactivar).')
+    args = parser.parse_args()
+
+    registry = None
+    if args.metrics_port:
+        registry = MetricsRegistry()
+        try:
+            start_metrics_server(registry, METRICS_HOST, args.metrics_port)
+        except OSError as e:
+            print(f"Advertencia: No se pudo iniciar el endpoint de métricas: {e}")
+
+    position_writer = None
+    if args.sqlite:
+        from sqlite_store import BatchWriter, UwbDatabase
+        db = UwbDatabase(args.sqlite)
+        position_writer = BatchWriter(db, 'positions', db.source_id(f"live_engine@{time.strftime('%Y-%m-%dT%H:%M:%S')}", 'live'))
+    engine = LivePositionEngine(load_engine_anchor_positions(), max_gap_ms=args.max_gap_ms, solver=args.solver,
+                                max_anchors=args.max_anchors)
+    run_mqtt(engine, args.broker, args.port, jitter_ms=args.jitter_ms, position_writer=position_writer,
+             latency_report_s=args.latency_report_s, registry=registry)
@@ -0,0 +1,349 @@
+# log_follower.py
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from compressed_logs import StreamDecompressor, compression_of, log_patterns, strip_log_suffix
+from epoch_alignment import DEFAULT_MAX_GAP_MS, StreamingEpochBuilder
+from live_engine import MIN_DISTANCE_M, load_engine_anchor_positions, parse_log_payload
+from position_solvers import available_solvers, get_solver
+from anchor_selection import AnchorSelector
+from post_process_data import ANCHOR_CONFIG_FILE
+from session_segments import SessionState
+
+# --- Configuración ---
+DEFAULT_PATTERN = os.path.join('uwb_logs_mqtt', 'uwb_log_*.csv') # Logs de log_receiver_opt.py (y http_collector.py), también .gz/.zst
+DEFAULT_CHECKPOINT = 'follow_checkpoint.json'
+PROCESSED_SUFFIX = '_processed.csv'
+POLL_INTERVAL_S = 1.0
+CHECKPOINT_VERSION = 2 # 2: sesiones (SessionID) en el estado
+
+
+class FollowedLog:
+    """Estado del seguimiento de un log crudo: offset en bytes, historia por ancla y epochs abiertos.
+
+    Cada medida se alinea causalmente con StreamingEpochBuilder. El epoch (tag, timestamp) se cierra
+    y se escribe cuando llega una medida posterior del mismo tag.
+    Cada registro pasa por SessionState (session_segments.py) como en el modo offline: al cambiar de
+    sesión (reinicio del tag o hueco) se cierra el epoch abierto y se borra la historia del tag.
+    Así las filas coinciden con post_process_data.py --epoch-mode causal aunque el archivo se lea a
+    trozos (en orden de llegada en vez de por timestamp; lo comprueba self_test, con un reinicio).
+    Los logs .csv.gz/.csv.zst se descomprimen de forma incremental; en ellos offset cuenta bytes de
+    texto descomprimido y raw_offset los bytes comprimidos leídos del disco.
+    """
+
+    def __init__(self, input_file, output_file, anchor_positions, max_gap_ms=DEFAULT_MAX_GAP_MS, solver=None,
+                 selector=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.anchor_positions = anchor_positions
+        self.solver = solver or get_solver(config_file=ANCHOR_CONFIG_FILE)
+        self.selector = selector or AnchorSelector(anchor_positions, config_file=ANCHOR_CONFIG_FILE)
+        self.anchor_ids = sorted(anchor_positions.keys())
+        self.builder = StreamingEpochBuilder(max_gap_ms=max_gap_ms)
+        self.offset = 0
+        self.compression = compression_of(input_file)
+        self.raw_offset = 0
+        self._decompressor = StreamDecompressor(self.compression) if self.compression else None
+        self._partial = b''
+        self.sessions = SessionState()
+        self.pending = {} # tag_id -> (timestamp (ms) desenrollado, SessionID) del epoch aún abierto
+        self.records_in = 0
+        self.rows_out = 0
+
+    def get_state(self):
+        return {'offset': self.offset, 'pending': {str(tag): list(epoch) for tag, epoch in self.pending.items()},
+                'history': self.builder.get_state(), 'sessions': self.sessions.get_state(), 'output_file': self.output_file}
+
+    def set_state(self, state):
+        self.offset = int(state.get('offset', 0))
+        if self.compression:
+            # El estado del descompresor no se guarda: se rehace desde el inicio saltando lo ya procesado
+            self.raw_offset = 0
+            self._decompressor = StreamDecompressor(self.compression, skip=self.offset)
+            self._partial = b''
+        self.pending = {int(tag): (int(ts), int(session_id)) for tag, (ts, session_id) in state.get('pending', {}).items()}
+        self.builder.set_state(state.get('history', {}))
+        self.sessions = SessionState.from_state(state.get('sessions', {}))
+
+    def _reset(self):
+        self.offset = 0
+        if self.compression:
+            self.raw_offset = 0
+            self._decompressor = StreamDecompressor(self.compression)
+            self._partial = b''
+        self.pending = {}
+        self.builder.reset()
+        self.sessions = SessionState()
+
+    def columns(self):
+        return (['Timestamp(ms)', 'TagID', 'SessionID'] + [f'FilteredDistance_{aid}' for aid in self.anchor_ids]
+                + [f'RSSI_{aid}' for aid in self.anchor_ids] + ['Position_X', 'Position_Y', 'Position_Z'])
+
+    def _epoch_row(self, tag_id, timestamp_ms, session_id):
+        """Fila de salida (formato de post_process_data) para el epoch causal de tag_id en timestamp_ms."""
+        epoch = self.builder.epoch_at(tag_id, timestamp_ms)
+        distances_cm = [epoch[aid][0] if aid in epoch else np.nan for aid in self.anchor_ids]
+        rssis = [epoch[aid][1] if aid in epoch else np.nan for aid in self.anchor_ids]
+        responding_distances = {}
+        for aid, dist_cm in zip(self.anchor_ids, distances_cm):
+            if not np.isnan(dist_cm) and dist_cm / 100.0 > MIN_DISTANCE_M:
+                responding_distances[aid] = dist_cm / 100.0
+        position = [np.nan, np.nan, np.nan]
+        if len(responding_distances) >= 3:
+            selected = self.selector.select_map(responding_distances, dict(zip(self.anchor_ids, rssis)), tag_id)
+            responding_positions = {aid: self.anchor_positions[aid] for aid in responding_distances if aid in selected}
+            responding_distances = {aid: responding_distances[aid] for aid in responding_positions}
+            pos_3d = self.solver.solve_map(responding_distances, responding_positions, tag_id=tag_id)
+            if pos_3d is not None:
+                position = list(pos_3d)
+        return [timestamp_ms, tag_id, session_id] + distances_cm + rssis + position
+
+    def _process_line(self, line, rows):
+        record = parse_log_payload(line)
+        if record is None:
+            return # Cabecera o línea inválida
+        tag_id, timestamp_ms, anchor_id, distance_cm, rssi = record
+        self.records_in += 1
+        session_id, timestamp_ms, _ = self.sessions.advance(tag_id, timestamp_ms)
+        open_ts, open_session = self.pending.get(tag_id, (None, None))
+        if open_ts is not None and open_session != session_id:
+            # Sesión nueva: se cierra la anterior y su historia no sirve para el nuevo reloj
+            rows.append(self._epoch_row(tag_id, open_ts, open_session))
+            self.builder.reset(tag_id)
+            open_ts = None
+        elif open_ts is not None and timestamp_ms > open_ts:
+            rows.append(self._epoch_row(tag_id, open_ts, session_id))
+        if open_ts is None or timestamp_ms >= open_ts:
+            self.pending[tag_id] = (timestamp_ms, session_id)
+        self.builder.add(tag_id, timestamp_ms, anchor_id, (distance_cm, rssi))
+
+    def poll(self):
+        """Procesa las líneas completas añadidas desde el último offset. Devuelve las filas nuevas."""
+        try:
+            size = os.path.getsize(self.input_file)
+        except FileNotFoundError:
+            return []
+        disk_offset = self.raw_offset if self.compression else self.offset
+        if size < disk_offset:
+            print(f"Advertencia: {self.input_file} se ha truncado o reemplazado. Se vuelve a procesar desde el inicio.")
+            self._reset()
+            disk_offset = 0
+        if size == disk_offset:
+            return []
+        with open(self.input_file, 'rb') as f:
+            f.seek(disk_offset)
+            chunk = f.read(size - disk_offset)
+        if self.compression:
+            self.raw_offset = size
+            chunk = self._partial + self._decompressor.feed(chunk)
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            if self.compression:
+                self._partial = chunk
+            return [] # Solo hay una línea a medio escribir
+        rows = []
+        for line in chunk[:end].decode('utf-8', errors='replace').splitlines():
+            self._process_line(line, rows)
+        self.offset += end + 1
+        if self.compression:
+            self._partial = chunk[end + 1:]
+        self._append_rows(rows)
+        return rows
+
+    def flush(self):
+        """Cierra los epochs abiertos (fin de sesión) y los escribe."""
+        rows = [self._epoch_row(tag_id, ts, session_id)
+                for tag_id, (ts, session_id) in sorted(self.pending.items(), key=lambda item: item[1])]
+        self.pending = {}
+        self._append_rows(rows)
+        return rows
+
+    def _append_rows(self, rows):
+        if not rows:
+            return
+        new_file = not os.path.exists(self.output_file) or os.path.getsize(self.output_file) == 0
+        with open(self.output_file, 'a') as f:
+            if new_file:
+                f.write(','.join(self.columns()) + '\n')
+            for row in rows:
+                f.write(','.join(_format_value(v) for v in row) + '\n')
+        self.rows_out += len(rows)
+
+
+def _format_value(value):
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    return '' if np.isnan(value) else f'{value:.4f}'
+
+
+class LogFollower:
+    """Sigue uno o varios logs crudos que crecen y añade posiciones a su archivo procesado.
+
+    Los patrones se vuelven a evaluar en cada pasada, así que los logs nuevos del receptor se
+    incorporan solos. Tras cada pasada se guarda el checkpoint (offsets + historia) de forma atómica.
+    """
+
+    def __init__(self, patterns, anchor_positions, checkpoint_file=DEFAULT_CHECKPOINT, output_dir=None,
+                 max_gap_ms=DEFAULT_MAX_GAP_MS, solver=None, max_anchors=None):
+        self.patterns = [expanded for pattern in patterns for expanded in log_patterns(pattern)]
+        self.anchor_positions = anchor_positions
+        self.solver = get_solver(solver, ANCHOR_CONFIG_FILE)
+        self.selector = AnchorSelector(anchor_positions, max_anchors, config_file=ANCHOR_CONFIG_FILE)
+        self.checkpoint_file = checkpoint_file
+        self.output_dir = output_dir
+        self.max_gap_ms = max_gap_ms
+        self.logs = {}
+        self._saved_states = self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_file):
+            return {}
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Advertencia: No se pudo leer el checkpoint {self.checkpoint_file} ({e}). Se empieza de cero.")
+            return {}
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('max_gap_ms') != self.max_gap_ms:
+            print("Advertencia: Checkpoint de otra versión o con otro max_gap_ms. Se empieza de cero.")
+            return {}
+        return checkpoint.get('files', {})
+
+    def save_checkpoint(self):
+        checkpoint = {'version': CHECKPOINT_VERSION, 'max_gap_ms': self.max_gap_ms,
+                      'files': {path: log.get_state() for path, log in self.logs.items()}}
+        tmp_path = self.checkpoint_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_file)
+
+    def output_path(self, input_file):
+        base = strip_log_suffix(os.path.basename(input_file)) + PROCESSED_SUFFIX
+        return os.path.join(self.output_dir or os.path.dirname(input_file), base)
+
+    def _discover(self):
+        for pattern in self.patterns:
+            for path in sorted(glob.glob(pattern)):
+                if path.endswith(PROCESSED_SUFFIX) or path in self.logs:
+                    continue
+                log = FollowedLog(path, self.output_path(path), self.anchor_positions, self.max_gap_ms, self.solver,
+                                  self.selector)
+                if path in self._saved_states:
+                    log.set_state(self._saved_states[path])
+                    print(f"Reanudando {path} desde el byte {log.offset}")
+                else:
+                    print(f"Siguiendo {path} -> {log.output_file}")
+                self.logs[path] = log
+
+    def poll_once(self):
+        """Una pasada sobre todos los logs. Devuelve el número de filas nuevas escritas."""
+        self._discover()
+        new_rows = sum(len(log.poll()) for log in self.logs.values())
+        self.save_checkpoint()
+        return new_rows
+
+    def flush(self):
+        new_rows = sum(len(log.flush()) for log in self.logs.values())
+        self.save_checkpoint()
+        return new_rows
+
+    def run(self, poll_interval=POLL_INTERVAL_S):
+        print(f"Modo seguimiento: {self.patterns} cada {poll_interval:.1f} s (Ctrl+C para salir)")
+        try:
+            while True:
+                start = time.perf_counter()
+                new_rows = self.poll_once()
+                if new_rows:
+                    print(f"{new_rows} posiciones nuevas ({time.perf_counter() - start:.2f} s)")
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("\nSeguimiento detenido por el usuario (Ctrl+C). Checkpoint guardado.")
+            self.save_checkpoint()
+
+
+def self_test(epochs_per_boot=150, chunk_lines=50, solver='fixed_height_2_5d', seed=0):
+    """Sigue a trozos un log sintético con un reinicio del tag y lo compara con el modo causal offline.
+
+    El log usa las anclas del config; entre trozo y trozo se crea un LogFollower nuevo, así que
+    también se prueba el checkpoint. El solver por defecto es el de altura fija: con las anclas a la
+    misma altura multilateration_3d está mal condicionado y amplifica diferencias de redondeo.
+    Devuelve True si las filas coinciden.
+    """
+    import pandas as pd
+    from post_process_data import process_uwb_log
+
+    anchor_positions = load_engine_anchor_positions()
+    anchor_ids = sorted(anchor_positions)
+    anchors = np.array([anchor_positions[aid] for aid in anchor_ids], dtype=np.float64)
+    low, high = anchors[:, :2].min(axis=0), anchors[:, :2].max(axis=0)
+    rng = np.random.default_rng(seed)
+    lines = ['Tag_ID,Timestamp_ms,Anchor_ID,Raw_Distance_cm,Filtered_Distance_cm,Signal_Power_dBm,Anchor_Status\n']
+    for boot_ms in (500000, 1000): # Segundo arranque: millis() vuelve a empezar
+        timestamp_ms = boot_ms
+        for e in range(epochs_per_boot):
+            xy = low + (high - low) * (0.5 + 0.3 * np.array([np.sin(e / 20), np.cos(e / 30)]))
+            for anchor_id, pos in zip(anchor_ids, anchors):
+                dist_cm = np.hypot(np.linalg.norm(xy - pos[:2]), pos[2]) * 100 + rng.normal(0, 3)
+                lines.append(f"1,{timestamp_ms},{anchor_id},{dist_cm:.2f},{dist_cm:.2f},{-60 - 20 * np.log10(dist_cm / 100):.2f},1\n")
+                timestamp_ms += 6
+            timestamp_ms += 26
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, 'uwb_log_selftest.csv')
+        checkpoint = os.path.join(tmp, DEFAULT_CHECKPOINT)
+        for start in range(0, len(lines), chunk_lines):
+            with open(raw_path, 'a') as f:
+                f.writelines(lines[start:start + chunk_lines])
+            follower = LogFollower([raw_path], anchor_positions, checkpoint_file=checkpoint, solver=solver)
+            follower.poll_once()
+        follower.flush()
+        offline_path = os.path.join(tmp, 'offline.csv')
+        process_uwb_log(raw_path, offline_path, epoch_mode='causal', solver_name=solver)
+        keys = ['SessionID', 'Timestamp(ms)']
+        followed = pd.read_csv(follower.output_path(raw_path)).sort_values(keys).reset_index(drop=True)
+        offline = pd.read_csv(offline_path).sort_values(keys).reset_index(drop=True)
+
+    same = list(followed.columns) == list(offline.columns) and followed.shape == offline.shape and np.allclose(
+        followed.to_numpy(dtype=np.float64), offline.to_numpy(dtype=np.float64), atol=1e-3, equal_nan=True)
+    per_session = followed.groupby('SessionID')['Position_X'].count().to_dict()
+    print(f"\nSeguimiento a trozos de {chunk_lines} líneas: {len(followed)} filas, posiciones por sesión {per_session}; "
+          f"offline causal: {len(offline)} filas. {'Coinciden.' if same else 'NO coinciden.'}")
+    return same
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Procesa incrementalmente logs UWB crudos mientras crecen.')
+    parser.add_argument('inputs', nargs='*', default=[DEFAULT_PATTERN],
+                        help=f'Archivos o patrones glob de logs crudos (por defecto {DEFAULT_PATTERN}).')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help='Archivo JSON con offsets y estado por ancla.')
+    parser.add_argument('--output-dir', default=None, help='Carpeta de salida (por defecto, junto a cada log).')
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL_S, help='Segundos entre pasadas.')
+    parser.add_argument('--max-gap-ms', type=int, default=DEFAULT_MAX_GAP_MS,
+                        help='Antigüedad máxima (ms) de la última medida de un ancla para extrapolarla.')
+    parser.add_argument('--solver', choices=available_solvers(), default=None,
+                        help='Solver de posición (position_solvers.py; por defecto field_settings.solver o multilateration_3d).')
+    parser.add_argument('--max-anchors', type=int, default=None,
+                        help='Anclas por epoch como mucho, elegidas por DOP y señal (por defecto field_settings.max_anchors o 6; 0 = todas).')
+    parser.add_argument('--once', action='store_true',
+                        help='Procesa lo pendiente, cierra los epochs abiertos y sale (sesión terminada).')
+    parser.add_argument('--self-test', action='store_true',
+                        help='Compara el seguimiento a trozos con post_process_data --epoch-mode causal en un log sintético con un reinicio.')
+    args = parser.parse_args()
+
+    if args.self_test:
+        raise SystemExit(0 if self_test() else 1)
+
+    follower = LogFollower(args.inputs, load_engine_anchor_positions(), checkpoint_file=args.checkpoint,
+                           output_dir=args.output_dir, max_gap_ms=args.max_gap_ms, solver=args.solver,
+                           max_anchors=args.max_anchors)
+    if args.once:
+        rows = follower.poll_once() + follower.flush()
+        print(f"{rows} posiciones escritas.")
+    else:
+        follower.run(args.poll)
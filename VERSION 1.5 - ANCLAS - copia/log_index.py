@@ -0,0 +1,411 @@
+# log_index.py
+import argparse
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from binary_records import BINARY_SUFFIX, FILE_MAGIC, RECORD_DTYPE, read_binary_log, records_to_frame
+from compressed_logs import compression_of
+from session_segments import MILLIS_WRAP, SessionState, segment_sessions
+from sqlite_store import log_start_ms, parse_time, session_host_offsets
+from uwb_loader import (DEFAULT_USECOLS, _detect_layout, coerce_raw_columns, drop_invalid_rows, load_raw_log,
+                        read_csv_typed, sort_by_tag_and_time)
+
+# --- Configuración ---
+INDEX_SUFFIX = '.idx.npz'     # El índice se guarda junto al log: uwb_log_x.csv -> uwb_log_x.csv.idx.npz
+INDEX_VERSION = 2             # Subir si cambia el formato del índice
+BLOCK_ROWS = 1024             # Filas por bloque del índice (granularidad de lectura)
+SCAN_CHUNK_BYTES = 8 << 20    # El escaneo inicial recorre el archivo en trozos de este tamaño
+HEAD_CHECK_BYTES = 64 << 10   # Bytes iniciales que se comparan para detectar que el archivo se sustituyó
+MAX_INT_DIGITS = 10           # millis() cabe en 10 dígitos (uint32)
+ENTRY_COLUMNS = ['block', 'tag', 'session', 'min_ts', 'max_ts', 'count']
+BOUNDARY_COLUMNS = ['offset', 'tag', 'session', 'wraps']
+
+
+def _parse_uints(data, begin, end):
+    """Enteros sin signo de los campos data[begin:end] (vectorizado); -1 si el campo no es un entero."""
+    width = end - begin
+    place = np.arange(MAX_INT_DIGITS)
+    inside = place < width[:, None]
+    positions = np.clip(end[:, None] - 1 - place, 0, len(data) - 1)
+    digits = data[positions].astype(np.int64) - 48
+    bad = (inside & ((digits < 0) | (digits > 9))).any(axis=1) | (width <= 0) | (width > MAX_INT_DIGITS)
+    values = (np.where(inside, digits, 0) * 10 ** place).sum(axis=1)
+    values[bad] = -1
+    return values
+
+
+def _scan_csv_lines(data, base):
+    """(offsets, tags, timestamps) de las líneas completas de data; base es su posición en el archivo.
+
+    Solo se miran los dos primeros campos (TagID y Timestamp). Las líneas cuyo TagID o Timestamp no
+    son enteros (cabecera, basura) devuelven -1 y no entran en el índice.
+    """
+    newlines = np.flatnonzero(data == 10)
+    starts = np.concatenate(([0], newlines[:-1] + 1)) if len(newlines) else np.zeros(0, dtype=np.int64)
+    commas = np.flatnonzero(data == 44)
+    if len(starts) == 0 or len(commas) < 2:
+        return base + starts, np.full(len(starts), -1), np.full(len(starts), -1)
+    first = np.minimum(np.searchsorted(commas, starts), len(commas) - 2)
+    c1, c2 = commas[first], commas[first + 1]
+    ok = (c1 >= starts) & (c2 < newlines)
+    tags = np.where(ok, _parse_uints(data, starts, c1), -1)
+    timestamps = np.where(ok, _parse_uints(data, c1 + 1, c2), -1)
+    return base + starts, tags, timestamps
+
+
+class LogIndex:
+    """Índice disperso por tiempo de un log crudo (.csv o .bin) para leer solo una ventana.
+
+    El archivo se divide en bloques de block_rows filas consecutivas; por bloque y sesión
+    (session_segments.py) se guarda el timestamp mínimo y máximo, y aparte el byte donde empieza
+    cada bloque y el de cada frontera de sesión. Como cada tag tiene su propio millis() y los tags
+    se intercalan, el orden solo existe dentro de cada sesión: una ventana [t0, t1] se resuelve con
+    los bloques cuyo [mín, máx] la corta. Si el log está casi ordenado son unos pocos bloques
+    contiguos; si hay desorden se leen más, pero el resultado siempre es correcto. Las filas leídas
+    reciben el mismo SessionID (y millis() desenrollado) que les daría load_raw_log con el archivo
+    entero. El índice se guarda junto al log y se amplía (no se rehace) cuando el receptor sigue escribiendo.
+    """
+
+    def __init__(self, path, block_rows=BLOCK_ROWS, save=True):
+        if compression_of(path):
+            raise ValueError(f"{path} está comprimido: no se puede leer por posición (usa read_log_window).")
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.block_rows = block_rows
+        self.binary = path.endswith(BINARY_SUFFIX)
+        if self.binary:
+            self.has_header, self.names = False, None
+            self.data_start = len(FILE_MAGIC) + 1
+        else:
+            self.has_header, self.names = _detect_layout(path)
+            self.data_start = self._header_length() if self.has_header else 0
+        self.block_offsets = np.array([self.data_start], dtype=np.int64)   # Inicio de cada bloque + fin indexado
+        self.entries = pd.DataFrame({col: np.zeros(0, np.int64) for col in ENTRY_COLUMNS})
+        # Filas donde empieza una sesión o millis() da la vuelta: (byte, tag, sesión, vueltas)
+        self.boundaries = pd.DataFrame({col: np.zeros(0, np.int64) for col in BOUNDARY_COLUMNS})
+        self._spans = None
+        self.loaded_from_disk = self._load()
+        if self.refresh() and save:
+            self.save()
+
+    def _header_length(self):
+        with open(self.path, 'rb') as f:
+            return len(f.readline())
+
+    @property
+    def indexed_bytes(self):
+        return int(self.block_offsets[-1])
+
+    def _head_digest(self, length):
+        with open(self.path, 'rb') as f:
+            return hashlib.sha256(f.read(length)).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path) as saved:
+                meta = saved['meta']
+                if (int(meta[0]) != INDEX_VERSION or int(meta[1]) != self.block_rows
+                        or int(meta[2]) != self.data_start or int(meta[3]) > os.path.getsize(self.path)
+                        or str(saved['head_digest']) != self._head_digest(int(meta[4]))):
+                    return False
+                self.block_offsets = saved['block_offsets']
+                self.entries = pd.DataFrame({col: saved[col] for col in ENTRY_COLUMNS})
+                self.boundaries = pd.DataFrame({col: saved['boundary_' + col] for col in BOUNDARY_COLUMNS})
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Advertencia: Índice {self.index_path} ilegible ({e}). Se reconstruye.")
+            return False
+        return True
+
+    def save(self):
+        head_length = min(HEAD_CHECK_BYTES, self.indexed_bytes)
+        meta = np.array([INDEX_VERSION, self.block_rows, self.data_start, self.indexed_bytes, head_length], dtype=np.int64)
+        tmp_path = self.index_path + '.tmp.npz'
+        np.savez(tmp_path, meta=meta, head_digest=np.array(self._head_digest(head_length)),
+                 block_offsets=self.block_offsets, **{col: self.entries[col].to_numpy() for col in ENTRY_COLUMNS},
+                 **{'boundary_' + col: self.boundaries[col].to_numpy() for col in BOUNDARY_COLUMNS})
+        os.replace(tmp_path, self.index_path)
+
+    def refresh(self):
+        """Indexa lo que se haya escrito desde la última vez. Devuelve True si el índice cambió."""
+        size = os.path.getsize(self.path)
+        if size <= self.indexed_bytes:
+            return False
+        # El último bloque puede estar a medias: se vuelve a indexar desde su inicio
+        last_block = max(len(self.block_offsets) - 2, 0)
+        offsets, tags, timestamps = self._scan(int(self.block_offsets[last_block]), size)
+        if len(offsets) == 0:
+            return False
+        row_end = offsets[-1] + self._row_length(offsets[-1])
+        if row_end == self.indexed_bytes:
+            return False # Solo se añadió una fila a medio escribir
+        block_starts = offsets[::self.block_rows]
+        blocks = last_block + np.arange(len(offsets)) // self.block_rows
+        valid = (tags >= 0) & (timestamps >= 0)
+        offsets, blocks, tags = offsets[valid], blocks[valid], tags[valid]
+        sessions, unwrapped, reasons, wrapped = segment_sessions(tags, timestamps[valid], self._session_state(last_block))
+        marks = (reasons > 0) | wrapped
+        new_boundaries = pd.DataFrame({'offset': offsets[marks], 'tag': tags[marks], 'session': sessions[marks],
+                                       'wraps': unwrapped[marks] // MILLIS_WRAP})
+        new_entries = (pd.DataFrame({'block': blocks, 'tag': tags, 'session': sessions, 'ts': unwrapped})
+                       .groupby(['block', 'tag', 'session'], sort=True)['ts'].agg(['min', 'max', 'count']).reset_index()
+                       .rename(columns={'min': 'min_ts', 'max': 'max_ts'}))
+        rescan_start = self.block_offsets[last_block]
+        self.block_offsets = np.concatenate((self.block_offsets[:last_block], block_starts, [row_end])).astype(np.int64)
+        self.entries = pd.concat([self.entries[self.entries['block'] < last_block], new_entries[ENTRY_COLUMNS].astype(np.int64)],
+                                 ignore_index=True)
+        self.boundaries = pd.concat([self.boundaries[self.boundaries['offset'] < rescan_start], new_boundaries.astype(np.int64)],
+                                    ignore_index=True)
+        self._spans = None
+        return True
+
+    def _session_state(self, block):
+        """Estado del segmentador al inicio de un bloque, a partir de lo ya indexado antes."""
+        kept = self.entries[self.entries['block'] < block]
+        if kept.empty:
+            return SessionState()
+        last = kept.sort_values(['block', 'session']).groupby('tag').last()
+        return SessionState({int(tag): (int(row.session), int(row.max_ts)) for tag, row in last.iterrows()},
+                            next_id=int(kept['session'].max()) + 1)
+
+    def _row_length(self, offset):
+        if self.binary:
+            return RECORD_DTYPE.itemsize
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return len(f.readline())
+
+    def _scan(self, start, size):
+        """(offsets, tags, timestamps) de las filas completas entre start y size."""
+        if self.binary:
+            records = read_binary_log(self.path)
+            first = (start - self.data_start) // RECORD_DTYPE.itemsize
+            rows = np.arange(first, len(records))
+            return (self.data_start + rows * RECORD_DTYPE.itemsize, records['tag_id'][first:].astype(np.int64),
+                    records['timestamp_ms'][first:].astype(np.int64))
+        buffer = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(size,))
+        parts = []
+        position = start
+        while position < size:
+            chunk = np.asarray(buffer[position:min(position + SCAN_CHUNK_BYTES, size)])
+            newlines = np.flatnonzero(chunk == 10)
+            if len(newlines) == 0:
+                break # Sin salto de línea: fila a medio escribir al final del archivo
+            chunk = chunk[:newlines[-1] + 1]
+            parts.append(_scan_csv_lines(chunk, position))
+            position += len(chunk)
+        if not parts:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    @property
+    def tag_ids(self):
+        return [int(t) for t in np.unique(self.entries['tag'])]
+
+    def session_spans(self):
+        """Por SessionID: tag y primer/último millis() (desenrollado)."""
+        if self._spans is None:
+            self._spans = self.entries.groupby('session', sort=True).agg(
+                {'tag': 'first', 'min_ts': 'min', 'max_ts': 'max'}).rename(columns={'min_ts': 'first', 'max_ts': 'last'})
+        return self._spans
+
+    def device_windows(self, tag_ids=None, start=None, end=None, clock='device'):
+        """{sesión: (t0, t1)} en millis() del tag para una ventana en hora del host o en millis()."""
+        return _device_windows(self.session_spans(), tag_ids, start, end, clock, self.path)
+
+    def byte_ranges(self, windows):
+        """Tramos [inicio, fin) del archivo que contienen todas las filas de las ventanas por sesión."""
+        entries = self.entries
+        selected = np.zeros(len(entries), dtype=bool)
+        for session_id, (t0, t1) in windows.items():
+            selected |= ((entries['session'] == session_id) & (entries['max_ts'] >= t0)
+                         & (entries['min_ts'] <= t1)).to_numpy()
+        blocks = np.unique(entries['block'].to_numpy()[selected])
+        if len(blocks) == 0:
+            return []
+        # Bloques consecutivos se leen de una vez
+        breaks = np.flatnonzero(np.diff(blocks) > 1)
+        firsts = np.concatenate(([blocks[0]], blocks[breaks + 1]))
+        lasts = np.concatenate((blocks[breaks], [blocks[-1]]))
+        return [(int(self.block_offsets[a]), int(self.block_offsets[b + 1])) for a, b in zip(firsts, lasts)]
+
+    def read_ranges(self, ranges, usecols=None):
+        """DataFrame (sin limpiar) con las filas de los tramos de bytes indicados."""
+        usecols = usecols or DEFAULT_USECOLS
+        if self.binary:
+            records = read_binary_log(self.path)
+            size = RECORD_DTYPE.itemsize
+            parts = [records[(a - self.data_start) // size:(b - self.data_start) // size] for a, b in ranges]
+            return records_to_frame(np.concatenate(parts) if parts else records[:0], usecols)
+        with open(self.path, 'rb') as f:
+            chunks = []
+            for start, stop in ranges:
+                f.seek(start)
+                chunks.append(f.read(stop - start))
+        return read_csv_typed(io.BytesIO(b''.join(chunks)), False, self.names, usecols)
+
+    def _label_sessions(self, df, start):
+        """SessionID y millis() desenrollado de filas leídas desde el byte start (sin fronteras dentro del tramo)."""
+        df = coerce_raw_columns(df)
+        # Las fronteras están en orden de byte: la última de cada tag antes de start manda
+        before = self.boundaries[self.boundaries['offset'] <= start]
+        latest = before.drop_duplicates('tag', keep='last').sort_values('tag')
+        boundary_tags = latest['tag'].to_numpy()
+        tags = df['TagID'].to_numpy().astype(np.int64)
+        where = np.minimum(np.searchsorted(boundary_tags, tags), max(len(boundary_tags) - 1, 0))
+        # Filas que el índice no reconoció (TagID/Timestamp no enteros) se descartan
+        known = boundary_tags[where] == tags if len(boundary_tags) else np.zeros(len(tags), dtype=bool)
+        where = where[known]
+        df = df[known]
+        return df.assign(**{'SessionID': latest['session'].to_numpy()[where].astype(np.int32),
+                            'Timestamp(ms)': df['Timestamp(ms)'].to_numpy() + latest['wraps'].to_numpy()[where] * MILLIS_WRAP})
+
+    def read_window(self, tag_ids=None, start=None, end=None, clock='device', usecols=None):
+        """Filas de la ventana, limpias, con SessionID y ordenadas por (TagID, SessionID, Timestamp) como load_raw_log."""
+        windows = self.device_windows(tag_ids, start, end, clock)
+        ranges = self.byte_ranges(windows)
+        if not ranges:
+            empty = records_to_frame(np.zeros(0, dtype=RECORD_DTYPE), usecols or DEFAULT_USECOLS)
+            return sort_by_tag_and_time(empty.assign(SessionID=np.zeros(0, np.int32)))
+        # Cada tramo se parte en las fronteras de sesión: dentro de un trozo, cada tag está en una sola sesión
+        cuts = np.unique(self.boundaries['offset'].to_numpy())
+        frames = []
+        for range_start, range_stop in ranges:
+            inner = cuts[(cuts > range_start) & (cuts < range_stop)].tolist()
+            edges = [range_start] + inner + [range_stop]
+            for piece_start, piece_stop in zip(edges[:-1], edges[1:]):
+                frames.append(self._label_sessions(self.read_ranges([(piece_start, piece_stop)], usecols), piece_start))
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return _filter_windows(drop_invalid_rows(df), windows)
+
+    def summary(self):
+        return (f"{self.path}: {len(self.block_offsets) - 1} bloques de {self.block_rows} filas, "
+                f"{len(self.tag_ids)} tags, {self.entries['session'].nunique()} sesiones, {self.indexed_bytes} bytes indexados")
+
+
+def _device_windows(spans, tag_ids, start, end, clock, path):
+    if clock not in ('host', 'device'):
+        raise ValueError(f"Reloj desconocido: {clock} (usa 'host' o 'device').")
+    start, end = parse_time(start), parse_time(end)
+    if tag_ids is not None:
+        spans = spans[spans['tag'].isin([int(t) for t in np.atleast_1d(tag_ids)])]
+    shift = pd.Series(0, index=spans.index)
+    if clock == 'host':
+        # Misma conversión que sqlite_store.estimate_host_ms: apertura del log + millis() desde el inicio
+        # de la sesión, con las sesiones de cada tag una detrás de otra
+        shift = spans['first'] - session_host_offsets(spans) - log_start_ms(path)
+    lo = -np.inf if start is None else start
+    hi = np.inf if end is None else end
+    return {int(session): (lo + s, hi + s) for session, s in shift.items()}
+
+
+def _filter_windows(df, windows):
+    if df.empty:
+        return sort_by_tag_and_time(df)
+    sessions = df['SessionID'].to_numpy()
+    timestamps = df['Timestamp(ms)'].to_numpy()
+    keep = np.zeros(len(df), dtype=bool)
+    for session_id, (t0, t1) in windows.items():
+        keep |= (sessions == session_id) & (timestamps >= t0) & (timestamps <= t1)
+    return sort_by_tag_and_time(df[keep])
+
+
+def read_log_window(path, tag_ids=None, start=None, end=None, clock='device', usecols=None):
+    """Ventana [start, end] de un log crudo: por índice si es .csv/.bin; leyendo todo si está comprimido.
+
+    clock='device' interpreta start/end como millis() del tag; clock='host' como hora del host
+    ('2025-05-04 17:05:00' o epoch ms), estimada con la hora de apertura del nombre del log.
+    """
+    if compression_of(path):
+        # gzip/zstd no permiten saltar a un byte: se descomprime todo y se filtra
+        df = load_raw_log(path, usecols=usecols)
+        spans = df.groupby('SessionID', sort=True).agg(tag=('TagID', 'first'), first=('Timestamp(ms)', 'min'),
+                                                       last=('Timestamp(ms)', 'max'))
+        return _filter_windows(df, _device_windows(spans.astype(np.int64), tag_ids, start, end, clock, path))
+    return LogIndex(path).read_window(tag_ids, start, end, clock, usecols)
+
+
+def _write_interleaved_log(path, minutes, num_tags=4, rate_hz=10, anchor_ids=(10, 20, 30, 40)):
+    """Log sintético como el del receptor: tags intercalados, cada uno con su millis() y algo de desorden."""
+    rng = np.random.default_rng(0)
+    epochs = int(minutes * 60 * rate_hz)
+    tag_offsets = rng.integers(10000, 500000, num_tags)
+    tags = np.tile(np.repeat(np.arange(1, num_tags + 1), len(anchor_ids)), epochs)
+    anchors = np.tile(np.array(anchor_ids), epochs * num_tags)
+    epoch = np.repeat(np.arange(epochs), num_tags * len(anchor_ids))
+    timestamps = tag_offsets[tags - 1] + epoch * (1000 // rate_hz) + rng.integers(0, 3, len(tags))
+    # Algunos registros llegan unos cientos de ms tarde (reordenados en el archivo)
+    late = rng.random(len(tags)) < 0.01
+    order = np.argsort(np.arange(len(tags)) + np.where(late, rng.integers(1, 200, len(tags)), 0), kind='stable')
+    filtered = rng.uniform(50, 600, len(tags))
+    df = pd.DataFrame({
+        'Tag_ID': tags, 'Timestamp_ms': timestamps, 'Anchor_ID': anchors,
+        'Raw_Distance_cm': (filtered + rng.normal(0, 3, len(tags))).round(2), 'Filtered_Distance_cm': filtered.round(2),
+        'Signal_Power_dBm': rng.uniform(-95, -60, len(tags)).round(2), 'Anchor_Status': 1,
+    }).iloc[order]
+    df.to_csv(path, index=False)
+    return tag_offsets
+
+
+def benchmark(minutes=90, clip_s=120):
+    """Compara leer un clip de clip_s segundos con el índice frente a cargar el log entero."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'uwb_log_20250504_170000.csv')
+        tag_offsets = _write_interleaved_log(path, minutes)
+        print(f"Log sintético: {minutes} min, {os.path.getsize(path) / 1e6:.1f} MB")
+        t0_ms = int(tag_offsets[0]) + (minutes * 60 // 2) * 1000
+        t1_ms = t0_ms + clip_s * 1000
+
+        start = time.perf_counter()
+        full = load_raw_log(path)
+        in_clip = (full['TagID'] == 1) & full['Timestamp(ms)'].between(t0_ms, t1_ms)
+        expected = full[in_clip]
+        t_full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = LogIndex(path)
+        t_build = time.perf_counter() - start
+        start = time.perf_counter()
+        index = LogIndex(path)
+        clip = index.read_window(1, t0_ms, t1_ms)
+        t_clip = time.perf_counter() - start
+        read_bytes = sum(b - a for a, b in index.byte_ranges(index.device_windows(1, t0_ms, t1_ms)))
+
+        same = clip.reset_index(drop=True).equals(expected.reset_index(drop=True))
+        print(f"  Carga completa + filtro: {t_full * 1000:.0f} ms ({len(full)} filas)")
+        print(f"  Construir índice (una vez): {t_build * 1000:.0f} ms -> {os.path.getsize(index.index_path) / 1e3:.1f} kB")
+        print(f"  Clip de {clip_s} s del tag 1 con índice: {t_clip * 1000:.1f} ms ({len(clip)} filas, "
+              f"{read_bytes / 1e6:.2f} MB leídos), idéntico a la carga completa: {'sí' if same else 'NO'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Índice por tiempo de logs crudos para leer solo una ventana.')
+    parser.add_argument('files', nargs='*', help='Logs .csv/.bin a indexar (o a leer con --from/--to).')
+    parser.add_argument('--tag', type=int, nargs='*', default=None)
+    parser.add_argument('--from', dest='start', default=None, help="Inicio (millis() del tag o, con --clock host, hora local/epoch ms).")
+    parser.add_argument('--to', dest='end', default=None, help='Fin (mismo formato que --from).')
+    parser.add_argument('--clock', choices=('host', 'device'), default='device')
+    parser.add_argument('--export', default=None, help='Guarda la ventana leída en este CSV.')
+    parser.add_argument('--benchmark', type=float, default=0, metavar='MIN', help='Mide un clip de 2 min sobre un log sintético de MIN minutos.')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    elif not args.files:
+        parser.error('Indica algún log o --benchmark.')
+    for path in args.files:
+        start = time.perf_counter()
+        if args.start is None and args.end is None and args.tag is None:
+            print(f"{LogIndex(path).summary()} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+            continue
+        df = read_log_window(path, args.tag, args.start, args.end, args.clock)
+        print(f"{path}: {len(df)} filas en la ventana ({(time.perf_counter() - start) * 1000:.1f} ms)")
+        if args.export:
+            df.to_csv(args.export, index=False)
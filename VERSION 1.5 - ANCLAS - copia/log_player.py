@@ -0,0 +1,221 @@
+# log_player.py
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from binary_records import BINARY_TOPIC, MAX_BATCH_RECORDS, encode_batch, pack_records
+from compressed_logs import log_patterns
+from live_engine import BROKER_ADDRESS, BROKER_PORT, LOG_TOPIC
+from session_segments import MILLIS_WRAP, add_session_columns
+from sqlite_store import estimate_host_ms
+from uwb_loader import coerce_raw_columns, drop_invalid_rows, read_raw_log
+
+# --- Configuración ---
+DEFAULT_PATTERN = os.path.join('uwb_logs_mqtt', 'uwb_log_*.csv')
+PLAYER_USECOLS = ['TagID', 'Timestamp(ms)', 'AnchorID', 'RawDistance(cm)', 'FilteredDistance(cm)', 'RSSI(dBm)', 'AnchorStatus']
+MAX_SLEEP_S = 0.05       # Nunca dormir más que esto seguido (para reaccionar a Ctrl+C y no pasarse de la hora)
+REPORT_INTERVAL_S = 5.0
+
+
+def firmware_payload(tag_id, timestamp_ms, anchor_id, raw_cm, filtered_cm, rssi, status):
+    """Misma línea que publica el tag (dataString en dw3000_wireless_opt.ino)."""
+    return f"{tag_id},{timestamp_ms},{anchor_id},{raw_cm:.2f},{filtered_cm:.2f},{rssi:.2f},{status}"
+
+
+def load_schedule(files, remap_tags=True):
+    """Carga los logs y devuelve (offsets_ms, payloads, records) ordenados por instante de publicación.
+
+    Cada tag tiene su propio reloj millis(), así que la línea de tiempo de cada (archivo, tag) se
+    alinea a 0 en su primera medida y todos los archivos se reproducen a la vez, como tags
+    concurrentes. Si un tag se reinició dentro del archivo, sus sesiones (session_segments.py) se
+    reproducen una detrás de otra con sus millis() originales, sin solaparse.
+    Si un TagID ya está en uso (de un archivo anterior) se le asigna el siguiente ID libre.
+    records son los mismos registros en formato binario (binary_records.RECORD_DTYPE).
+    """
+    offsets = []
+    payloads = []
+    records = []
+    used_tags = set()
+    for path in files:
+        try:
+            df = drop_invalid_rows(coerce_raw_columns(read_raw_log(path, usecols=PLAYER_USECOLS)))
+        except ValueError as e:
+            print(f"Advertencia: No se pudo leer {path} ({e}). Se omite.")
+            continue
+        if df.empty:
+            print(f"Advertencia: {path} no contiene medidas válidas. Se omite.")
+            continue
+        if 'RawDistance(cm)' not in df.columns:
+            df['RawDistance(cm)'] = df['FilteredDistance(cm)']
+        if 'RSSI(dBm)' not in df.columns:
+            df['RSSI(dBm)'] = 0.0
+        # Los logs anteriores no tienen Anchor_Status: lo que llegó al receptor respondió (1)
+        status = df['AnchorStatus'].astype(str).to_numpy() if 'AnchorStatus' in df.columns else np.full(len(df), '1')
+        df = add_session_columns(df)
+        tags = df['TagID'].to_numpy().astype(np.int64)
+        timestamps = df['Timestamp(ms)'].to_numpy() % MILLIS_WRAP # Lo que publicó el tag (sin desenrollar)
+        elapsed = estimate_host_ms(tags, df['Timestamp(ms)'].to_numpy(), 0, df['SessionID'].to_numpy())
+        for tag_id in np.unique(tags):
+            rows = np.flatnonzero(tags == tag_id)
+            out_tag = int(tag_id)
+            if remap_tags and out_tag in used_tags:
+                out_tag = max(used_tags) + 1
+                print(f"{path}: Tag {tag_id} ya está en uso, se reproduce como Tag {out_tag}")
+            used_tags.add(out_tag)
+            tag_ts = timestamps[rows]
+            offsets.append(elapsed[rows])
+            records.append(pack_records(out_tag, tag_ts, df['AnchorID'].to_numpy()[rows], df['RawDistance(cm)'].to_numpy()[rows],
+                                        df['FilteredDistance(cm)'].to_numpy()[rows], df['RSSI(dBm)'].to_numpy()[rows],
+                                        np.array([int(st) if st.isdigit() else 1 for st in status[rows]])))
+            payloads.extend(firmware_payload(out_tag, ts, aid, raw, filt, rssi, st) for ts, aid, raw, filt, rssi, st in zip(
+                tag_ts, df['AnchorID'].to_numpy()[rows], df['RawDistance(cm)'].to_numpy()[rows],
+                df['FilteredDistance(cm)'].to_numpy()[rows], df['RSSI(dBm)'].to_numpy()[rows], status[rows]))
+        print(f"{path}: {len(df)} medidas, {len(np.unique(tags))} tags")
+    if not payloads:
+        return np.zeros(0, dtype=np.int64), [], None
+    offsets = np.concatenate(offsets)
+    order = np.argsort(offsets, kind='stable')
+    return offsets[order], [payloads[i] for i in order], np.concatenate(records)[order]
+
+
+class LogPlayer:
+    """Publica el calendario a la velocidad pedida con un planificador de hora absoluta.
+
+    El instante objetivo de cada registro es start + offset / speed sobre time.perf_counter(), así el
+    retraso de un sleep o de un publish no se acumula (no hay deriva). Se publican de golpe todos los
+    registros cuya hora ya pasó. speed=0 publica lo más rápido posible. Con publish_batch, cada
+    grupo de registros vencidos se entrega de una vez como publish_batch(inicio, fin).
+    """
+
+    def __init__(self, offsets_ms, payloads, publish, speed=1.0, publish_batch=None):
+        self.offsets_s = np.asarray(offsets_ms, dtype=np.float64) / 1000.0
+        self.payloads = payloads
+        self.publish = publish
+        self.publish_batch = publish_batch
+        self.speed = speed
+        self.published = 0
+        self.lateness_s = np.zeros(len(payloads))
+
+    def play(self):
+        num_records = len(self.payloads)
+        start = time.perf_counter()
+        last_report = start
+        deadlines = start + self.offsets_s / self.speed if self.speed > 0 else np.full(num_records, start)
+        i = 0
+        while i < num_records:
+            now = time.perf_counter()
+            wait = deadlines[i] - now
+            if wait > 0:
+                time.sleep(min(wait, MAX_SLEEP_S))
+                continue
+            due = int(np.searchsorted(deadlines, now, side='right'))
+            if self.publish_batch is not None:
+                self.publish_batch(i, due)
+            else:
+                for j in range(i, due):
+                    self.publish(self.payloads[j])
+            self.lateness_s[i:due] = now - deadlines[i:due]
+            self.published = i = due
+            if now - last_report >= REPORT_INTERVAL_S:
+                print(f"  {i}/{num_records} publicados ({i / (now - start):.0f} msg/s)")
+                last_report = now
+        return time.perf_counter() - start
+
+    def summary(self, elapsed):
+        n = self.published
+        if n == 0:
+            return "No se publicó ningún registro."
+        session_s = self.offsets_s[n - 1]
+        late_ms = self.lateness_s[:n] * 1000.0
+        text = (f"{n} registros en {elapsed:.2f} s ({n / max(elapsed, 1e-9):.0f} msg/s, sesión de {session_s:.2f} s")
+        if self.speed > 0:
+            text += (f" a {self.speed:g}x). Retraso sobre el calendario: p50 {np.percentile(late_ms, 50):.2f} ms, "
+                     f"p99 {np.percentile(late_ms, 99):.2f} ms, máx {late_ms.max():.2f} ms")
+        else:
+            text += " a velocidad máxima)"
+        return text
+
+
+def expand_inputs(inputs):
+    files = []
+    for pattern in inputs:
+        matches = sorted(path for expanded in log_patterns(pattern) for path in glob.glob(expanded))
+        files.extend(path for path in matches if not path.endswith('_processed.csv'))
+    return files
+
+
+def mqtt_publisher(broker, port, topic, qos):
+    """Cliente MQTT con el bucle de red en un hilo; devuelve (publish, close). publish(payload, topic=None)."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(client_id=f"log-player-{os.getpid()}-{time.time()}")
+    client.max_queued_messages_set(0)
+    client.connect(broker, port, 60)
+    client.loop_start()
+    print(f"Publicando en {topic} de {broker}:{port} (QoS {qos})")
+
+    def publish(payload, to_topic=None):
+        client.publish(to_topic or topic, payload, qos=qos)
+
+    def close():
+        time.sleep(0.5) # Dejar que salga lo que quede en la cola de paho
+        client.loop_stop()
+        client.disconnect()
+
+    return publish, close
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reproduce sesiones grabadas publicándolas por MQTT con su cadencia original.')
+    parser.add_argument('inputs', nargs='*', default=[DEFAULT_PATTERN],
+                        help=f'Logs crudos o patrones glob (por defecto {DEFAULT_PATTERN}). Varios archivos se reproducen a la vez.')
+    parser.add_argument('--speed', type=float, default=1.0, help='Factor de velocidad (1 = tiempo real, 0 = lo más rápido posible).')
+    parser.add_argument('--max-speed', action='store_true', help='Equivale a --speed 0.')
+    parser.add_argument('--loop', type=int, default=1, help='Número de veces que se repite la sesión (0 = infinito).')
+    parser.add_argument('--keep-tag-ids', action='store_true', help='No renumerar tags repetidos entre archivos.')
+    parser.add_argument('--broker', default=BROKER_ADDRESS)
+    parser.add_argument('--port', type=int, default=BROKER_PORT)
+    parser.add_argument('--topic', default=LOG_TOPIC)
+    parser.add_argument('--qos', type=int, default=0, choices=(0, 1, 2))
+    parser.add_argument('--binary', action='store_true',
+                        help=f'Publica lotes binarios (binary_records.py) en {BINARY_TOPIC} en vez de líneas CSV.')
+    parser.add_argument('--dry-run', action='store_true', help='No conecta al broker: solo mide la precisión del planificador.')
+    args = parser.parse_args()
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        parser.error(f"Ningún archivo coincide con {args.inputs}")
+    offsets_ms, payloads, records = load_schedule(files, remap_tags=not args.keep_tag_ids)
+    if not payloads:
+        print("Nada que reproducir.")
+        exit(1)
+
+    if args.dry_run:
+        publish, close = (lambda payload, to_topic=None: None), (lambda: None)
+    else:
+        try:
+            publish, close = mqtt_publisher(args.broker, args.port, args.topic, args.qos)
+        except OSError as e:
+            print(f"Error: No se pudo conectar al broker MQTT ({args.broker}:{args.port}): {e}")
+            exit(1)
+    speed = 0.0 if args.max_speed else args.speed
+    publish_batch = None
+    if args.binary:
+        def publish_binary_batch(start, stop):
+            for chunk_start in range(start, stop, MAX_BATCH_RECORDS):
+                publish(encode_batch(records[chunk_start:min(stop, chunk_start + MAX_BATCH_RECORDS)]), BINARY_TOPIC)
+        publish_batch = publish_binary_batch
+    iteration = 0
+    try:
+        while args.loop == 0 or iteration < args.loop:
+            iteration += 1
+            player = LogPlayer(offsets_ms, payloads, publish, speed=speed, publish_batch=publish_batch)
+            elapsed = player.play()
+            print(f"Pasada {iteration}: {player.summary(elapsed)}")
+    except KeyboardInterrupt:
+        print("\nReproducción detenida por el usuario (Ctrl+C).")
+    finally:
+        close()
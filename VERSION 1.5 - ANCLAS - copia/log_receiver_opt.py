@@ -3,6 +3,16 @@ import paho.mqtt.client as mqtt
 import datetime
 import os
 import time
+import argparse
+import threading
+import numpy as np
+from binary_records import (BINARY_SUFFIX, BINARY_TOPIC, RECORD_DTYPE, decode_batch, is_binary_payload,
+                            open_binary_log, record_payload_bytes)
+from compressed_logs import COMPRESSIONS, open_log_writer, strip_log_suffix
+from jitter_buffer import DEFAULT_LATENCY_MS, POLL_INTERVAL_S, JitterBuffer
+from latency_metrics import REPORT_INTERVAL_S, BrokerProbe, LatencyMonitor, arrival_time, start_latency_reporter
+from receiver_metrics import ReceiverMetrics, start_metrics_server
+from sqlite_store import BatchWriter, UwbDatabase, binary_records_to_range_rows, csv_lines_to_range_rows
 
 # --- Configuración ---
 BROKER_ADDRESS = "127.0.0.1"  # IP del broker MQTT (tu PC, localhost)
@@ -10,15 +20,94 @@ BROKER_PORT = 1883
 LOG_TOPIC = "uwb/tag/logs"    # Topic donde los tags publican los logs
 LOG_DIR = "uwb_logs_mqtt"     # Directorio para guardar logs (diferente para evitar mezclar)
 EXPECTED_HEADER = "Tag_ID,Timestamp_ms,Anchor_ID,Raw_Distance_cm,Filtered_Distance_cm,Signal_Power_dBm,Anchor_Status" # Mantener el formato CSV esperado
+METRICS_HOST = "127.0.0.1"    # Interfaz del endpoint de métricas (solo local)
+# Extras opcionales: desactivados por defecto para que el receptor escriba igual que siempre
+METRICS_PORT = 0              # Puerto del endpoint /metrics (0 = desactivado; p. ej. 9108)
+COMPRESSION = None            # None, 'gzip' o 'zstd' (compressed_logs.py)
+ROTATE_MINUTES = 0            # Abrir un archivo nuevo cada N minutos (0 = un archivo por ejecución)
+JITTER_MS = 0                 # Buffer de reordenación por tag (0 = orden de llegada; p. ej. DEFAULT_LATENCY_MS)
+LATENCY_REPORT_S = 0          # Cada cuánto publicar latencias en uwb/latency/receiver (0 = no medir; p. ej. REPORT_INTERVAL_S)
 
 # -- Variables Globales --
 current_log_file = None
 log_file_handle = None
+binary_log_file = None
+binary_log_handle = None
+log_opened_at = None
 client = None
+metrics = None
+jitter_buffer = None
+sqlite_writer = None
+latency = None
+latency_probe = None
+jitter_lock = threading.Lock()
+
+def current_log_file_size():
+    """Tamaño actual (bytes) del archivo de log abierto, para el endpoint de métricas."""
+    # Se consulta desde el hilo HTTP: usar el tamaño en disco (escribimos con flush) en vez de tell()
+    if current_log_file and os.path.exists(current_log_file):
+        return os.path.getsize(current_log_file)
+    return None
+
+def write_log_lines(lines):
+    """Escribe un lote de líneas CSV en el log abierto y registra tamaño de lote y latencia."""
+    t0 = time.perf_counter()
+    log_file_handle.write(''.join(line + '\n' for line in lines))
+    log_file_handle.flush() # Forzar escritura a disco (los comprimidos vacían como mucho 1 vez/s)
+    if metrics:
+        metrics.record_write(len(lines), time.perf_counter() - t0)
+    if sqlite_writer:
+        sqlite_writer.add(csv_lines_to_range_rows(lines, int(time.time() * 1000), sqlite_writer.source_id))
+    rotate_if_due()
+
+def rotate_if_due():
+    """Abre un archivo nuevo si el actual lleva ROTATE_MINUTES abierto."""
+    if ROTATE_MINUTES > 0 and log_opened_at is not None and time.monotonic() - log_opened_at >= ROTATE_MINUTES * 60:
+        create_log_directory_and_file()
+
+def write_binary_records(data):
+    """Añade registros binarios tal cual al log .bin de la sesión (se abre con el primer lote)."""
+    global binary_log_file, binary_log_handle
+    if binary_log_handle is None or binary_log_handle.closed:
+        binary_log_file = strip_log_suffix(current_log_file) + BINARY_SUFFIX
+        binary_log_handle = open_binary_log(binary_log_file)
+        print(f"Opened new binary log file: {binary_log_file}")
+    t0 = time.perf_counter()
+    binary_log_handle.write(data)
+    binary_log_handle.flush()
+    if metrics:
+        metrics.record_write(len(data) // RECORD_DTYPE.itemsize, time.perf_counter() - t0)
+    if sqlite_writer:
+        records = np.frombuffer(data, dtype=RECORD_DTYPE)
+        sqlite_writer.add(binary_records_to_range_rows(records, int(time.time() * 1000), sqlite_writer.source_id))
+    rotate_if_due()
+
+def write_released(items):
+    """Escribe lo liberado por el buffer de reordenación (líneas CSV o registros binarios),
+    reabriendo el log si se cerró."""
+    if not items:
+        return
+    if not log_file_handle or log_file_handle.closed:
+        print("Advertencia: Registros liberados pero el archivo de log no está abierto.")
+        create_log_directory_and_file()
+    if not log_file_handle or log_file_handle.closed:
+        return
+    lines = [item for item in items if isinstance(item, str)]
+    if lines:
+        write_log_lines(lines)
+    if len(lines) < len(items):
+        write_binary_records(b''.join(item for item in items if not isinstance(item, str)))
+
+def jitter_poll_loop():
+    """Libera periódicamente los registros retenidos de tags que han dejado de publicar."""
+    while True:
+        time.sleep(POLL_INTERVAL_S)
+        with jitter_lock:
+            write_released(jitter_buffer.poll())
 
 def create_log_directory_and_file():
     """Crea el directorio de logs si no existe y abre un nuevo archivo CSV con timestamp."""
-    global current_log_file, log_file_handle
+    global current_log_file, log_file_handle, binary_log_handle, log_opened_at
     try:
         if not os.path.exists(LOG_DIR):
             os.makedirs(LOG_DIR)
@@ -28,15 +117,25 @@ def create_log_directory_and_file():
         if log_file_handle and not log_file_handle.closed:
             log_file_handle.close()
             print(f"Closed previous log file: {current_log_file}")
+        if binary_log_handle and not binary_log_handle.closed:
+            binary_log_handle.close()
+            print(f"Closed previous binary log file: {binary_log_file}")
+        binary_log_handle = None
 
         # Generar nombre único y abrir nuevo archivo
         timestamp_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"uwb_log_{timestamp_str}.csv"
+        suffix = ".csv" + (COMPRESSIONS[COMPRESSION] if COMPRESSION else "")
+        filename = f"uwb_log_{timestamp_str}{suffix}"
         current_log_file = os.path.join(LOG_DIR, filename)
+        counter = 1
+        while os.path.exists(current_log_file): # Rotación dentro del mismo segundo
+            current_log_file = os.path.join(LOG_DIR, f"uwb_log_{timestamp_str}_{counter}{suffix}")
+            counter += 1
 
-        log_file_handle = open(current_log_file, 'w') 
+        log_file_handle = open_log_writer(current_log_file, COMPRESSION)
         log_file_handle.write(EXPECTED_HEADER + '\n') 
         log_file_handle.flush() # Asegurar que se escriba inmediatamente
+        log_opened_at = time.monotonic()
         print(f"Opened new log file: {current_log_file}")
 
     except Exception as e:
@@ -52,36 +151,82 @@ def on_connect(client, userdata, flags, rc):
         log_topic = "uwb/tag/logs" # <<< CORRECT TOPIC
         client.subscribe(log_topic)
         print(f"Suscrito al topic: {log_topic}")
+        client.subscribe(BINARY_TOPIC) # Lotes binarios (binary_records.py)
+        print(f"Suscrito al topic: {BINARY_TOPIC}")
+        if latency_probe:
+            latency_probe.subscribe() # Eco propio para medir broker -> receptor
     else:
         print(f"Fallo al conectar, código de error: {rc}")
 
+def handle_binary_batch(payload, arrival):
+    """Lote binario: se decodifica de una vez y se guarda tal cual en el log .bin."""
+    records = decode_batch(payload)
+    if latency:
+        latency.record_arrivals(records['tag_id'].tolist(), records['timestamp_ms'].tolist(), arrival)
+    if metrics:
+        tag_ids, counts = np.unique(records['tag_id'], return_counts=True)
+        for tag_id, count in zip(tag_ids.tolist(), counts.tolist()):
+            metrics.record_valid(str(tag_id), count)
+    if not log_file_handle or log_file_handle.closed:
+        print("Advertencia: Lote binario recibido pero el archivo de log no está abierto.")
+        create_log_directory_and_file()
+    if jitter_buffer is not None:
+        # Cada registro viaja como una vista de sus bytes dentro del lote (sin copias ni arrays de 1 fila)
+        data = record_payload_bytes(payload)
+        size = RECORD_DTYPE.itemsize
+        items = [data[offset:offset + size] for offset in range(0, len(records) * size, size)]
+        with jitter_lock:
+            write_released(jitter_buffer.push_many(records['tag_id'].tolist(), records['timestamp_ms'].tolist(),
+                                                   records['anchor_id'].tolist(), items))
+    elif log_file_handle and not log_file_handle.closed:
+        write_binary_records(record_payload_bytes(payload))
+
 def on_message(client, userdata, msg):
     """Callback que se ejecuta cuando se recibe un mensaje en un topic suscrito."""
-    global log_file_handle
     payload_str = ""
+    arrival = arrival_time(msg) # Hora monotónica de llegada, antes de cualquier proceso
+    if latency_probe and latency_probe.handle(msg, arrival):
+        return
+    if metrics:
+        metrics.record_message(msg.topic)
     try:
+        if is_binary_payload(msg.payload):
+            handle_binary_batch(msg.payload, arrival)
+            return
         # Decodificar el mensaje (payload)
         payload_str = msg.payload.decode("utf-8")
         # print(f"Mensaje recibido en [{msg.topic}]: {payload_str}") # Descomentar para debug
 
         # Validar que el payload no esté vacío y tenga el formato esperado (N columnas)
         if payload_str and len(payload_str.split(',')) == len(EXPECTED_HEADER.split(',')):
+            if metrics:
+                metrics.record_valid(payload_str.split(',', 1)[0])
+            if latency:
+                fields = payload_str.split(',', 2)
+                latency.record_arrival(int(fields[0]), int(fields[1]), arrival)
+            if jitter_buffer is not None:
+                # Reordenar por tag y descartar duplicados antes de escribir
+                fields = payload_str.split(',', 3)
+                with jitter_lock:
+                    write_released(jitter_buffer.push(int(fields[0]), int(fields[1]), int(fields[2]), payload_str))
             # Escribir en el archivo CSV si está abierto
-            if log_file_handle and not log_file_handle.closed:
-                log_file_handle.write(payload_str + '\n')
-                log_file_handle.flush() # Forzar escritura a disco
+            elif log_file_handle and not log_file_handle.closed:
+                write_log_lines([payload_str])
             else:
                 print("Advertencia: Mensaje MQTT recibido pero el archivo de log no está abierto.")
                 # Intentar reabrir el archivo si se cerró inesperadamente
                 create_log_directory_and_file()
                 if log_file_handle and not log_file_handle.closed:
-                     log_file_handle.write(payload_str + '\n')
-                     log_file_handle.flush()
+                     write_log_lines([payload_str])
 
         else:
+            if metrics:
+                metrics.record_invalid(msg.topic)
             print(f"Advertencia: Payload inválido o vacío recibido en [{msg.topic}]: '{payload_str}'")
 
     except Exception as e:
+        if metrics:
+            metrics.record_error()
         print(f"Error procesando mensaje MQTT: {e}")
         print(f"Payload problemático: {payload_str}")
 
@@ -111,7 +256,47 @@ def setup_mqtt_client():
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Receptor de logs UWB vía MQTT.')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='Puerto del endpoint HTTP de métricas Prometheus, p. ej. 9108 (por defecto 0: desactivado).')
+    parser.add_argument('--compress', choices=sorted(COMPRESSIONS), default=COMPRESSION,
+                        help='Escribir los logs comprimidos (.csv.gz / .csv.zst; zstd necesita el paquete zstandard).')
+    parser.add_argument('--rotate-minutes', type=float, default=ROTATE_MINUTES,
+                        help='Abrir un archivo de log nuevo cada N minutos (0 = un archivo por ejecución).')
+    parser.add_argument('--sqlite', default=None, metavar='DB',
+                        help='Guardar también las medidas en una base SQLite (sqlite_store.py), con la hora de llegada.')
+    parser.add_argument('--jitter-ms', type=int, default=JITTER_MS,
+                        help=f'Retención (ms) para reordenar por tag y quitar duplicados, p. ej. {DEFAULT_LATENCY_MS} '
+                             f'(por defecto 0: se escribe en orden de llegada).')
+    parser.add_argument('--latency-report-s', type=float, default=LATENCY_REPORT_S,
+                        help=f'Publicar percentiles de latencia y relojes de los tags en uwb/latency/receiver cada N s '
+                             f'(latency_metrics.py), p. ej. {REPORT_INTERVAL_S:g} (por defecto 0: no se mide).')
+    args = parser.parse_args()
+
     print("Iniciando Receptor de Logs MQTT...")
+    COMPRESSION = args.compress
+    ROTATE_MINUTES = args.rotate_minutes
+
+    if args.metrics_port:
+        metrics = ReceiverMetrics(file_size_func=current_log_file_size)
+        try:
+            start_metrics_server(metrics.registry, METRICS_HOST, args.metrics_port)
+        except OSError as e:
+            print(f"Advertencia: No se pudo iniciar el endpoint de métricas: {e}")
+
+    if args.jitter_ms > 0:
+        jitter_buffer = JitterBuffer(args.jitter_ms, registry=metrics.registry if metrics else None, prefix='uwb_receiver')
+        threading.Thread(target=jitter_poll_loop, name='jitter-poll', daemon=True).start()
+        print(f"Buffer de reordenación por tag: {args.jitter_ms} ms")
+
+    if args.sqlite:
+        sqlite_db = UwbDatabase(args.sqlite)
+        sqlite_writer = BatchWriter(sqlite_db, 'ranges',
+                                    sqlite_db.source_id(f"log_receiver@{datetime.datetime.now().isoformat(timespec='seconds')}", 'live'))
+        print(f"Guardando medidas también en {args.sqlite}")
+
+    if args.latency_report_s > 0:
+        latency = LatencyMonitor(registry=metrics.registry if metrics else None, prefix='uwb_receiver')
 
     # Crear directorio y archivo de log inicial
     create_log_directory_and_file()
@@ -123,6 +308,9 @@ if __name__ == "__main__":
     client = setup_mqtt_client()
 
     if client:
+        if latency:
+            latency_probe = BrokerProbe(client, f"log-receiver-{os.getpid()}", latency)
+            start_latency_reporter(client, latency, latency_probe, 'receiver', args.latency_report_s)
         try:
             # Iniciar el bucle de red MQTT (bloqueante)
             # Este bucle maneja la reconexión y procesa los callbacks
@@ -137,9 +325,21 @@ if __name__ == "__main__":
             if client.is_connected():
                  client.loop_stop() # Detener el bucle de red de forma limpia si es posible
                  client.disconnect()
+            if jitter_buffer is not None:
+                with jitter_lock:
+                    write_released(jitter_buffer.flush())
+                print(f"Buffer de reordenación: {jitter_buffer.summary()}")
+            if latency:
+                print(f"Latencias:\n{latency.summary()}")
+            if sqlite_writer:
+                sqlite_writer.flush()
+                print(f"Medidas guardadas en {args.sqlite}: {sqlite_writer.rows_written}")
             if log_file_handle and not log_file_handle.closed:
                 log_file_handle.close()
                 print(f"Archivo de log cerrado: {current_log_file}")
+            if binary_log_handle and not binary_log_handle.closed:
+                binary_log_handle.close()
+                print(f"Archivo de log binario cerrado: {binary_log_file}")
             print("Receptor de Logs MQTT detenido.")
     else:
         print("No se pudo iniciar el cliente MQTT. Saliendo.")
@@ -0,0 +1,110 @@
+# pipeline_stats.py
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class PipelineStats:
+    """Registra tiempo, filas y pico de memoria por etapa del post-procesado, más estadísticas del solver."""
+
+    def __init__(self, enabled=True, track_memory=True):
+        self.enabled = enabled
+        self.track_memory = track_memory and enabled
+        self.stages = []
+        self.metadata = {}
+        self.solver = {
+            'epochs': 0,                       # Epochs (filas pivotadas) evaluados
+            'skipped_insufficient_anchors': 0, # Epochs con menos de 3 anclas válidas
+            'attempted': 0,                    # Llamadas al optimizador
+            'iterations_total': 0,
+            'failures': 0,                     # result.success == False
+            'rejected_by_gate': 0,             # Converge pero result.fun >= umbral
+            'accepted': 0,
+        }
+        self._started_tracemalloc = False
+        self._t_start = None
+
+    def start(self, **metadata):
+        """Inicia la medición global y guarda metadatos (archivo de entrada, salida...)."""
+        if not self.enabled:
+            return
+        self.metadata.update(metadata)
+        self._t_start = time.perf_counter()
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        """Finaliza la medición y libera tracemalloc si lo arrancamos nosotros."""
+        if not self.enabled:
+            return
+        if self._t_start is not None:
+            self.metadata['total_wall_time_s'] = time.perf_counter() - self._t_start
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Mide una etapa. El bloque puede rellenar record['rows_out'] (y rows_in si no se conocía)."""
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        if not self.enabled:
+            yield record
+            return
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            mem_before = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time_s'] = time.perf_counter() - t0
+            if self.track_memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                record['peak_memory_bytes'] = peak
+                record['peak_memory_delta_bytes'] = max(0, peak - mem_before)
+                record['memory_after_bytes'] = current
+            self.stages.append(record)
+
+    def record_skipped_epoch(self):
+        if self.enabled:
+            self.solver['epochs'] += 1
+            self.solver['skipped_insufficient_anchors'] += 1
+
+    def record_solve(self, result, accepted):
+        """Registra el resultado de scipy.optimize.minimize para un epoch."""
+        if not self.enabled:
+            return
+        self.solver['epochs'] += 1
+        self.solver['attempted'] += 1
+        self.solver['iterations_total'] += int(getattr(result, 'nit', 0) or 0)
+        if not result.success:
+            self.solver['failures'] += 1
+        elif not accepted:
+            self.solver['rejected_by_gate'] += 1
+        if accepted:
+            self.solver['accepted'] += 1
+
+    def report(self):
+        """Devuelve el informe como diccionario serializable a JSON."""
+        solver = dict(self.solver)
+        attempted = solver['attempted']
+        solver['iterations_mean'] = solver['iterations_total'] / attempted if attempted else None
+        solver['rejected_by_gate_share'] = solver['rejected_by_gate'] / attempted if attempted else None
+        solver['failure_share'] = solver['failures'] / attempted if attempted else None
+        return {
+            **self.metadata,
+            'stages': self.stages,
+            'solver': solver,
+        }
+
+    def write_json(self, path):
+        """Escribe el informe en 'path' ('-' para stdout)."""
+        text = json.dumps(self.report(), indent=2, default=float)
+        if path == '-':
+            print(text)
+        else:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+            print(f"Informe de rendimiento guardado en: {path}")
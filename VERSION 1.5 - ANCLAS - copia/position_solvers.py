@@ -0,0 +1,463 @@
+# position_solvers.py
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from scipy.optimize import minimize
+
+from solver_backend import get_backend
+
+# --- Configuración ---
+SOLVER_CONFIG_FILE = 'anchor_positions.json' # El solver se elige en "field_settings": {"solver": ...}
+DEFAULT_SOLVER = 'multilateration_3d'
+MIN_DISTANCE_M = 0.01          # Distancias <= 1 cm no son válidas
+MAX_SOLVE_ERROR = 1.0          # multilateration_3d: suma de residuos al cuadrado (m^2) máxima aceptada
+MAX_PLANAR_ERROR = 0.5         # Solvers 2D: error cuadrático medio (m^2) máximo aceptado
+BOUNDS_MARGIN_M = 10.0         # Límites del optimizador: extensión de las anclas +- este margen
+# Calibración: puntos sintéticos sobre la geometría actual de anclas
+CALIBRATION_POINTS = 300
+CALIBRATION_NOISE_M = 0.05
+CALIBRATION_ACCURACY_M = 0.15  # Error horizontal p90 máximo para que un solver sea elegible
+CALIBRATION_MIN_SUCCESS = 0.95 # Fracción mínima de epochs resueltos
+DEFAULT_TAG_HEIGHT = 0.0       # Altura del tag si el config no tiene "tag_height" (ni "tag_heights" para ese tag)
+# fixed_height_2_5d: Gauss-Newton amortiguado (Levenberg) vectorizado sobre todos los epochs
+GN_MAX_ITER = 20
+GN_TOL_M = 1e-4                # Un epoch ha convergido cuando su paso es menor que esto
+GN_DAMPING = 1e-3              # Amortiguamiento relativo a la traza de J^T J
+GN_MAX_STEP_M = 2.0            # Paso máximo por iteración (evita saltos con geometrías malas)
+
+
+class SolveResult:
+    """Resultado de un epoch. success/nit siguen a scipy para PipelineStats.record_solve()."""
+
+    __slots__ = ('position', 'error', 'success', 'accepted', 'nit')
+
+    def __init__(self, position, error, success, accepted, nit=0):
+        self.position = position # [x, y, z] o None si no se acepta
+        self.error = error
+        self.success = success
+        self.accepted = accepted
+        self.nit = nit
+
+
+class PositionSolver:
+    """Interfaz común de los solvers de posición.
+
+    solve() resuelve un epoch (arrays de las anclas que responden, distancias en metros) y
+    solve_batch() una matriz de epochs x anclas con NaN donde no hay lectura. Las subclases solo
+    tienen que implementar solve(); solve_batch() las recorre epoch a epoch si no hay nada mejor.
+    initial_guess es [x, y(, z)] y bounds los límites [(min, max)] de X e Y; si el solver estima Z,
+    sus límites salen de las anclas. tag_id solo lo usan los solvers con datos por tag (altura fija).
+    """
+
+    name = None
+    description = ''
+    min_anchors = 3
+
+    def solve(self, distances, anchor_positions, initial_guess=None, bounds=None, tag_id=None):
+        raise NotImplementedError
+
+    def settings(self):
+        """Parámetros del config que cambian el resultado (para claves de caché)."""
+        return {}
+
+    def with_config(self, config_file):
+        """El solver leyendo sus parámetros de config_file; los que no leen nada del config devuelven self."""
+        return self
+
+    def solve_map(self, responding_distances, responding_positions, stats=None, tag_id=None):
+        """Como multilateration_3d: dicts ancla -> distancia (m) / posición. Devuelve [x, y, z] o None."""
+        if len(responding_distances) < self.min_anchors:
+            return None
+        anchor_ids = list(responding_distances.keys())
+        result = self.solve(np.array([responding_distances[aid] for aid in anchor_ids], dtype=np.float64),
+                            np.array([responding_positions[aid] for aid in anchor_ids], dtype=np.float64),
+                            tag_id=tag_id)
+        if stats is not None:
+            stats.record_solve(result, result.accepted)
+        return result.position
+
+    def solve_batch(self, distances, anchor_positions, stats=None, tag_ids=None, return_residuals=False):
+        """distances (E, A) en metros, NaN o <= MIN_DISTANCE_M si el ancla no responde.
+
+        Devuelve (positions (E, 3) con NaN donde no hay solución aceptada, errors (E,)) y, con
+        return_residuals, también los residuos de rango (E, A) en metros (NaN sin lectura o sin solución).
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        anchor_positions = np.asarray(anchor_positions, dtype=np.float64)
+        positions = np.full((len(distances), 3), np.nan)
+        errors = np.full(len(distances), np.nan)
+        with np.errstate(invalid='ignore'):
+            valid = distances > MIN_DISTANCE_M
+        for e, (row, mask) in enumerate(zip(distances, valid)):
+            if np.count_nonzero(mask) < self.min_anchors:
+                if stats is not None:
+                    stats.record_skipped_epoch()
+                continue
+            result = self.solve(row[mask], anchor_positions[mask], tag_id=None if tag_ids is None else tag_ids[e])
+            if stats is not None:
+                stats.record_solve(result, result.accepted)
+            errors[e] = result.error
+            if result.accepted:
+                positions[e] = result.position
+        if not return_residuals:
+            return positions, errors
+        return positions, errors, range_residuals(positions, anchor_positions, distances, valid)
+
+
+def range_residuals(positions, anchor_positions, distances, valid):
+    """Distancia calculada menos medida (m) por epoch y ancla; NaN sin lectura o sin posición."""
+    predicted = np.linalg.norm(positions[:, None, :] - anchor_positions[None, :, :], axis=2)
+    return np.where(valid, predicted - distances, np.nan)
+
+
+def _anchor_bounds(anchor_positions, dims):
+    low = anchor_positions[:, :dims].min(axis=0) - BOUNDS_MARGIN_M
+    high = anchor_positions[:, :dims].max(axis=0) + BOUNDS_MARGIN_M
+    return list(zip(low, high))
+
+
+class Multilateration3D(PositionSolver):
+    name = 'multilateration_3d'
+    description = 'X, Y y Z libres (L-BFGS-B); acepta si la suma de residuos^2 < MAX_SOLVE_ERROR.'
+
+    def solve(self, distances, anchor_positions, initial_guess=None, bounds=None, tag_id=None):
+        backend = get_backend()
+        if initial_guess is None or len(initial_guess) < 3:
+            initial_guess = anchor_positions.mean(axis=0)
+        full_bounds = _anchor_bounds(anchor_positions, 3)
+        if bounds is not None:
+            full_bounds[:2] = bounds[:2]
+        result = minimize(backend.range_error_3d, initial_guess, args=(anchor_positions, distances),
+                          method='L-BFGS-B', bounds=full_bounds)
+        accepted = bool(result.success and result.fun < MAX_SOLVE_ERROR)
+        return SolveResult(result.x if accepted else None, float(result.fun), bool(result.success), accepted,
+                           int(getattr(result, 'nit', 0) or 0))
+
+
+class TagOnFloor2D(PositionSolver):
+    name = 'tag_z0_2d'
+    description = 'Tag en Z=0 contra distancias inclinadas (replay opt_post); acepta si el error medio^2 < MAX_PLANAR_ERROR.'
+
+    def solve(self, distances, anchor_positions, initial_guess=None, bounds=None, tag_id=None):
+        backend = get_backend()
+        if initial_guess is None:
+            initial_guess = anchor_positions.mean(axis=0)[:2]
+        result = minimize(backend.range_error_z0, initial_guess[:2], args=(anchor_positions, distances),
+                          method='L-BFGS-B', bounds=bounds or _anchor_bounds(anchor_positions, 2),
+                          options={'maxiter': 50, 'ftol': 1e-7})
+        accepted = bool(result.success and result.fun < MAX_PLANAR_ERROR)
+        position = [float(result.x[0]), float(result.x[1]), 0.0] if accepted else None
+        return SolveResult(position, float(result.fun), bool(result.success), accepted,
+                           int(getattr(result, 'nit', 0) or 0))
+
+
+class Trilateration2D(PositionSolver):
+    name = 'trilateration_2d'
+    description = 'Mínimos cuadrados lineales en el plano (ignora la Z de anclas y tag), sin iteraciones.'
+
+    def solve(self, distances, anchor_positions, initial_guess=None, bounds=None, tag_id=None):
+        xy = anchor_positions[:, :2]
+        # Restando la ecuación de la primera ancla a las demás el sistema queda lineal en (x, y)
+        a = 2.0 * (xy[1:] - xy[0])
+        b = (distances[0] ** 2 - distances[1:] ** 2) + np.einsum('ij,ij->i', xy[1:], xy[1:]) - xy[0] @ xy[0]
+        solution, _, rank, _ = np.linalg.lstsq(a, b, rcond=None)
+        if rank < 2:
+            return SolveResult(None, np.inf, False, False)
+        if bounds is not None:
+            solution = np.clip(solution, [lo for lo, _ in bounds], [hi for _, hi in bounds])
+        residual = np.linalg.norm(xy - solution, axis=1) - distances
+        error = float(residual @ residual) / len(distances)
+        accepted = error < MAX_PLANAR_ERROR
+        position = [float(solution[0]), float(solution[1]), 0.0] if accepted else None
+        return SolveResult(position, error, True, accepted)
+
+
+def solve_fixed_height(distances, anchor_positions, heights, initial_xy=None, max_iter=GN_MAX_ITER, tol_m=GN_TOL_M):
+    """X, Y del tag a altura conocida para muchos epochs a la vez.
+
+    distances (E, A) en metros con NaN donde el ancla no responde, heights (E,) la altura del tag en
+    cada epoch. Con Z fija el problema es 2D contra las distancias inclinadas: se arranca de la
+    solución lineal (mínimos cuadrados sobre las distancias proyectadas al plano del tag) y se refina
+    con Gauss-Newton amortiguado, todo con operaciones sobre arrays (E, A). Siempre devuelve un
+    punto finito por epoch con >= 3 anclas: no hay "fallos" del optimizador.
+    Devuelve (xy (E, 2), residuos (E, A), iteraciones (E,)); NaN en los epochs con menos de 3 anclas.
+    """
+    d = np.asarray(distances, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        valid = d > MIN_DISTANCE_M
+    w = valid.astype(np.float64)
+    d = np.where(valid, d, 0.0)
+    anchor_xy = np.asarray(anchor_positions, dtype=np.float64)[:, :2]
+    dz2 = (np.asarray(anchor_positions, dtype=np.float64)[None, :, 2] - np.asarray(heights, dtype=np.float64)[:, None]) ** 2
+    count = w.sum(axis=1)
+    solvable = count >= 3
+    safe_count = np.maximum(count, 1.0)[:, None]
+
+    centroid = (w @ anchor_xy) / safe_count
+    if initial_xy is None:
+        # |p - a_i|^2 = rho_i^2; restando la media de las ecuaciones queda (a_i - ā)·p = (g_i - ḡ) / 2
+        g = np.sum(anchor_xy ** 2, axis=1)[None, :] - np.maximum(d ** 2 - dz2, 0.0)
+        g_centered = (g - (w * g).sum(axis=1, keepdims=True) / safe_count) * w
+        centered = (anchor_xy[None, :, :] - centroid[:, None, :]) * w[:, :, None]
+        m = np.einsum('eai,eaj->eij', centered, centered)
+        v = np.einsum('eai,ea->ei', centered, g_centered) / 2.0
+        det = m[:, 0, 0] * m[:, 1, 1] - m[:, 0, 1] ** 2
+        ok = np.abs(det) > 1e-9 # Anclas alineadas: se arranca del centroide
+        safe_det = np.where(ok, det, 1.0)
+        xy = np.where(ok[:, None], np.column_stack([(m[:, 1, 1] * v[:, 0] - m[:, 0, 1] * v[:, 1]) / safe_det,
+                                                    (m[:, 0, 0] * v[:, 1] - m[:, 0, 1] * v[:, 0]) / safe_det]), centroid)
+    else:
+        xy = np.array(initial_xy, dtype=np.float64).reshape(len(d), 2)
+
+    iterations = np.zeros(len(d), dtype=np.int64)
+    active = solvable.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        diff = xy[:, None, :] - anchor_xy[None, :, :]
+        predicted = np.maximum(np.sqrt(np.sum(diff ** 2, axis=2) + dz2), 1e-9)
+        residual = (predicted - d) * w
+        jacobian = diff / predicted[:, :, None] * w[:, :, None]
+        jtj = np.einsum('eai,eaj->eij', jacobian, jacobian)
+        jtr = np.einsum('eai,ea->ei', jacobian, residual)
+        damping = GN_DAMPING * (jtj[:, 0, 0] + jtj[:, 1, 1]) + 1e-12
+        a, b, c = jtj[:, 0, 0] + damping, jtj[:, 0, 1], jtj[:, 1, 1] + damping
+        det = a * c - b * b
+        step = -np.column_stack([c * jtr[:, 0] - b * jtr[:, 1], a * jtr[:, 1] - b * jtr[:, 0]]) / det[:, None]
+        norm = np.linalg.norm(step, axis=1)
+        step *= np.minimum(1.0, GN_MAX_STEP_M / np.maximum(norm, 1e-12))[:, None]
+        step[~active] = 0.0
+        xy += step
+        iterations += active
+        active &= norm > tol_m
+
+    predicted = np.sqrt(np.sum((xy[:, None, :] - anchor_xy[None, :, :]) ** 2, axis=2) + dz2)
+    residuals = np.where(valid & solvable[:, None], predicted - d, np.nan)
+    xy[~solvable] = np.nan
+    return xy, residuals, iterations
+
+
+class FixedHeight25D(PositionSolver):
+    name = 'fixed_height_2_5d'
+    description = ('Altura del tag fija (field_settings.tag_height / tag_heights): X, Y por Gauss-Newton '
+                   'vectorizado contra distancias inclinadas; acepta si el error medio^2 < MAX_PLANAR_ERROR.')
+
+    def __init__(self, config_file=SOLVER_CONFIG_FILE):
+        self.config_file = config_file
+        self._heights = None
+        self._heights_mtime = None
+
+    def with_config(self, config_file):
+        if os.path.abspath(config_file) == os.path.abspath(self.config_file):
+            return self
+        return FixedHeight25D(config_file)
+
+    def _load_heights(self):
+        """(altura por defecto, {tag: altura}); se vuelve a leer si el config cambia en disco."""
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._heights is None or mtime != self._heights_mtime:
+            self._heights = load_tag_heights(self.config_file)
+            self._heights_mtime = mtime
+        return self._heights
+
+    def tag_height(self, tag_id=None):
+        """Altura (m) del tag: field_settings.tag_heights[tag], si no field_settings.tag_height."""
+        default, per_tag = self._load_heights()
+        return per_tag.get(int(tag_id), default) if tag_id is not None else default
+
+    def settings(self):
+        default, per_tag = self._load_heights()
+        return {'tag_height': default, 'tag_heights': sorted(per_tag.items())}
+
+    def _accept(self, residuals):
+        # Media de residuos^2 por epoch (NaN si ninguna ancla tiene residuo, sin aviso de nanmean)
+        counts = np.count_nonzero(~np.isnan(residuals), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            errors = np.where(counts > 0, np.nansum(residuals ** 2, axis=1) / counts, np.nan)
+        return errors, errors < MAX_PLANAR_ERROR
+
+    def solve(self, distances, anchor_positions, initial_guess=None, bounds=None, tag_id=None):
+        height = self.tag_height(tag_id)
+        initial_xy = None if initial_guess is None else np.asarray(initial_guess, dtype=np.float64)[None, :2]
+        xy, residuals, iterations = solve_fixed_height(np.asarray(distances, dtype=np.float64)[None, :],
+                                                       anchor_positions, [height], initial_xy)
+        if bounds is not None:
+            xy = np.clip(xy, [lo for lo, _ in bounds], [hi for _, hi in bounds])
+        errors, accepted = self._accept(residuals)
+        solved = bool(np.isfinite(xy[0, 0]))
+        position = [float(xy[0, 0]), float(xy[0, 1]), height] if accepted[0] else None
+        return SolveResult(position, float(errors[0]), solved, bool(accepted[0]), int(iterations[0]))
+
+    def solve_batch(self, distances, anchor_positions, stats=None, tag_ids=None, return_residuals=False):
+        distances = np.asarray(distances, dtype=np.float64)
+        if tag_ids is None:
+            heights = np.full(len(distances), self.tag_height())
+        else:
+            tag_ids = np.asarray(tag_ids)
+            unique_tags, inverse = np.unique(tag_ids, return_inverse=True)
+            heights = np.array([self.tag_height(tag) for tag in unique_tags.tolist()], dtype=np.float64)[inverse]
+        xy, residuals, iterations = solve_fixed_height(distances, anchor_positions, heights)
+        errors, accepted = self._accept(residuals)
+        positions = np.full((len(distances), 3), np.nan)
+        positions[accepted] = np.column_stack([xy, heights])[accepted]
+        if stats is not None and stats.enabled:
+            solved = np.isfinite(xy[:, 0])
+            for e in range(len(distances)):
+                if solved[e]:
+                    stats.record_solve(SolveResult(None, errors[e], True, bool(accepted[e]), int(iterations[e])),
+                                       bool(accepted[e]))
+                else:
+                    stats.record_skipped_epoch()
+        if not return_residuals:
+            return positions, errors
+        return positions, errors, np.where(accepted[:, None], residuals, np.nan)
+
+
+_solvers = {}
+
+
+def register_solver(solver):
+    """Registra una instancia de PositionSolver con su nombre. Devuelve el solver."""
+    _solvers[solver.name] = solver
+    return solver
+
+
+for _solver_class in (Multilateration3D, TagOnFloor2D, Trilateration2D, FixedHeight25D):
+    register_solver(_solver_class())
+
+
+def available_solvers():
+    return sorted(_solvers)
+
+
+def load_field_settings(config_file=SOLVER_CONFIG_FILE):
+    """Bloque "field_settings" del config de anclas ({} si no existe o no se puede leer)."""
+    if not os.path.exists(config_file):
+        return {}
+    try:
+        with open(config_file, 'r') as f:
+            settings = json.load(f).get('field_settings', {})
+    except (OSError, ValueError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def load_tag_heights(config_file=SOLVER_CONFIG_FILE):
+    """(field_settings.tag_height, {tag: field_settings.tag_heights[tag]}) en metros."""
+    settings = load_field_settings(config_file)
+    per_tag = settings.get('tag_heights', {})
+    return (float(settings.get('tag_height', DEFAULT_TAG_HEIGHT)),
+            {int(tag): float(h) for tag, h in per_tag.items()} if isinstance(per_tag, dict) else {})
+
+
+def configured_solver_name(config_file=SOLVER_CONFIG_FILE, default=DEFAULT_SOLVER):
+    """UWB_SOLVER si está definida; si no, field_settings.solver del config; si no, default."""
+    return os.environ.get('UWB_SOLVER') or load_field_settings(config_file).get('solver') or default
+
+
+def get_solver(name=None, config_file=SOLVER_CONFIG_FILE, default=DEFAULT_SOLVER):
+    """Devuelve el solver registrado con ese nombre (o el configurado si name es None).
+
+    default es el solver de la herramienta cuando ni UWB_SOLVER ni el config eligen ninguno.
+    Los parámetros del solver (p. ej. alturas de los tags) también se leen de config_file.
+    """
+    name = name or configured_solver_name(config_file, default)
+    if name not in _solvers:
+        raise ValueError(f"Solver desconocido: {name}. Opciones: {available_solvers()}")
+    return _solvers[name].with_config(config_file)
+
+
+def save_solver_choice(name, config_file=SOLVER_CONFIG_FILE):
+    """Escribe field_settings.solver en el config de anclas conservando el resto."""
+    config = {}
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+    config.setdefault('field_settings', {})['solver'] = name
+    tmp_path = config_file + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, config_file)
+
+
+# --- Calibración ---
+
+def calibration_problem(anchor_positions, num_points=CALIBRATION_POINTS, noise_m=CALIBRATION_NOISE_M,
+                        tag_height=DEFAULT_TAG_HEIGHT, seed=0):
+    """Puntos al azar dentro de la extensión XY de las anclas y sus distancias con ruido gaussiano."""
+    rng = np.random.default_rng(seed)
+    anchors = np.asarray(anchor_positions, dtype=np.float64)
+    low, high = anchors[:, :2].min(axis=0), anchors[:, :2].max(axis=0)
+    points = np.column_stack([rng.uniform(low, high, size=(num_points, 2)), np.full(num_points, tag_height)])
+    distances = np.linalg.norm(points[:, None, :] - anchors[None, :, :], axis=2)
+    return points, distances + rng.normal(0, noise_m, distances.shape)
+
+
+def calibrate(anchor_positions, accuracy_m=CALIBRATION_ACCURACY_M, min_success=CALIBRATION_MIN_SUCCESS,
+              solver_names=None, config_file=SOLVER_CONFIG_FILE, **problem_kwargs):
+    """Mide cada solver registrado sobre la geometría de anclas y elige el más rápido que cumple.
+
+    Cumple quien resuelve al menos min_success de los epochs con error horizontal p90 <= accuracy_m.
+    Devuelve (nombre elegido o None, filas con las medidas de cada solver).
+    """
+    anchors = np.asarray(anchor_positions, dtype=np.float64)
+    points, distances = calibration_problem(anchors, **problem_kwargs)
+    rows = []
+    for name in solver_names or available_solvers():
+        solver = get_solver(name, config_file)
+        solver.solve_batch(distances[:2], anchors) # Compilar/calentar (Numba)
+        start = time.perf_counter()
+        positions, _ = solver.solve_batch(distances, anchors)
+        elapsed = time.perf_counter() - start
+        solved = ~np.isnan(positions[:, 0])
+        horizontal = np.linalg.norm(positions[solved, :2] - points[solved, :2], axis=1)
+        p90 = float(np.quantile(horizontal, 0.9)) if solved.any() else np.inf
+        success = float(solved.mean())
+        rows.append({'solver': name, 'us_per_epoch': elapsed / len(points) * 1e6, 'success': success,
+                     'p90_error_m': p90, 'eligible': success >= min_success and p90 <= accuracy_m})
+    eligible = [row for row in rows if row['eligible']]
+    best = min(eligible, key=lambda row: row['us_per_epoch'])['solver'] if eligible else None
+    return best, rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Solvers de posición registrados y calibración sobre la geometría de anclas.')
+    parser.add_argument('--config', default=SOLVER_CONFIG_FILE, help='Config de anclas (field_settings.solver).')
+    parser.add_argument('--list', action='store_true', help='Lista los solvers registrados y sale.')
+    parser.add_argument('--accuracy-m', type=float, default=CALIBRATION_ACCURACY_M,
+                        help='Error horizontal p90 (m) máximo para que un solver sea elegible.')
+    parser.add_argument('--noise-m', type=float, default=CALIBRATION_NOISE_M, help='Ruido de rango (m) de la calibración.')
+    parser.add_argument('--points', type=int, default=CALIBRATION_POINTS, help='Epochs sintéticos de la calibración.')
+    parser.add_argument('--save', action='store_true', help='Guarda el solver elegido en field_settings.solver.')
+    args = parser.parse_args()
+
+    if args.list:
+        current = configured_solver_name(args.config)
+        for name in available_solvers():
+            print(f"{'*' if name == current else ' '} {name:20s} {get_solver(name).description}")
+        raise SystemExit(0)
+    from post_process_data import load_anchor_map
+
+    anchor_map = load_anchor_map(args.config)
+    settings = load_field_settings(args.config)
+    tag_height = float(settings.get('tag_height', DEFAULT_TAG_HEIGHT))
+    best, rows = calibrate([anchor_map[aid] for aid in sorted(anchor_map)], accuracy_m=args.accuracy_m,
+                           config_file=args.config, num_points=args.points, noise_m=args.noise_m, tag_height=tag_height)
+    print(f"Calibración: {args.points} epochs, ruido {args.noise_m * 100:.0f} cm, tag a {tag_height:.2f} m, "
+          f"umbral p90 {args.accuracy_m * 100:.0f} cm")
+    for row in rows:
+        print(f"  {row['solver']:20s} {row['us_per_epoch']:9.1f} µs/epoch  resueltos {row['success'] * 100:5.1f}%  "
+              f"p90 {row['p90_error_m'] * 100:7.1f} cm  {'elegible' if row['eligible'] else '-'}")
+    if best is None:
+        print("Ningún solver cumple el umbral. Se mantiene el configurado.")
+        raise SystemExit(1)
+    print(f"Solver elegido: {best} (configurado: {configured_solver_name(args.config)})")
+    if args.save:
+        save_solver_choice(best, args.config)
+        print(f"Guardado en {args.config} (field_settings.solver)")
@@ -3,15 +3,17 @@ import numpy as np
 import argparse
 import json
 import os
-from scipy.optimize import minimize
+from pipeline_stats import PipelineStats
+from uwb_loader import RAW_COLUMN_NAMES, read_raw_log, coerce_raw_columns, drop_invalid_rows
+from solver_backend import get_backend
+from epoch_alignment import DEFAULT_MAX_GAP_MS, build_aligned_epochs
+from session_cache import CACHE_DIR, DEFAULT_MAX_BYTES, SessionCache, file_digest
+from session_segments import add_session_columns, session_table
+from position_solvers import MAX_SOLVE_ERROR, MIN_DISTANCE_M, available_solvers, get_solver, range_residuals
+from anchor_selection import AnchorSelector
 
 # --- Constantes y Configuración ---
-# Columnas esperadas en el archivo de log crudo
-RAW_COLUMN_NAMES = [
-    'TagID', 'Timestamp(ms)', 'AnchorID', 
-    'RawDistance(cm)', 'FilteredDistance(cm)', 
-    'RSSI(dBm)', 'AnchorStatus'
-]
+# Columnas esperadas en el archivo de log crudo: RAW_COLUMN_NAMES (definidas en uwb_loader.py)
 # Columnas a usar como valores al pivotar
 PIVOT_VALUE_COLS = ['FilteredDistance(cm)', 'RSSI(dBm)']
 # Columnas de índice para pivotar
@@ -22,6 +24,14 @@ PIVOT_COLUMN_COL = 'AnchorID'
 ANCHOR_CONFIG_FILE = 'anchor_positions.json'
 # Altura por defecto si no está en el config
 DEFAULT_ANCHOR_HEIGHT = 1.5 
+# Claves del config que no son anclas
+CONFIG_SECTIONS = ('field_settings',)
+# Colores de las anclas en los replays (se repiten si hay más anclas que colores)
+ANCHOR_COLORS = ['red', 'green', 'blue', 'purple', 'orange', 'brown', 'magenta', 'olive', 'cyan', 'gray']
+# Modos de construcción de epochs: 'exact' agrupa por timestamp idéntico (pivot), 'aligned' interpola
+# cada ancla a cada medida (offline) y 'causal' extrapola solo con el pasado (igual que en tiempo real)
+EPOCH_MODES = ('exact', 'aligned', 'causal')
+# Solver de posición: se elige por nombre (--solver o field_settings.solver, ver position_solvers.py)
 
 # --- Funciones ---
 
@@ -32,6 +42,8 @@ def load_anchor_positions(config_file, anchors_dict):
             with open(config_file, 'r') as f:
                 config = json.load(f)
                 for anchor_id_str, data in config.items():
+                    if anchor_id_str in CONFIG_SECTIONS:
+                        continue
                     try:
                         anchor_id = int(anchor_id_str)
                         pos = data.get('position')
@@ -67,200 +79,340 @@ def load_anchor_positions(config_file, anchors_dict):
              anchors_dict[aid]['position'] = data['position'][:3] # Truncar si hay más de 3
 
 
+def load_anchor_map(config_file=ANCHOR_CONFIG_FILE):
+    """Todas las anclas del config, sean cuantas sean: {id: [x, y, z]}."""
+    anchors_config = {}
+    load_anchor_positions(config_file, anchors_config)
+    return {aid: data['position'] for aid, data in anchors_config.items() if 'position' in data}
+
+
 # Usar la misma función de multilateración que el replay para consistencia
-def multilateration_3d(responding_distances, responding_anchor_positions):
-    """Calcula la posición 3D del tag usando multilateración optimizada."""
-    anchor_ids = list(responding_distances.keys())
-    if len(anchor_ids) < 3: # Necesitamos al menos 3 para 3D (aunque 4 es mejor)
-        return None 
-
-    def error_function(point): # point is [x, y, z]
-        error = 0
-        for anchor_id in anchor_ids:
-            anchor_pos = responding_anchor_positions[anchor_id]
-            measured_dist = responding_distances[anchor_id]
-            if measured_dist <= 0: # Ignorar distancias no válidas
-                continue 
-            calculated_dist_sq = (
-                (point[0] - anchor_pos[0])**2 + 
-                (point[1] - anchor_pos[1])**2 + 
-                (point[2] - anchor_pos[2])**2
-            )
-            # Evitar sqrt de números negativos pequeños debido a precisión flotante
-            if calculated_dist_sq < 0: calculated_dist_sq = 0 
-            calculated_dist = np.sqrt(calculated_dist_sq)
-            error += (calculated_dist - measured_dist)**2
-        return error
-
-    # Usar una estimación inicial basada en las posiciones de las anclas que responden
-    initial_guess = np.mean([responding_anchor_positions[aid] for aid in anchor_ids], axis=0).tolist()
-    
-    # Límites razonables (ej. -10m a +10m de las anclas, ajustar si es necesario)
-    all_anchor_pos = np.array([pos for pos in responding_anchor_positions.values()])
-    min_coords = np.min(all_anchor_pos, axis=0) - 10
-    max_coords = np.max(all_anchor_pos, axis=0) + 10
-    bounds = list(zip(min_coords, max_coords))
+def multilateration_3d(responding_distances, responding_anchor_positions, stats=None):
+    """Calcula la posición 3D del tag usando multilateración optimizada (solver 'multilateration_3d').
 
-    result = minimize(error_function, initial_guess, method='L-BFGS-B', bounds=bounds)
+    Si se pasa 'stats' (PipelineStats), se registran iteraciones, fallos y rechazos por umbral.
+    """
+    return get_solver('multilateration_3d').solve_map(responding_distances, responding_anchor_positions, stats)
 
-    if result.success and result.fun < 1.0: # Añadir un umbral de error (ej. 1.0 m^2 total)
-        return result.x # Devuelve [x, y, z]
-    else:
-        # print(f"Optimización fallida o error alto: {result.message} (Error: {result.fun:.2f})")
-        return None
 
+def session_cache_keys(cache, input_file, epoch_mode, max_gap_ms, anchor_positions_map, solver, residuals=False,
+                       selector=None):
+    """Claves encadenadas de las etapas parsed -> epochs -> solved para un log crudo."""
+    parsed_key = cache.key('parsed', file_digest(input_file))
+    epochs_key = cache.key('epochs', parsed_key, epoch_mode, max_gap_ms if epoch_mode != 'exact' else None)
+    anchors = sorted((int(aid), [float(c) for c in pos]) for aid, pos in anchor_positions_map.items())
+    solved_key = cache.key('solved', epochs_key, anchors, solver.name, solver.settings(), MAX_SOLVE_ERROR,
+                           get_backend().name, residuals, selector.settings() if selector else None)
+    return {'parsed': parsed_key, 'epochs': epochs_key, 'solved': solved_key}
 
-def process_uwb_log(input_file, output_file):
-    """Carga, pivota y aplica post-procesamiento (cálculo de posición) a un log UWB."""
+
+def process_uwb_log(input_file, output_file, stats=None, epoch_mode='exact', max_gap_ms=DEFAULT_MAX_GAP_MS, cache=None,
+                    raw_reader=None, solver_name=None, residuals=False, max_anchors=None):
+    """Carga, pivota y aplica post-procesamiento (cálculo de posición) a un log UWB.
+
+    Si se pasa 'stats' (PipelineStats), se mide cada etapa: read, numeric, dropna, pivot, solve y write.
+    Con epoch_mode 'aligned' o 'causal' se calcula una posición por cada medida recibida, llevando
+    la distancia de cada ancla al instante de la medida (ver epoch_alignment.py).
+    Si se pasa 'cache' (SessionCache), se reutilizan las etapas ya calculadas para el mismo contenido
+    del log: cambiar solo las anclas repite únicamente el cálculo de posiciones.
+    Con 'raw_reader' (función sin argumentos que devuelve el DataFrame crudo, p. ej. una consulta
+    a sqlite_store.UwbDatabase) input_file solo se usa como descripción y no se usa la caché.
+    solver_name elige el solver de position_solvers.py (por defecto, el de field_settings.solver).
+    Con residuals se añaden las columnas Residual_<ancla> (distancia calculada - medida, m).
+    Se usan todas las anclas del config; max_anchors (por defecto field_settings.max_anchors) limita
+    cuántas entran en cada epoch (ver anchor_selection.py, 0 = todas).
+    """
+    if epoch_mode not in EPOCH_MODES:
+        print(f"Error: Modo de epoch desconocido '{epoch_mode}'. Opciones: {EPOCH_MODES}")
+        return
+    try:
+        solver = get_solver(solver_name, ANCHOR_CONFIG_FILE)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if stats is None:
+        stats = PipelineStats(enabled=False)
     print(f"Procesando archivo: {input_file}")
 
-    # Definir estructura inicial de anchors (será actualizada desde JSON si existe)
-    # Es importante tener al menos los IDs que esperamos ver en los datos
-    # Las posiciones se sobreescribirán/completarán desde el archivo
-    anchors_config = {
-        10: {}, 20: {}, 30: {}, 40: {} # IDs esperados
-    }
-    load_anchor_positions(ANCHOR_CONFIG_FILE, anchors_config)
-    print("Configuración de Anchors a usar:", anchors_config)
-    
-    # Extraer solo las posiciones para la multilateración
-    anchor_positions_map = {aid: data['position'] for aid, data in anchors_config.items() if 'position' in data}
+    # Todas las anclas del archivo de configuración (cualquier número)
+    anchor_positions_map = load_anchor_map(ANCHOR_CONFIG_FILE)
+    print("Configuración de Anchors a usar:", anchor_positions_map)
     if len(anchor_positions_map) < 3:
         print("Error: No se pudieron cargar suficientes posiciones de anclas (>=3) para calcular la posición.")
         return
+    selector = AnchorSelector(anchor_positions_map, max_anchors, config_file=ANCHOR_CONFIG_FILE)
+
+    df = None
+    df_pivot = None
+    solved = False
+    cache_keys = None
+    if raw_reader is not None:
+        cache = None
+    try:
+        if cache is not None:
+            cache_keys = session_cache_keys(cache, input_file, epoch_mode, max_gap_ms, anchor_positions_map, solver,
+                                            residuals, selector)
+            df_pivot = cache.get(cache_keys['solved'])
+            solved = df_pivot is not None
+            if df_pivot is None:
+                df_pivot = cache.get(cache_keys['epochs'])
+            if df_pivot is None:
+                df = cache.get(cache_keys['parsed'])
+            if df_pivot is not None or df is not None:
+                print(f"Reutilizando etapas de la caché ({'solved' if solved else 'epochs' if df is None else 'parsed'}).")
+    except FileNotFoundError:
+        print(f"Error: El archivo {input_file} no fue encontrado.")
+        return
+
+    if df is None and df_pivot is None:
+        df = read_and_clean_raw_log(input_file, stats, raw_reader)
+        if df is None:
+            return
+        if cache is not None:
+            cache.put(cache_keys['parsed'], df)
+
+    if df_pivot is None:
+        df_pivot = pivot_epochs(df, stats, epoch_mode, max_gap_ms)
+        if df_pivot is None:
+            return
+        if cache is not None:
+            cache.put(cache_keys['epochs'], df_pivot)
+
+    try:
+        if not solved:
+            solve_positions(df_pivot, anchor_positions_map, stats, solver, residuals, selector)
+            if cache is not None:
+                cache.put(cache_keys['solved'], df_pivot)
 
+        print("Primeras filas con posición:")
+        print(df_pivot[['Timestamp(ms)', 'TagID', 'Position_X', 'Position_Y', 'Position_Z']].head())
+
+        # --- Fin del post-procesado --- 
+
+        # Guardar el DataFrame procesado
+        try:
+            with stats.stage('write', rows_in=len(df_pivot)) as st:
+                df_pivot.to_csv(output_file, index=False, float_format='%.4f')
+                st['rows_out'] = len(df_pivot)
+            print(f"Archivo procesado y enriquecido guardado en: {output_file}")
+        except Exception as e:
+            print(f"Error al guardar el archivo procesado: {e}")
+
+    except KeyError as e:
+         print(f"Error de clave al acceder a columnas: {e}. Verifica los nombres de columna y los IDs de ancla en los datos.")
+    except Exception as e:
+        import traceback
+        print(f"Error inesperado al procesar: {e}")
+        traceback.print_exc()
+    if cache is not None:
+        print(cache.summary())
+
+
+def read_and_clean_raw_log(input_file, stats, raw_reader=None):
+    """Etapas read, numeric y dropna: devuelve el DataFrame crudo limpio o None si no se puede leer."""
     try:
-        # Intentar detectar separador automáticamente, o especificar si es necesario
-        # Especificar dtype puede ayudar, pero lo haremos explícito después
-        df = pd.read_csv(input_file, header=None, names=RAW_COLUMN_NAMES, on_bad_lines='warn')
+        # Lectura tipada (usecols + dtypes compactos); detecta la cabecera del receptor si existe
+        with stats.stage('read') as st:
+            df = raw_reader() if raw_reader is not None else read_raw_log(input_file)
+            st['rows_out'] = len(df)
         print(f"Archivo leído con éxito. Columnas detectadas: {df.columns.tolist()}")
-        if df.shape[1] != len(RAW_COLUMN_NAMES):
-             print(f"Advertencia: El número de columnas esperado ({len(RAW_COLUMN_NAMES)}) no coincide con las columnas leídas ({df.shape[1]}). Verifica el separador o el formato del CSV.")
-             # Podrías intentar leer de nuevo con otro separador si el primero falla
-             # df = pd.read_csv(input_file, header=None, names=RAW_COLUMN_NAMES, sep=';') # Ejemplo con punto y coma
-
-        # --- NUEVO: Forzar conversión a numérico --- 
-        numeric_cols = ['FilteredDistance(cm)', 'RSSI(dBm)', 'RawDistance(cm)', 'Timestamp(ms)', 'AnchorID', 'TagID', 'AnchorStatus']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            else:
-                print(f"Advertencia: La columna numérica esperada '{col}' no se encontró en el CSV.")
+        for col in ['TagID', 'Timestamp(ms)', 'AnchorID', 'FilteredDistance(cm)', 'RSSI(dBm)']:
+            if col not in df.columns:
+                print(f"Advertencia: La columna numérica esperada '{col}' no se encontró en el CSV. Columnas esperadas: {RAW_COLUMN_NAMES}")
+
+        # Forzar conversión a numérico (solo si la lectura tipada no pudo hacerlo)
+        with stats.stage('numeric', rows_in=len(df)) as st:
+            df = coerce_raw_columns(df)
+            st['rows_out'] = len(df)
                 
         # Eliminar filas donde la conversión falló (resultó en NaN) en columnas críticas
-        critical_cols = ['Timestamp(ms)', 'TagID', 'AnchorID', 'FilteredDistance(cm)', 'RSSI(dBm)']
-        initial_rows = len(df)
-        df.dropna(subset=critical_cols, inplace=True)
+        with stats.stage('dropna', rows_in=len(df)) as st:
+            initial_rows = len(df)
+            df = drop_invalid_rows(df.dropna(subset=['RSSI(dBm)']))
+            st['rows_out'] = len(df)
         if len(df) < initial_rows:
             print(f"Eliminadas {initial_rows - len(df)} filas con valores no numéricos o NaN en columnas críticas.")
 
+        # Sesiones (reinicios del tag, huecos, vueltas de millis()): en orden de llegada, antes de pivotar
+        with stats.stage('sessions', rows_in=len(df)) as st:
+            if 'SessionID' not in df.columns:
+                df = add_session_columns(df)
+            st['rows_out'] = len(df)
+        sessions = session_table(df)
+        if len(sessions) > df['TagID'].nunique():
+            print(f"Detectadas {len(sessions)} sesiones (reinicios o huecos); se procesan por separado:")
+            print(sessions[['SessionID', 'TagID', 'Reason', 'Rows', 'FirstTimestamp', 'LastTimestamp']].to_string(index=False))
+
     except pd.errors.EmptyDataError:
         print(f"Error: El archivo {input_file} está vacío o no se pudo leer.")
-        return
+        return None
     except FileNotFoundError:
         print(f"Error: El archivo {input_file} no fue encontrado.")
-        return
+        return None
+    except ValueError as e:
+        print(f"Error: El archivo {input_file} no tiene el formato crudo esperado: {e}")
+        return None
+    if df.empty:
+        print(f"Error: El archivo {input_file} no tiene filas válidas.")
+        return None
         
     print(f"Leídas {len(df)} filas.")
+    return df
+
 
+def pivot_epochs(df, stats, epoch_mode, max_gap_ms):
+    """Etapa pivot: una fila por epoch con columnas FilteredDistance_<ancla> y RSSI_<ancla>."""
     # Verificar que las columnas para pivotar existen y son numéricas
     if not all(col in df.columns and pd.api.types.is_numeric_dtype(df[col]) for col in PIVOT_VALUE_COLS):
         print(f"Error: Las columnas de valor {PIVOT_VALUE_COLS} no son numéricas.")
-        return
+        return None
         
     if not all(col in df.columns for col in PIVOT_INDEX_COLS + [PIVOT_COLUMN_COL]):
         print(f"Error: Faltan columnas de índice o pivot {PIVOT_INDEX_COLS + [PIVOT_COLUMN_COL]}.")
-        return
+        return None
 
     try:
         # --- Paso Clave: Pivotar la tabla ---
         # Queremos una fila por timestamp, con columnas para cada ancla
         # Usaremos la 'FilteredDistance(cm)' y 'RSSI(dBm)'
-        df_pivot = df.pivot_table(
-            index=PIVOT_INDEX_COLS, 
-            columns=PIVOT_COLUMN_COL, 
-            values=PIVOT_VALUE_COLS
-        )
-
-        # Aplanar los nombres de las columnas (e.g., ('FilteredDistance(cm)', 10) -> 'Dist_10')
-        df_pivot.columns = [f'{val.replace("(cm)","").replace("(dBm)","")}_{int(col)}' for val, col in df_pivot.columns]
-        df_pivot.reset_index(inplace=True)
-
-        print(f"Datos pivotados. {len(df_pivot)} timestamps únicos.")
-        print("Primeras filas pivotadas:")
-        print(df_pivot.head())
-
-        # --- Calcular Posición para cada Timestamp ---
-        positions_x = []
-        positions_y = []
-        positions_z = []
-        print("Calculando posiciones...")
-        
-        anchor_ids_available = sorted([aid for aid in anchor_positions_map.keys()]) # IDs de anclas con posición conocida
-        
-        for index, row in df_pivot.iterrows():
-            responding_distances = {}
-            responding_positions = {}
-            num_valid_anchors = 0
-            
-            for anchor_id in anchor_ids_available:
-                dist_col = f'FilteredDistance_{anchor_id}'
-                # Verificar si la columna de distancia existe y no es NaN
-                if dist_col in row and pd.notna(row[dist_col]):
-                     dist_m = row[dist_col] / 100.0 # Convertir a metros
-                     if dist_m > 0.01: # Considerar distancia válida si es > 1cm
-                         responding_distances[anchor_id] = dist_m
-                         responding_positions[anchor_id] = anchor_positions_map[anchor_id]
-                         num_valid_anchors += 1
-
-            # Calcular posición si hay suficientes anclas válidas
-            if num_valid_anchors >= 3:
-                pos_3d = multilateration_3d(responding_distances, responding_positions)
-                if pos_3d is not None:
-                    positions_x.append(pos_3d[0])
-                    positions_y.append(pos_3d[1])
-                    positions_z.append(pos_3d[2])
-                else:
-                    positions_x.append(np.nan)
-                    positions_y.append(np.nan)
-                    positions_z.append(np.nan)
+        # (Equivale a pivot_table(index=PIVOT_INDEX_COLS, columns=PIVOT_COLUMN_COL, values=PIVOT_VALUE_COLS)
+        #  pero agrupando en arrays con el backend numérico activo)
+        with stats.stage('pivot', rows_in=len(df)) as st:
+            if epoch_mode != 'exact':
+                df_pivot = build_aligned_epochs(df, PIVOT_VALUE_COLS, max_gap_ms=max_gap_ms, causal=(epoch_mode == 'causal'))
             else:
-                positions_x.append(np.nan)
-                positions_y.append(np.nan)
-                positions_z.append(np.nan)
+                # Se agrupa por sesión en vez de por tag (cada sesión es de un solo tag): dos arranques
+                # del mismo tag con el mismo millis() no caen en el mismo epoch
+                epoch_ts, epoch_sessions, epoch_anchors, epoch_values = get_backend().assemble_epochs(
+                    df['Timestamp(ms)'].to_numpy(), df['SessionID'].to_numpy(), df[PIVOT_COLUMN_COL].to_numpy(),
+                    df[PIVOT_VALUE_COLS].to_numpy(dtype=np.float64)
+                )
+                session_tags = df.groupby('SessionID')['TagID'].first()
+                pivot_data = {'Timestamp(ms)': epoch_ts,
+                              'TagID': session_tags.reindex(epoch_sessions).to_numpy().astype(np.int64),
+                              'SessionID': epoch_sessions}
+                # Aplanar los nombres de las columnas (e.g., ('FilteredDistance(cm)', 10) -> 'FilteredDistance_10')
+                for v, val in enumerate(PIVOT_VALUE_COLS):
+                    for a, anchor_id in enumerate(epoch_anchors):
+                        pivot_data[f'{val.replace("(cm)","").replace("(dBm)","")}_{int(anchor_id)}'] = epoch_values[:, a, v]
+                df_pivot = pd.DataFrame(pivot_data)
+            st['rows_out'] = len(df_pivot)
 
-        # Añadir columnas de posición al DataFrame
-        df_pivot['Position_X'] = positions_x
-        df_pivot['Position_Y'] = positions_y
-        df_pivot['Position_Z'] = positions_z
-        
-        print("Cálculo de posiciones finalizado.")
-        print("Primeras filas con posición:")
-        print(df_pivot[['Timestamp(ms)', 'TagID', 'Position_X', 'Position_Y', 'Position_Z']].head())
+    except KeyError as e:
+         print(f"Error de clave al pivotar o acceder a columnas: {e}. Verifica los nombres de columna y los IDs de ancla en los datos.")
+         return None
 
-        # --- Fin del post-procesado --- 
+    print(f"Datos pivotados. {len(df_pivot)} timestamps únicos.")
+    print("Primeras filas pivotadas:")
+    print(df_pivot.head())
+    return df_pivot
 
-        # Guardar el DataFrame procesado
-        try:
-            df_pivot.to_csv(output_file, index=False, float_format='%.4f')
-            print(f"Archivo procesado y enriquecido guardado en: {output_file}")
-        except Exception as e:
-            print(f"Error al guardar el archivo procesado: {e}")
 
-    except KeyError as e:
-         print(f"Error de clave al pivotar o acceder a columnas: {e}. Verifica los nombres de columna y los IDs de ancla en los datos.")
-    except Exception as e:
-        import traceback
-        print(f"Error inesperado al pivotar o procesar: {e}")
-        traceback.print_exc()
+def solve_positions(df_pivot, anchor_positions_map, stats, solver=None, residuals=False, selector=None):
+    """Etapa solve: añade Position_X/Y/Z (NaN si no hay solución) y, si se pide, Residual_<ancla> a df_pivot.
+
+    Con 'selector' (AnchorSelector) cada epoch se resuelve solo con las anclas elegidas; los residuos
+    se siguen dando para todas las que tienen lectura.
+    """
+    solver = solver or get_solver(config_file=ANCHOR_CONFIG_FILE)
+    print(f"Calculando posiciones (solver {solver.name})...")
+    
+    anchor_ids_available = sorted([aid for aid in anchor_positions_map.keys()]) # IDs de anclas con posición conocida
+    
+    # Matriz de distancias (cm) epoch x ancla, solo anclas con posición conocida presentes en los datos
+    dist_cols = [(aid, f'FilteredDistance_{aid}') for aid in anchor_ids_available]
+    dist_cols = [(aid, col) for aid, col in dist_cols if col in df_pivot.columns]
+    dist_matrix = df_pivot[[col for _, col in dist_cols]].to_numpy(dtype=np.float64)
+    anchors_array = np.array([anchor_positions_map[aid] for aid, _ in dist_cols], dtype=np.float64).reshape(-1, 3)
+    solve_matrix = dist_matrix
+    if selector is not None and selector.active:
+        # Solo las K anclas elegidas por geometría y señal; el resto cuenta como sin lectura
+        anchor_map = {aid: anchor_positions_map[aid] for aid, _ in dist_cols}
+        if len(anchor_map) != len(selector.anchor_ids):
+            selector = AnchorSelector(anchor_map, selector.max_anchors, selector.fixed_height, config_file=selector.config_file)
+        rssi_cols = [f'RSSI_{aid}' for aid, _ in dist_cols]
+        rssi = df_pivot[rssi_cols].to_numpy(dtype=np.float64) if all(c in df_pivot.columns for c in rssi_cols) else None
+        solve_matrix = np.where(selector.select_batch(dist_matrix / 100.0, rssi, df_pivot['TagID'].to_numpy()), dist_matrix, np.nan)
+        print(f"Selección de anclas: {selector.summary()}")
+
+    with stats.stage('solve', rows_in=len(df_pivot)) as st:
+        # Distancias en metros; NaN o <= 1 cm cuentan como ancla sin lectura
+        # TagID: los solvers con datos por tag (altura fija) los usan; el resto los ignora
+        solved = solver.solve_batch(solve_matrix / 100.0, anchors_array, stats=stats,
+                                    tag_ids=df_pivot['TagID'].to_numpy(), return_residuals=residuals)
+        positions = solved[0]
+        residual_matrix = solved[2] if residuals else None
+        if residuals and solve_matrix is not dist_matrix:
+            with np.errstate(invalid='ignore'):
+                residual_matrix = range_residuals(positions, anchors_array, dist_matrix / 100.0,
+                                                  dist_matrix / 100.0 > MIN_DISTANCE_M)
+
+        # Añadir columnas de posición al DataFrame
+        df_pivot['Position_X'] = positions[:, 0]
+        df_pivot['Position_Y'] = positions[:, 1]
+        df_pivot['Position_Z'] = positions[:, 2]
+        if residuals:
+            for (anchor_id, _), column in zip(dist_cols, residual_matrix.T):
+                df_pivot[f'Residual_{anchor_id}'] = column
+        st['rows_out'] = int(np.count_nonzero(~np.isnan(positions[:, 0])))
+    
+    print("Cálculo de posiciones finalizado.")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Post-procesa un archivo CSV de logs UWB, pivotando y calculando posición 3D.')
-    parser.add_argument('--input', required=True, help='Ruta al archivo CSV de entrada (log crudo).')
+    parser.add_argument('--input', default=None, help='Ruta al archivo CSV de entrada (log crudo).')
     parser.add_argument('--output', required=True, help='Ruta para guardar el archivo CSV procesado (con posiciones).')
     # Opcional: añadir argumento para especificar archivo de config de anclas
     # parser.add_argument('--anchors', default=ANCHOR_CONFIG_FILE, help='Ruta al archivo JSON de configuración de anclas.') 
+    parser.add_argument('--epoch-mode', choices=EPOCH_MODES, default='exact',
+                        help="Construcción de epochs: 'exact' (timestamp idéntico), 'aligned' (una posición por medida, interpolando) o 'causal' (extrapolando solo con el pasado).")
+    parser.add_argument('--max-gap-ms', type=int, default=DEFAULT_MAX_GAP_MS,
+                        help=f'Hueco máximo (ms) para interpolar/extrapolar un ancla en los modos aligned/causal (por defecto {DEFAULT_MAX_GAP_MS}).')
+    parser.add_argument('--stats-json', default=None, help='Ruta para guardar un informe JSON de rendimiento por etapa (\'-\' para stdout).')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'Carpeta de la caché de etapas (por defecto {CACHE_DIR}).')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2,
+                        help='Tamaño máximo de la caché en MiB; se expulsan las entradas usadas hace más tiempo.')
+    parser.add_argument('--no-cache', action='store_true', help='Recalcula todas las etapas sin leer ni escribir la caché.')
+    parser.add_argument('--db', default=None, help='Leer las medidas de una base sqlite_store.py en vez de --input.')
+    parser.add_argument('--tag', type=int, nargs='*', default=None, help='Con --db o --from/--to: tags a procesar (por defecto todos).')
+    parser.add_argument('--from', dest='start', default=None,
+                        help="Inicio ('2025-05-04 17:05:00' hora local o epoch ms; con --clock device, millis() del tag).")
+    parser.add_argument('--to', dest='end', default=None, help='Fin (mismo formato que --from).')
+    parser.add_argument('--clock', choices=('host', 'device'), default='host', help='Reloj de --from/--to.')
+    parser.add_argument('--solver', choices=available_solvers(), default=None,
+                        help='Solver de posición (position_solvers.py; por defecto field_settings.solver o multilateration_3d).')
+    parser.add_argument('--residuals', action='store_true',
+                        help='Añade Residual_<ancla> (distancia calculada - medida, m) a la salida.')
+    parser.add_argument('--max-anchors', type=int, default=None,
+                        help='Anclas por epoch como mucho, elegidas por DOP y señal (por defecto field_settings.max_anchors o 6; 0 = todas).')
     args = parser.parse_args()
+    if (args.input is None) == (args.db is None):
+        parser.error('Indica --input o --db.')
+
+    raw_reader = None
+    if args.db:
+        from sqlite_store import UwbDatabase
+        db = UwbDatabase(args.db)
+        raw_reader = lambda: db.load_raw_frame(args.tag, args.start, args.end, args.clock)
+        args.input = f"{args.db} (tags {args.tag or 'todos'}, {args.start or 'inicio'} -> {args.end or 'fin'})"
+    elif args.start is not None or args.end is not None:
+        # Ventana de un log: solo se leen los bloques necesarios (log_index.py)
+        from log_index import read_log_window
+        input_path = args.input
+        raw_reader = lambda: read_log_window(input_path, args.tag, args.start, args.end, args.clock)
+        args.input = f"{input_path} (tags {args.tag or 'todos'}, {args.start or 'inicio'} -> {args.end or 'fin'})"
 
     # Llamar a la función principal
-    process_uwb_log(args.input, args.output)
+    stats = PipelineStats() if args.stats_json else None
+    if stats:
+        stats.start(input_file=args.input, output_file=args.output)
+    try:
+        cache = None if args.no_cache else SessionCache(args.cache_dir, max_bytes=int(args.cache_max_mb * 1024 ** 2))
+        process_uwb_log(args.input, args.output, stats=stats, epoch_mode=args.epoch_mode, max_gap_ms=args.max_gap_ms,
+                        cache=cache, raw_reader=raw_reader, solver_name=args.solver,
+                        residuals=args.residuals, max_anchors=args.max_anchors)
+    finally:
+        if stats:
+            stats.stop()
+            stats.write_json(args.stats_json)
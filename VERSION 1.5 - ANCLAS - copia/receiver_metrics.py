@@ -0,0 +1,225 @@
+# receiver_metrics.py
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Buckets por defecto (segundos) para latencias de escritura a disco
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Buckets por defecto (registros) para tamaños de lote
+DEFAULT_BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.metric_type}']
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Contador monótono, opcionalmente con etiquetas."""
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self):
+        if not self.label_names and not self._values:
+            return [f'{self.name} 0']
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(val)}'
+                for key, val in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Valor instantáneo. Puede fijarse con set() o calcularse en cada scrape con una función."""
+    metric_type = 'gauge'
+
+    def __init__(self, name, help_text, label_names=(), func=None):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+        self._func = func
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _render_samples(self):
+        if self._func is not None:
+            try:
+                value = self._func()
+            except Exception:
+                value = None
+            return [] if value is None else [f'{self.name} {_format_value(value)}']
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(val)}'
+                for key, val in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos (formato Prometheus)."""
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def _render_samples(self):
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for upper, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, ('le', _format_value(float(upper))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            base = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{base} {_format_value(series["sum"])}')
+            lines.append(f'{self.name}_count{base} {series["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    """Colección de métricas que se exponen juntas en formato de texto Prometheus."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=(), func=None):
+        return self.register(Gauge(name, help_text, label_names, func=func))
+
+    def histogram(self, name, help_text, buckets, label_names=()):
+        return self.register(Histogram(name, help_text, buckets, label_names))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class ReceiverMetrics:
+    """Métricas del receptor de logs MQTT (mensajes, tags, payloads inválidos, escrituras)."""
+
+    def __init__(self, registry=None, file_size_func=None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.start_time = time.time()
+        self.messages = r.counter('uwb_receiver_messages_total', 'Mensajes MQTT recibidos por topic.', ('topic',))
+        self.tag_records = r.counter('uwb_receiver_tag_records_total', 'Registros válidos recibidos por tag.', ('tag',))
+        self.tag_last_seen = r.gauge('uwb_receiver_tag_last_seen_timestamp_seconds',
+                                     'Hora (epoch) del último registro recibido por tag.', ('tag',))
+        self.invalid_payloads = r.counter('uwb_receiver_invalid_payloads_total', 'Payloads vacíos o con formato inválido.', ('topic',))
+        self.errors = r.counter('uwb_receiver_errors_total', 'Excepciones al procesar mensajes.')
+        self.write_batch = r.histogram('uwb_receiver_write_batch_records', 'Registros por escritura a disco.',
+                                       DEFAULT_BATCH_BUCKETS)
+        self.write_latency = r.histogram('uwb_receiver_write_latency_seconds', 'Latencia de escritura+flush a disco.',
+                                         DEFAULT_LATENCY_BUCKETS)
+        r.gauge('uwb_receiver_start_time_seconds', 'Hora (epoch) de arranque del receptor.', func=lambda: self.start_time)
+        if file_size_func is not None:
+            r.gauge('uwb_receiver_log_file_bytes', 'Tamaño actual del archivo de log.', func=file_size_func)
+
+    def record_message(self, topic):
+        self.messages.inc(topic=topic)
+
+    def record_valid(self, tag_id, count=1):
+        self.tag_records.inc(count, tag=tag_id)
+        self.tag_last_seen.set(time.time(), tag=tag_id)
+
+    def record_invalid(self, topic):
+        self.invalid_payloads.inc(topic=topic)
+
+    def record_error(self):
+        self.errors.inc()
+
+    def record_write(self, num_records, elapsed_s):
+        self.write_batch.observe(num_records)
+        self.write_latency.observe(elapsed_s)
+
+
+def start_metrics_server(registry, host='127.0.0.1', port=9108):
+    """Arranca un servidor HTTP en un hilo daemon que sirve /metrics. Devuelve el servidor."""
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Silenciar el log por petición
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    print(f"Endpoint de métricas en http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,155 @@
+# session_cache.py
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+# --- Configuración ---
+CACHE_DIR = 'uwb_cache'              # Carpeta de la caché (junto a uwb_logs_mqtt)
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # Tamaño máximo en disco antes de expulsar entradas (LRU)
+CACHE_FORMAT_VERSION = 2             # Subir si cambia el formato/semántica de alguna etapa
+ENTRY_SUFFIX = '.pkl'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 del contenido de un archivo (la clave no depende del nombre ni de la fecha)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def params_digest(*parts):
+    """SHA-256 de una lista de parámetros serializables a JSON (orden de claves normalizado)."""
+    payload = json.dumps([CACHE_FORMAT_VERSION] + list(parts), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SessionCache:
+    """Caché en disco direccionada por contenido para las etapas del post-procesado.
+
+    Cada entrada es un DataFrame (pickle, conserva los dtypes) cuyo nombre es '<etapa>-<hash>'. Las
+    claves se encadenan: la de 'epochs' incluye la de 'parsed' y la de 'solved' la de 'epochs', así
+    que cambiar solo las anclas o el solver reutiliza el parseo y los epochs. La fecha de
+    modificación de cada entrada marca su último uso y se expulsan las más antiguas al superar max_bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, stage, *parts):
+        return f"{stage}-{params_digest(*parts)[:32]}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """DataFrame guardado con esa clave, o None. Un acierto renueva la entrada para el LRU."""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            df = pd.read_pickle(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"Advertencia: Entrada de caché corrupta {path} ({e}). Se descarta.")
+            self._remove(path)
+            self.misses += 1
+            return None
+        os.utime(path, None)
+        self.hits += 1
+        return df
+
+    def put(self, key, df):
+        """Guarda un DataFrame (escritura atómica) y aplica el límite de tamaño."""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Advertencia: No se pudo guardar en caché {path}: {e}")
+            self._remove(tmp_path)
+            return
+        self.evict(keep=path)
+
+    def entries(self):
+        """Lista de (ruta, tamaño, último uso) de las entradas, de la más antigua a la más reciente."""
+        result = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return result
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((path, st.st_size, st.st_mtime))
+        result.sort(key=lambda entry: entry[2])
+        return result
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Borra las entradas usadas hace más tiempo hasta quedar por debajo de max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            self.evictions += 1
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def summary(self):
+        return f"Caché {self.cache_dir}: {self.hits} aciertos, {self.misses} fallos, {self.evictions} expulsiones"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspecciona o vacía la caché de sesiones procesadas.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--clear', action='store_true', help='Borra todas las entradas.')
+    args = parser.parse_args()
+
+    cache = SessionCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        print(f"Caché {args.cache_dir} vaciada.")
+    else:
+        now = time.time()
+        for path, size, mtime in cache.entries():
+            print(f"{os.path.basename(path):<50} {size / 1024:10.1f} KiB  usada hace {now - mtime:8.0f} s")
+        print(f"Total: {cache.size_bytes() / 1024 ** 2:.1f} MiB (límite {cache.max_bytes / 1024 ** 2:.0f} MiB)")
@@ -0,0 +1,209 @@
+# session_segments.py
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from jitter_buffer import RESET_GAP_MS
+
+# --- Configuración ---
+MAX_GAP_MS = 60000          # Un tag callado más de 1 minuto empieza una sesión nueva
+MILLIS_WRAP = 1 << 32       # millis() es un unsigned long: vuelve a 0 a los ~49,7 días
+WRAP_MARGIN_MS = 60000      # Un salto de menos de esto antes del límite a menos de esto después es una vuelta
+# Motivo por el que empieza una sesión
+REASON_START, REASON_RESET, REASON_GAP = 1, 2, 3
+REASON_NAMES = {REASON_START: 'start', REASON_RESET: 'reset', REASON_GAP: 'gap'}
+
+
+class SessionState:
+    """Estado del segmentador para continuar por donde se quedó (logs que siguen creciendo).
+
+    tags: tag -> (sesión actual, último millis() desenrollado); next_id: siguiente SessionID libre.
+    """
+
+    def __init__(self, tags=None, next_id=0):
+        self.tags = dict(tags or {})
+        self.next_id = next_id
+
+    def advance(self, tag_id, timestamp_ms, max_gap_ms=MAX_GAP_MS, reset_gap_ms=RESET_GAP_MS):
+        """Un registro en orden de llegada (modo en tiempo real), con las mismas reglas que segment_sessions.
+
+        Devuelve (session_id, timestamp desenrollado, motivo): motivo es REASON_* si el registro abre
+        sesión y 0 si sigue en la del tag.
+        """
+        entry = self.tags.get(tag_id)
+        reason = REASON_START
+        wraps = 0
+        if entry is not None:
+            session_id, last_ts = entry
+            prev = last_ts % MILLIS_WRAP
+            step = timestamp_ms - prev
+            wrapped = prev >= MILLIS_WRAP - WRAP_MARGIN_MS and timestamp_ms < WRAP_MARGIN_MS
+            reason = REASON_GAP if step > max_gap_ms else REASON_RESET if step < -reset_gap_ms and not wrapped else 0
+            wraps = last_ts // MILLIS_WRAP + int(wrapped)
+        if reason:
+            session_id = self.next_id
+            self.next_id += 1
+            wraps = 0
+        unwrapped = int(timestamp_ms) + wraps * MILLIS_WRAP
+        self.tags[tag_id] = (session_id, unwrapped)
+        return session_id, unwrapped, reason
+
+    def get_state(self):
+        """Estado serializable a JSON (para checkpoints)."""
+        return {'tags': {str(tag_id): list(entry) for tag_id, entry in self.tags.items()}, 'next_id': self.next_id}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls({int(tag_id): (int(entry[0]), int(entry[1])) for tag_id, entry in state.get('tags', {}).items()},
+                   int(state.get('next_id', 0)))
+
+
+def segment_sessions(tag_ids, timestamps_ms, state=None, max_gap_ms=MAX_GAP_MS, reset_gap_ms=RESET_GAP_MS):
+    """Divide registros en orden de llegada en sesiones (vidas del millis() de cada tag).
+
+    Dentro de cada tag, un salto atrás de más de reset_gap_ms es un reinicio del tag y un salto
+    adelante de más de max_gap_ms un hueco: ambos abren sesión. Pasar de casi 2^32 a casi 0 es
+    la vuelta de millis(): la sesión sigue y el timestamp se desenrolla sumando 2^32. Los saltos
+    atrás pequeños (registros que llegan desordenados) no cortan nada.
+    Los SessionID se numeran por orden de aparición en el archivo, así que añadir datos al final no
+    cambia los ya asignados. Devuelve (session_ids, timestamps desenrollados, motivos, vueltas),
+    todo en el orden de entrada; motivos es REASON_* en la primera fila de cada sesión y 0 en el resto.
+    """
+    state = state if state is not None else SessionState()
+    tags = np.asarray(tag_ids, dtype=np.int64)
+    raw = np.asarray(timestamps_ms, dtype=np.int64)
+    n = len(tags)
+    if n == 0:
+        return (np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int8), np.zeros(0, dtype=bool))
+    # Orden estable por tag: dentro de cada tag se conserva el orden de llegada
+    order = np.argsort(tags, kind='stable')
+    t, ts = tags[order], raw[order]
+    first = np.concatenate(([True], t[1:] != t[:-1]))
+    first_idx = np.flatnonzero(first)
+    prev = np.concatenate(([0], ts[:-1]))
+    known = np.zeros(n, dtype=bool)
+    continued = {}
+    for i in first_idx: # Un bucle por tag, no por registro
+        entry = state.tags.get(int(t[i]))
+        if entry is not None:
+            known[i] = True
+            continued[i] = entry
+            prev[i] = entry[1] % MILLIS_WRAP
+
+    has_prev = ~first | known
+    step = ts - prev
+    wrapped = has_prev & (prev >= MILLIS_WRAP - WRAP_MARGIN_MS) & (ts < WRAP_MARGIN_MS)
+    reasons = np.zeros(n, dtype=np.int8)
+    reasons[first & ~known] = REASON_START
+    reasons[has_prev & ~wrapped & (step < -reset_gap_ms)] = REASON_RESET
+    reasons[has_prev & (step > max_gap_ms)] = REASON_GAP
+    new = reasons > 0
+
+    # Cada tramo (sesión nueva o continuación de la anterior del tag) hereda sesión y vueltas de su primera fila
+    segment_start = new | first
+    start_idx = np.maximum.accumulate(np.where(segment_start, np.arange(n), 0))
+    base_session = np.zeros(n, dtype=np.int64)
+    base_wraps = np.zeros(n, dtype=np.int64)
+    new_idx = np.flatnonzero(new)
+    appearance = np.argsort(np.argsort(order[new_idx], kind='stable'), kind='stable')
+    base_session[new_idx] = state.next_id + appearance
+    for i, (session_id, last_ts) in continued.items():
+        if not new[i]:
+            base_session[i] = session_id
+            base_wraps[i] = last_ts // MILLIS_WRAP + wrapped[i]
+    cumulative_wraps = np.cumsum(wrapped)
+    sessions = base_session[start_idx]
+    wraps = cumulative_wraps - cumulative_wraps[start_idx] + base_wraps[start_idx]
+    unwrapped = ts + wraps * MILLIS_WRAP
+
+    last_idx = np.concatenate((first_idx[1:] - 1, [n - 1]))
+    for i in last_idx:
+        state.tags[int(t[i])] = (int(sessions[i]), int(unwrapped[i]))
+    state.next_id += len(new_idx)
+
+    inverse = np.empty(n, dtype=np.int64)
+    inverse[order] = np.arange(n)
+    return sessions[inverse], unwrapped[inverse], reasons[inverse], wrapped[inverse]
+
+
+def add_session_columns(df, state=None, **kwargs):
+    """Añade 'SessionID' y desenrolla 'Timestamp(ms)' en un DataFrame crudo en orden de llegada."""
+    sessions, unwrapped, _, _ = segment_sessions(df['TagID'].to_numpy(), df['Timestamp(ms)'].to_numpy(), state, **kwargs)
+    return df.assign(**{'Timestamp(ms)': unwrapped, 'SessionID': sessions.astype(np.int32)})
+
+
+def session_table(df, reset_gap_ms=RESET_GAP_MS):
+    """Índice de sesiones de un DataFrame con SessionID: tag, filas, primer/último timestamp y motivo.
+
+    Si df está ordenado por (TagID, SessionID, Timestamp) (sort_by_tag_and_time), RowStart/RowStop
+    son las filas [inicio, fin) de cada sesión: cada una se puede procesar por separado (o en paralelo).
+    """
+    sessions = df['SessionID'].to_numpy()
+    if len(sessions) == 0:
+        return pd.DataFrame(columns=['SessionID', 'TagID', 'Reason', 'Rows', 'FirstTimestamp', 'LastTimestamp',
+                                     'RowStart', 'RowStop'])
+    positions = np.arange(len(df))
+    table = (pd.DataFrame({'SessionID': sessions, 'TagID': df['TagID'].to_numpy().astype(np.int64),
+                           'ts': df['Timestamp(ms)'].to_numpy(), 'row': positions})
+             .groupby('SessionID', sort=True)
+             .agg(TagID=('TagID', 'first'), Rows=('ts', 'size'), FirstTimestamp=('ts', 'min'),
+                  LastTimestamp=('ts', 'max'), RowStart=('row', 'min'), RowStop=('row', 'max'))
+             .reset_index())
+    table['RowStop'] += 1
+    # Motivo: el primero de cada tag es 'start'; el resto, 'reset' si millis() volvió atrás o 'gap' si no
+    previous_last = table.groupby('TagID')['LastTimestamp'].shift()
+    table['Reason'] = np.where(previous_last.isna(), 'start',
+                               np.where(table['FirstTimestamp'] < previous_last - reset_gap_ms, 'reset', 'gap'))
+    return table[['SessionID', 'TagID', 'Reason', 'Rows', 'FirstTimestamp', 'LastTimestamp', 'RowStart', 'RowStop']]
+
+
+def benchmark(num_rows=2000000, num_tags=8, resets_per_tag=3):
+    """Mide la segmentación vectorizada con varios reinicios, huecos y una vuelta de millis()."""
+    rng = np.random.default_rng(0)
+    tags = rng.integers(1, num_tags + 1, num_rows)
+    timestamps = np.zeros(num_rows, dtype=np.int64)
+    expected = 0
+    for tag_id in range(1, num_tags + 1):
+        rows = np.flatnonzero(tags == tag_id)
+        clock = 60000 + np.arange(len(rows)) * 6 + rng.integers(0, 3, len(rows))
+        for cut in np.sort(rng.choice(np.arange(1, len(rows)), resets_per_tag, replace=False)):
+            clock[cut:] -= clock[cut] - rng.integers(1000, 5000) # Reinicio: millis() vuelve a empezar
+        expected += resets_per_tag + 1
+        timestamps[rows] = clock
+    # Tag 1: cerca del límite de millis() para que dé la vuelta
+    rows = np.flatnonzero(tags == 1)
+    timestamps[rows] = (timestamps[rows] + MILLIS_WRAP - 60000 - 6 * (len(rows) // 8)) % MILLIS_WRAP
+    start = time.perf_counter()
+    sessions, unwrapped, reasons, wrapped = segment_sessions(tags, timestamps)
+    elapsed = time.perf_counter() - start
+    print(f"{num_rows} registros, {num_tags} tags: {len(np.unique(sessions))} sesiones (esperadas {expected}), "
+          f"{int(wrapped.sum())} vueltas de millis(), {elapsed * 1000:.0f} ms ({num_rows / elapsed / 1e6:.1f} M registros/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Índice de sesiones (reinicios, huecos y vueltas de millis()) de logs crudos.')
+    parser.add_argument('files', nargs='*', help='Logs crudos (.csv, .bin o comprimidos).')
+    parser.add_argument('--output', default=None, help='Guarda el índice de sesiones en este CSV (con la columna Source).')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N', help='Mide la segmentación con N registros sintéticos.')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    elif not args.files:
+        parser.error('Indica algún log o --benchmark.')
+    from uwb_loader import load_raw_log
+
+    tables = []
+    for path in args.files:
+        try:
+            table = session_table(load_raw_log(path))
+        except ValueError as e:
+            print(f"Advertencia: No se pudo leer {path} ({e}). Se omite.")
+            continue
+        print(f"{path}: {len(table)} sesiones")
+        print(table.to_string(index=False))
+        tables.append(table.assign(Source=path))
+    if args.output and tables:
+        pd.concat(tables, ignore_index=True).to_csv(args.output, index=False)
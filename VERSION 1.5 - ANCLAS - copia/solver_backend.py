@@ -0,0 +1,280 @@
+# solver_backend.py
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+# Numba es opcional: si está instalado se usa automáticamente, si no se usa el backend NumPy.
+# UWB_SOLVER_BACKEND=numpy fuerza el backend NumPy aunque Numba esté disponible.
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+
+# --- Backend NumPy (referencia) ---
+# Las funciones objetivo son bucles escalares sobre floats de Python: con 4-8 anclas el coste fijo
+# de cada operación vectorizada pesa más que el bucle (medido con 'python solver_backend.py').
+
+def _range_error_3d_numpy(point, anchor_positions, measured_distances):
+    """Suma de errores cuadráticos de rango (m^2) para un punto 3D. Ignora distancias <= 0."""
+    px, py, pz = point.tolist()
+    error = 0.0
+    for (ax, ay, az), measured in zip(anchor_positions.tolist(), measured_distances.tolist()):
+        if measured <= 0:
+            continue
+        residual = math.sqrt((ax - px) ** 2 + (ay - py) ** 2 + (az - pz) ** 2) - measured
+        error += residual * residual
+    return error
+
+
+def _range_error_z0_numpy(tag_pos_xy, anchor_positions, measured_distances):
+    """Error cuadrático medio de rango para un tag en Z=0. Ignora distancias NaN; inf si no hay ninguna."""
+    px, py = tag_pos_xy.tolist()
+    error = 0.0
+    count = 0
+    for (ax, ay, az), measured in zip(anchor_positions.tolist(), measured_distances.tolist()):
+        if measured != measured: # NaN
+            continue
+        residual = math.sqrt((ax - px) ** 2 + (ay - py) ** 2 + az * az) - measured
+        error += residual * residual
+        count += 1
+    return error / count if count else np.inf
+
+
+def _accumulate_epochs_numpy(epoch_index, anchor_index, values, num_epochs, num_anchors):
+    """Suma y cuenta valores por (epoch, ancla). values: (N, V). Devuelve (sums, counts) (E, A, V)."""
+    num_values = values.shape[1]
+    flat = epoch_index * num_anchors + anchor_index
+    size = num_epochs * num_anchors
+    sums = np.empty((num_epochs, num_anchors, num_values))
+    counts = np.empty((num_epochs, num_anchors, num_values))
+    for v in range(num_values):
+        col = values[:, v]
+        ok = ~np.isnan(col)
+        sums[:, :, v] = np.bincount(flat[ok], weights=col[ok], minlength=size).reshape(num_epochs, num_anchors)
+        counts[:, :, v] = np.bincount(flat[ok], minlength=size).reshape(num_epochs, num_anchors)
+    return sums, counts
+
+
+# --- Backend Numba (mismas operaciones en bucles compilados) ---
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _range_error_3d_numba(point, anchor_positions, measured_distances):
+        error = 0.0
+        for i in range(anchor_positions.shape[0]):
+            measured = measured_distances[i]
+            if measured <= 0:
+                continue
+            dx = anchor_positions[i, 0] - point[0]
+            dy = anchor_positions[i, 1] - point[1]
+            dz = anchor_positions[i, 2] - point[2]
+            residual = np.sqrt(dx * dx + dy * dy + dz * dz) - measured
+            error += residual * residual
+        return error
+
+    @numba.njit(cache=True)
+    def _range_error_z0_numba(tag_pos_xy, anchor_positions, measured_distances):
+        error = 0.0
+        count = 0
+        for i in range(anchor_positions.shape[0]):
+            measured = measured_distances[i]
+            if np.isnan(measured):
+                continue
+            dx = anchor_positions[i, 0] - tag_pos_xy[0]
+            dy = anchor_positions[i, 1] - tag_pos_xy[1]
+            dz = anchor_positions[i, 2]
+            residual = np.sqrt(dx * dx + dy * dy + dz * dz) - measured
+            error += residual * residual
+            count += 1
+        if count == 0:
+            return np.inf
+        return error / count
+
+    @numba.njit(cache=True)
+    def _accumulate_epochs_numba(epoch_index, anchor_index, values, num_epochs, num_anchors):
+        num_values = values.shape[1]
+        sums = np.zeros((num_epochs, num_anchors, num_values))
+        counts = np.zeros((num_epochs, num_anchors, num_values))
+        for n in range(values.shape[0]):
+            e = epoch_index[n]
+            a = anchor_index[n]
+            for v in range(num_values):
+                x = values[n, v]
+                if not np.isnan(x):
+                    sums[e, a, v] += x
+                    counts[e, a, v] += 1.0
+        return sums, counts
+
+
+class SolverBackend:
+    """Conjunto de funciones numéricas del solver para un backend concreto ('numpy' o 'numba')."""
+
+    def __init__(self, name):
+        if name == 'numba':
+            if not NUMBA_AVAILABLE:
+                raise ValueError("El backend 'numba' no está disponible (pip install numba).")
+            self._range_error_3d = _range_error_3d_numba
+            self._range_error_z0 = _range_error_z0_numba
+            self._accumulate = _accumulate_epochs_numba
+        elif name == 'numpy':
+            self._range_error_3d = _range_error_3d_numpy
+            self._range_error_z0 = _range_error_z0_numpy
+            self._accumulate = _accumulate_epochs_numpy
+        else:
+            raise ValueError(f"Backend de solver desconocido: {name}")
+        self.name = name
+
+    def range_error_3d(self, point, anchor_positions, measured_distances):
+        """Función objetivo de multilateration_3d (suma de errores cuadráticos, m^2)."""
+        return self._range_error_3d(np.asarray(point, dtype=np.float64), anchor_positions, measured_distances)
+
+    def range_error_z0(self, tag_pos_xy, anchor_positions, measured_distances):
+        """Función objetivo del replay opt_post (tag en Z=0, error cuadrático medio)."""
+        return self._range_error_z0(np.asarray(tag_pos_xy, dtype=np.float64), anchor_positions, measured_distances)
+
+    def assemble_epochs(self, timestamps, tag_ids, anchor_ids, values):
+        """Agrupa registros (timestamp, tag, ancla) en epochs, promediando duplicados (como pivot_table).
+
+        Devuelve (epoch_timestamps, epoch_tags, anchors, means) con means de forma (E, A, V),
+        NaN donde un ancla no tiene lectura en el epoch. Los epochs salen ordenados por (timestamp, tag).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        tag_ids = np.asarray(tag_ids, dtype=np.int64)
+        values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(timestamps), -1)
+        # Clave única por (timestamp, tag): millis() cabe de sobra en 47 bits
+        keys = timestamps * 65536 + tag_ids
+        unique_keys, epoch_index = np.unique(keys, return_inverse=True)
+        anchors, anchor_index = np.unique(np.asarray(anchor_ids, dtype=np.int64), return_inverse=True)
+        sums, counts = self._accumulate(epoch_index.astype(np.int64), anchor_index.astype(np.int64), values,
+                                        len(unique_keys), len(anchors))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        means[counts == 0] = np.nan
+        return unique_keys // 65536, unique_keys % 65536, anchors, means
+
+
+def default_backend_name():
+    """'numba' si está instalado (salvo que UWB_SOLVER_BACKEND diga otra cosa), si no 'numpy'."""
+    forced = os.environ.get('UWB_SOLVER_BACKEND')
+    if forced:
+        return forced
+    return 'numba' if NUMBA_AVAILABLE else 'numpy'
+
+
+_backends = {}
+
+
+def get_backend(name=None):
+    """Devuelve (y cachea) el backend pedido o el de por defecto."""
+    name = name or default_backend_name()
+    if name not in _backends:
+        _backends[name] = SolverBackend(name)
+    return _backends[name]
+
+
+def available_backends():
+    return ['numpy'] + (['numba'] if NUMBA_AVAILABLE else [])
+
+
+# --- Verificación y benchmark ---
+
+def _legacy_range_error_3d(point, anchor_positions, measured_distances):
+    """Bucle Python original de multilateration_3d (referencia para el benchmark)."""
+    error = 0
+    for i in range(len(anchor_positions)):
+        if measured_distances[i] <= 0:
+            continue
+        anchor_pos = anchor_positions[i]
+        calculated_dist_sq = ((point[0] - anchor_pos[0])**2 + (point[1] - anchor_pos[1])**2 +
+                              (point[2] - anchor_pos[2])**2)
+        error += (np.sqrt(calculated_dist_sq) - measured_distances[i])**2
+    return error
+
+
+def _synthetic_problem(num_points, num_records, seed=0):
+    rng = np.random.default_rng(seed)
+    anchors = np.array([[0.0, 1.10, 2.0], [0.0, 4.55, 2.0], [3.45, 3.50, 2.0], [3.45, 0.66, 2.0]])
+    points = rng.uniform([0, 0, 0], [3.45, 5.1, 2.0], size=(num_points, 3))
+    dists = np.linalg.norm(points[:, None, :] - anchors[None, :, :], axis=2) + rng.normal(0, 0.05, (num_points, 4))
+    records_ts = 60000 + (np.arange(num_records) // 4) * 50 + rng.integers(0, 3, num_records)
+    records_tag = rng.integers(1, 4, num_records)
+    records_anchor = np.tile([10, 20, 30, 40], -(-num_records // 4))[:num_records]
+    records_values = rng.uniform(50, 600, (num_records, 2))
+    return anchors, points, dists, (records_ts, records_tag, records_anchor, records_values)
+
+
+def verify_backends(num_points=2000, num_records=50000):
+    """Comprueba que todos los backends dan el mismo resultado que NumPy. Devuelve True si coinciden."""
+    anchors, points, dists, records = _synthetic_problem(num_points, num_records)
+    reference = get_backend('numpy')
+    ok = True
+    for name in available_backends():
+        backend = get_backend(name)
+        err3d = np.array([backend.range_error_3d(p, anchors, d) for p, d in zip(points, dists)])
+        ref3d = np.array([reference.range_error_3d(p, anchors, d) for p, d in zip(points, dists)])
+        legacy = np.array([_legacy_range_error_3d(p, anchors, d) for p, d in zip(points, dists)])
+        errz0 = np.array([backend.range_error_z0(p[:2], anchors, d) for p, d in zip(points, dists)])
+        refz0 = np.array([reference.range_error_z0(p[:2], anchors, d) for p, d in zip(points, dists)])
+        epochs = backend.assemble_epochs(*records)
+        ref_epochs = reference.assemble_epochs(*records)
+        diffs = {
+            'range_error_3d': np.max(np.abs(err3d - ref3d)),
+            'range_error_3d vs bucle original': np.max(np.abs(err3d - legacy)),
+            'range_error_z0': np.max(np.abs(errz0 - refz0)),
+            'assemble_epochs': np.nanmax(np.abs(epochs[3] - ref_epochs[3])),
+        }
+        same_layout = all(np.array_equal(a, b) for a, b in zip(epochs[:3], ref_epochs[:3])) and \
+            np.array_equal(np.isnan(epochs[3]), np.isnan(ref_epochs[3]))
+        backend_ok = same_layout and all(np.isclose(d, 0.0, atol=1e-9) for d in diffs.values())
+        ok = ok and backend_ok
+        print(f"[{name}] {'OK' if backend_ok else 'DIFERENCIAS'} " +
+              ', '.join(f"{k}: max|Δ|={v:.2e}" for k, v in diffs.items()))
+    return ok
+
+
+def benchmark(num_points=20000, num_records=1000000):
+    """Mide el tiempo por llamada de la función objetivo y del ensamblador de epochs por backend."""
+    anchors, points, dists, records = _synthetic_problem(num_points, num_records)
+    timings = {}
+    start = time.perf_counter()
+    for p, d in zip(points, dists):
+        _legacy_range_error_3d(p, anchors, d)
+    timings[('range_error_3d', 'python (original)')] = (time.perf_counter() - start) / num_points
+    for name in available_backends():
+        backend = get_backend(name)
+        backend.range_error_3d(points[0], anchors, dists[0]) # Compilar/calentar
+        backend.assemble_epochs(*(r[:100] for r in records))
+        start = time.perf_counter()
+        for p, d in zip(points, dists):
+            backend.range_error_3d(p, anchors, d)
+        timings[('range_error_3d', name)] = (time.perf_counter() - start) / num_points
+        start = time.perf_counter()
+        for p, d in zip(points, dists):
+            backend.range_error_z0(p[:2], anchors, d)
+        timings[('range_error_z0', name)] = (time.perf_counter() - start) / num_points
+        start = time.perf_counter()
+        backend.assemble_epochs(*records)
+        timings[('assemble_epochs', name)] = time.perf_counter() - start
+
+    print(f"Benchmark ({num_points} evaluaciones de la función objetivo, {num_records} registros para epochs)")
+    for (func, name), seconds in timings.items():
+        unit = f"{seconds * 1e6:8.2f} µs/llamada" if func != 'assemble_epochs' else f"{seconds * 1e3:8.2f} ms total"
+        baseline = timings.get((func, 'python (original)'), timings.get((func, 'numpy')))
+        print(f"  {func:16s} {name:18s} {unit}  (x{baseline / seconds:.1f} vs referencia)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verifica y mide los backends del solver (NumPy / Numba).')
+    parser.add_argument('--verify', action='store_true', help='Solo comprobar que los backends coinciden.')
+    args = parser.parse_args()
+    print(f"Backends disponibles: {available_backends()} (por defecto: {default_backend_name()})")
+    ok = verify_backends()
+    if not args.verify:
+        benchmark()
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,393 @@
+# sqlite_store.py
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from session_segments import add_session_columns
+from uwb_loader import RAW_COLUMN_NAMES, drop_invalid_rows, load_raw_log, sort_by_tag_and_time
+
+# --- Configuración ---
+DB_FILE = 'uwb_sessions.db'
+INSERT_BATCH_ROWS = 10000     # Filas por executemany al importar
+WRITER_FLUSH_ROWS = 500       # BatchWriter: insertar cuando se acumulan tantas filas...
+WRITER_FLUSH_S = 1.0          # ...o cuando pasa este tiempo desde la última inserción
+LOG_NAME_TIME_RE = re.compile(r'(\d{8}_\d{6})')   # uwb_log_YYYYMMDD_HHMMSS (hora de apertura del receptor)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    imported_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ranges (
+    tag_id INTEGER NOT NULL,
+    timestamp_ms INTEGER NOT NULL,
+    host_ms INTEGER,
+    anchor_id INTEGER NOT NULL,
+    raw_cm REAL,
+    filtered_cm REAL,
+    rssi REAL,
+    status INTEGER,
+    source_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS positions (
+    tag_id INTEGER NOT NULL,
+    timestamp_ms INTEGER NOT NULL,
+    host_ms INTEGER,
+    x REAL, y REAL, z REAL,
+    source_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS ranges_tag_time ON ranges (tag_id, timestamp_ms);
+CREATE INDEX IF NOT EXISTS ranges_tag_host ON ranges (tag_id, host_ms);
+CREATE INDEX IF NOT EXISTS positions_tag_time ON positions (tag_id, timestamp_ms);
+CREATE INDEX IF NOT EXISTS positions_tag_host ON positions (tag_id, host_ms);
+"""
+RANGE_COLUMNS = ['tag_id', 'timestamp_ms', 'host_ms', 'anchor_id', 'raw_cm', 'filtered_cm', 'rssi', 'status', 'source_id']
+POSITION_COLUMNS = ['tag_id', 'timestamp_ms', 'host_ms', 'x', 'y', 'z', 'source_id']
+
+
+def parse_time(value):
+    """'2025-05-04 17:05:00' (hora local, ISO) o milisegundos epoch -> milisegundos epoch. None pasa tal cual."""
+    if value is None or isinstance(value, (int, float, np.integer)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def log_start_ms(path):
+    """Hora (epoch ms) en que el receptor abrió el log, sacada del nombre; si no, la de modificación."""
+    match = LOG_NAME_TIME_RE.search(os.path.basename(path))
+    if match:
+        return int(datetime.datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').timestamp() * 1000)
+    return int(os.path.getmtime(path) * 1000)
+
+
+def estimate_host_ms(tag_ids, timestamps_ms, start_ms, session_ids=None):
+    """Hora del host aproximada: apertura del log + millis() transcurridos desde la primera medida del tag.
+
+    Con session_ids (session_segments.py), las sesiones de cada tag se encadenan con
+    session_host_offsets: tras un reinicio millis() vuelve a empezar, pero el tiempo del host no.
+    """
+    tag_ids = np.asarray(tag_ids)
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    if session_ids is None:
+        first_ts = pd.Series(timestamps_ms).groupby(tag_ids).transform('min').to_numpy()
+        return start_ms + (timestamps_ms - first_ts)
+    session_ids = np.asarray(session_ids)
+    spans = pd.DataFrame({'tag': tag_ids, 'ts': timestamps_ms}).groupby(session_ids, sort=True).agg(
+        tag=('tag', 'first'), first=('ts', 'min'), last=('ts', 'max'))
+    offsets = session_host_offsets(spans)
+    return (start_ms + (timestamps_ms - spans['first'].reindex(session_ids).to_numpy())
+            + offsets.reindex(session_ids).to_numpy())
+
+
+def session_host_offsets(spans):
+    """Milisegundos del host desde el inicio del tag hasta el de cada sesión (spans: tag, first, last por sesión).
+
+    Tras un hueco millis() siguió contando y la distancia es real; tras un reinicio no se sabe
+    cuánto estuvo apagado el tag y la sesión se coloca justo después de la anterior.
+    """
+    by_tag = spans.groupby('tag')
+    prev_first = by_tag['first'].shift()
+    step = (np.maximum(by_tag['last'].shift(), spans['first']) - prev_first).fillna(0)
+    return step.groupby(spans['tag']).cumsum().astype(np.int64)
+
+
+class UwbDatabase:
+    """Medidas de rango y posiciones de varias sesiones en SQLite (WAL), indexadas por (tag, tiempo).
+
+    Cada fila guarda el timestamp del tag (millis()) y una hora del host (host_ms, epoch en ms) para
+    poder pedir "tag 3 entre las 10:05 y las 10:07" sin saber de qué archivo salió.
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL') # Con WAL es seguro ante caídas del proceso
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def source_id(self, name, kind):
+        """ID de la fuente (archivo o proceso en vivo), creándola si no existe."""
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM sources WHERE name = ?', (name,)).fetchone()
+            if row:
+                return row[0]
+            cursor = self.conn.execute('INSERT INTO sources (name, kind, imported_at) VALUES (?, ?, ?)',
+                                       (name, kind, time.time()))
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def has_source(self, name):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM sources WHERE name = ?', (name,)).fetchone() is not None
+
+    def delete_source(self, name):
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM sources WHERE name = ?', (name,)).fetchone()
+            if row:
+                self.conn.execute('DELETE FROM ranges WHERE source_id = ?', row)
+                self.conn.execute('DELETE FROM positions WHERE source_id = ?', row)
+                self.conn.execute('DELETE FROM sources WHERE id = ?', row)
+                self.conn.commit()
+
+    def _insert(self, table, columns, rows):
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        with self.lock:
+            self.conn.executemany(sql, rows)
+            self.conn.commit()
+
+    def insert_ranges(self, rows):
+        """rows: iterable de tuplas en el orden de RANGE_COLUMNS."""
+        self._insert('ranges', RANGE_COLUMNS, rows)
+
+    def insert_positions(self, rows):
+        """rows: iterable de tuplas en el orden de POSITION_COLUMNS."""
+        self._insert('positions', POSITION_COLUMNS, rows)
+
+    def _bulk_insert(self, table, columns, frame):
+        for start in range(0, len(frame), INSERT_BATCH_ROWS):
+            chunk = frame.iloc[start:start + INSERT_BATCH_ROWS]
+            # itertuples da tipos de Python (sqlite3 no acepta numpy.int64); NaN -> NULL
+            rows = [tuple(None if isinstance(v, float) and v != v else v for v in row)
+                    for row in chunk[columns].astype(object).itertuples(index=False, name=None)]
+            self._insert(table, columns, rows)
+
+    def import_raw_log(self, path, replace=False):
+        """Importa un log crudo (.csv/.gz/.zst/.bin). Devuelve el número de filas insertadas."""
+        name = os.path.abspath(path)
+        if self.has_source(name):
+            if not replace:
+                print(f"{path} ya está importado (usa --replace para volver a importarlo).")
+                return 0
+            self.delete_source(name)
+        df = load_raw_log(path, usecols=RAW_COLUMN_NAMES)
+        source = self.source_id(name, 'raw')
+        frame = pd.DataFrame({
+            'tag_id': df['TagID'].astype(np.int64),
+            'timestamp_ms': df['Timestamp(ms)'].astype(np.int64),
+            'host_ms': estimate_host_ms(df['TagID'], df['Timestamp(ms)'], log_start_ms(path), df['SessionID']),
+            'anchor_id': df['AnchorID'].astype(np.int64),
+            'raw_cm': df['RawDistance(cm)'].astype(np.float64) if 'RawDistance(cm)' in df else np.nan,
+            'filtered_cm': df['FilteredDistance(cm)'].astype(np.float64),
+            'rssi': df['RSSI(dBm)'].astype(np.float64) if 'RSSI(dBm)' in df else np.nan,
+            'status': pd.to_numeric(df['AnchorStatus'].astype(str), errors='coerce') if 'AnchorStatus' in df else np.nan,
+            'source_id': source,
+        })
+        self._bulk_insert('ranges', RANGE_COLUMNS, frame)
+        return len(frame)
+
+    def import_processed(self, path, replace=False):
+        """Importa un CSV procesado (Timestamp(ms), TagID, [SessionID,] Position_X/Y/Z)."""
+        name = os.path.abspath(path)
+        if self.has_source(name):
+            if not replace:
+                print(f"{path} ya está importado (usa --replace para volver a importarlo).")
+                return 0
+            self.delete_source(name)
+        columns = ['Timestamp(ms)', 'TagID', 'SessionID', 'Position_X', 'Position_Y', 'Position_Z']
+        df = pd.read_csv(path, usecols=lambda c: c in columns)
+        # Hora del host con todos los epochs (como import_raw_log), antes de quitar los que no tienen posición
+        host_ms = estimate_host_ms(df['TagID'], df['Timestamp(ms)'], log_start_ms(path),
+                                   df['SessionID'] if 'SessionID' in df else None)
+        solved = df[['Position_X', 'Position_Y']].notna().all(axis=1).to_numpy()
+        df = df[solved]
+        source = self.source_id(name, 'processed')
+        frame = pd.DataFrame({
+            'tag_id': df['TagID'].astype(np.int64),
+            'timestamp_ms': df['Timestamp(ms)'].astype(np.int64),
+            'host_ms': host_ms[solved],
+            'x': df['Position_X'], 'y': df['Position_Y'], 'z': df['Position_Z'],
+            'source_id': source,
+        })
+        self._bulk_insert('positions', POSITION_COLUMNS, frame)
+        return len(frame)
+
+    def _query(self, table, columns, tag_ids, start, end, clock):
+        time_col = 'host_ms' if clock == 'host' else 'timestamp_ms'
+        where, params = [], []
+        if tag_ids is not None:
+            tag_ids = [int(t) for t in np.atleast_1d(tag_ids)]
+            where.append(f"tag_id IN ({', '.join('?' * len(tag_ids))})")
+            params.extend(tag_ids)
+        if start is not None:
+            where.append(f'{time_col} >= ?')
+            params.append(parse_time(start))
+        if end is not None:
+            where.append(f'{time_col} <= ?')
+            params.append(parse_time(end))
+        sql = f"SELECT {', '.join(columns)} FROM {table}"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY tag_id, {time_col}'
+        with self.lock:
+            df = pd.read_sql_query(sql, self.conn, params=params)
+        return {col: df[col].to_numpy() for col in columns}
+
+    def query_ranges(self, tag_ids=None, start=None, end=None, clock='host'):
+        """Medidas de rango en [start, end] como dict de arrays NumPy (ordenadas por tag y tiempo).
+
+        clock='host' filtra por hora del host (ISO local o epoch ms); clock='device' por millis() del tag.
+        """
+        return self._query('ranges', RANGE_COLUMNS[:-1], tag_ids, start, end, clock)
+
+    def query_positions(self, tag_ids=None, start=None, end=None, clock='host'):
+        """Posiciones en [start, end] como dict de arrays NumPy (ver query_ranges)."""
+        return self._query('positions', POSITION_COLUMNS[:-1], tag_ids, start, end, clock)
+
+    def load_raw_frame(self, tag_ids=None, start=None, end=None, clock='host'):
+        """Medidas de rango con las columnas y dtypes de uwb_loader, para las herramientas de archivo.
+
+        Las sesiones (SessionID) se detectan en orden de hora del host, que es el de llegada.
+        """
+        ranges = self.query_ranges(tag_ids, start, end, clock)
+        if clock != 'host':
+            order = np.lexsort((ranges['host_ms'], ranges['tag_id']))
+            ranges = {col: values[order] for col, values in ranges.items()}
+        df = pd.DataFrame({
+            'TagID': ranges['tag_id'], 'Timestamp(ms)': ranges['timestamp_ms'], 'AnchorID': ranges['anchor_id'],
+            'RawDistance(cm)': ranges['raw_cm'], 'FilteredDistance(cm)': ranges['filtered_cm'],
+            'RSSI(dBm)': ranges['rssi'], 'AnchorStatus': pd.Series(ranges['status']).astype('Int64').astype(str),
+        })
+        return sort_by_tag_and_time(add_session_columns(drop_invalid_rows(df)))
+
+    def summary(self):
+        with self.lock:
+            sources = self.conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+            ranges = self.conn.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT tag_id), MIN(host_ms), MAX(host_ms) FROM ranges').fetchone()
+            positions = self.conn.execute('SELECT COUNT(*) FROM positions').fetchone()[0]
+        span = ''
+        if ranges[2] is not None:
+            first, last = (datetime.datetime.fromtimestamp(ms / 1000).isoformat(sep=' ', timespec='seconds')
+                           for ms in ranges[2:])
+            span = f", de {first} a {last}"
+        return (f"{self.path}: {sources} fuentes, {ranges[0]} medidas de {ranges[1]} tags{span}, "
+                f"{positions} posiciones")
+
+
+class BatchWriter:
+    """Acumula filas de los procesos en vivo y las inserta en lotes (executemany).
+
+    source_id identifica en la base al proceso que escribe (ver UwbDatabase.source_id).
+    """
+
+    def __init__(self, db, table, source_id=None, flush_rows=WRITER_FLUSH_ROWS, flush_s=WRITER_FLUSH_S):
+        self.db = db
+        self.source_id = source_id
+        self.insert = db.insert_ranges if table == 'ranges' else db.insert_positions
+        self.flush_rows = flush_rows
+        self.flush_s = flush_s
+        self._rows = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.rows_written = 0
+
+    def add(self, rows):
+        with self._lock:
+            self._rows.extend(rows)
+            due = len(self._rows) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_s
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+        if rows:
+            self.insert(rows)
+            self.rows_written += len(rows)
+
+
+def csv_lines_to_range_rows(lines, host_ms, source_id):
+    """Líneas del firmware -> filas de 'ranges' (las inválidas se saltan)."""
+    rows = []
+    for line in lines:
+        fields = line.split(',')
+        try:
+            rows.append((int(fields[0]), int(fields[1]), host_ms, int(fields[2]), float(fields[3]), float(fields[4]),
+                         float(fields[5]), int(fields[6]) if len(fields) > 6 else None, source_id))
+        except (ValueError, IndexError):
+            continue
+    return rows
+
+
+def binary_records_to_range_rows(records, host_ms, source_id):
+    """Registros binarios (binary_records.RECORD_DTYPE) -> filas de 'ranges'."""
+    return list(zip(records['tag_id'].tolist(), records['timestamp_ms'].tolist(), [host_ms] * len(records),
+                    records['anchor_id'].tolist(), records['raw_cm'].tolist(), records['filtered_cm'].tolist(),
+                    (records['rssi_cdbm'] / 100.0).tolist(), records['status'].tolist(), [source_id] * len(records)))
+
+
+def benchmark(db_path, num_rows=1000000, num_tags=8):
+    """Inserta num_rows medidas sintéticas y mide una consulta de 2 minutos de un tag."""
+    rng = np.random.default_rng(0)
+    db = UwbDatabase(db_path)
+    source = db.source_id(f'benchmark-{time.time()}', 'benchmark')
+    start_ms = int(time.time() * 1000)
+    per_tag = num_rows // num_tags
+    timestamps = 60000 + np.tile(np.arange(per_tag) * 25, num_tags)
+    frame = pd.DataFrame({
+        'tag_id': np.repeat(np.arange(1, num_tags + 1), per_tag), 'timestamp_ms': timestamps,
+        'host_ms': start_ms + timestamps - 60000, 'anchor_id': np.tile([10, 20, 30, 40], num_tags * per_tag // 4 + 1)[:num_tags * per_tag],
+        'raw_cm': rng.uniform(50, 600, num_tags * per_tag), 'filtered_cm': rng.uniform(50, 600, num_tags * per_tag),
+        'rssi': rng.uniform(-95, -60, num_tags * per_tag), 'status': 1, 'source_id': source,
+    })
+    t0 = time.perf_counter()
+    db._bulk_insert('ranges', RANGE_COLUMNS, frame)
+    t_insert = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    window_start = start_ms + (per_tag * 25) // 2
+    result = db.query_ranges(3, window_start, window_start + 120000)
+    t_query = time.perf_counter() - t0
+    print(f"Insertadas {len(frame)} medidas en {t_insert:.2f} s ({len(frame) / t_insert:.0f} filas/s)")
+    print(f"Consulta tag 3, 2 minutos: {len(result['tag_id'])} medidas en {t_query * 1000:.1f} ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Almacén SQLite de medidas y posiciones UWB con consultas por rango de tiempo.')
+    parser.add_argument('--db', default=DB_FILE, help=f'Base de datos SQLite (por defecto {DB_FILE}).')
+    parser.add_argument('--import-raw', nargs='+', default=[], metavar='LOG', help='Importa logs crudos.')
+    parser.add_argument('--import-processed', nargs='+', default=[], metavar='CSV', help='Importa CSV procesados.')
+    parser.add_argument('--replace', action='store_true', help='Vuelve a importar archivos ya importados.')
+    parser.add_argument('--export', default=None, metavar='CSV',
+                        help='Exporta a un log crudo CSV las medidas de --tag entre --from y --to.')
+    parser.add_argument('--tag', type=int, nargs='*', default=None)
+    parser.add_argument('--from', dest='start', default=None, help="Inicio: '2025-05-04 17:05:00' (hora local) o epoch ms.")
+    parser.add_argument('--to', dest='end', default=None, help='Fin (mismo formato que --from).')
+    parser.add_argument('--clock', choices=('host', 'device'), default='host',
+                        help="Reloj de --from/--to: 'host' (hora del PC) o 'device' (millis() del tag).")
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N', help='Inserta N medidas sintéticas y mide una consulta.')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.db, args.benchmark)
+        exit(0)
+    db = UwbDatabase(args.db)
+    for path in args.import_raw:
+        t0 = time.perf_counter()
+        print(f"{path}: {db.import_raw_log(path, replace=args.replace)} medidas importadas ({time.perf_counter() - t0:.2f} s)")
+    for path in args.import_processed:
+        print(f"{path}: {db.import_processed(path, replace=args.replace)} posiciones importadas")
+    if args.export:
+        df = db.load_raw_frame(args.tag, args.start, args.end, args.clock)
+        df.to_csv(args.export, index=False)
+        print(f"{len(df)} medidas exportadas a {args.export}")
+    print(db.summary())
+    db.close()
@@ -1,3 +1,4 @@
+import argparse
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -9,9 +10,11 @@ from tkinter import Tk, filedialog
 import datetime
 import time
 from collections import deque # Para la trayectoria
+from trajectory_store import trajectories_from_processed
+from post_process_data import ANCHOR_COLORS, CONFIG_SECTIONS
 
 class TagReplay:
-    def __init__(self):
+    def __init__(self, session_to_show=None):
         # Configuración del espacio experimental (3.45m x 5.1m)
         self.field_length = 5.1   # metros (largo)
         self.field_width = 3.45   # metros (ancho)
@@ -28,7 +31,7 @@ class TagReplay:
         }
         
         self.data = None
-        self.all_data = {} # Store data per tag_id (ahora del archivo procesado)
+        self.all_data = {} # TagTrajectory por tag_id (del archivo procesado)
         self.animation = None
         self.fig = None
         self.ax = None
@@ -45,6 +48,7 @@ class TagReplay:
         self.play_speed = 1.0 
         self.tag_ids_available = []
         self.selected_tag_id = None # Track which tag is being displayed
+        self.session_to_show = session_to_show # SessionID (session_segments.py); por defecto la primera de cada tag
 
         # Cargar posiciones guardadas de anchors si existen
         self.config_file = 'anchor_positions.json'
@@ -57,13 +61,19 @@ class TagReplay:
                 with open(self.config_file, 'r') as f:
                     config = json.load(f)
                     for anchor_id_str, data in config.items():
+                        if anchor_id_str in CONFIG_SECTIONS:
+                            continue
                         anchor_id = int(anchor_id_str)
-                        if anchor_id in self.anchors:
-                            # Ensure position includes Z, default to self.anchor_height if missing
-                            pos = data.get('position', [0, 0, self.anchor_height])
-                            if len(pos) == 2:
-                                pos.append(self.anchor_height) # Add Z if only X,Y saved
-                            self.anchors[anchor_id]['position'] = pos[:3] # Take only X,Y,Z
+                        if anchor_id not in self.anchors:
+                            # Ancla nueva (instalaciones con más de 4): color por orden de aparición
+                            color = ANCHOR_COLORS[len(self.anchors) % len(ANCHOR_COLORS)]
+                            self.anchors[anchor_id] = {'position': [0, 0, self.anchor_height], 'color': color,
+                                                       'label': f'Anchor {anchor_id}'}
+                        # Ensure position includes Z, default to self.anchor_height if missing
+                        pos = data.get('position', [0, 0, self.anchor_height])
+                        if len(pos) == 2:
+                            pos.append(self.anchor_height) # Add Z if only X,Y saved
+                        self.anchors[anchor_id]['position'] = pos[:3] # Take only X,Y,Z
                 print(f"Posiciones de anchors cargadas desde {self.config_file}")
             except Exception as e:
                 print(f"Error al cargar posiciones de anchors: {e}. Usando predeterminadas.")
@@ -78,11 +88,18 @@ class TagReplay:
                  self.anchors[aid]['position'] = data['position'][:2] + [self.anchor_height]
             elif len(data['position']) > 3:
                  self.anchors[aid]['position'] = data['position'][:3]
+        # El área cubre todas las anclas (p. ej. una pista completa)
+        self.field_width = max([self.field_width] + [data['position'][0] for data in self.anchors.values()])
+        self.field_length = max([self.field_length] + [data['position'][1] for data in self.anchors.values()])
 
     def save_anchor_positions(self):
         """Guarda las posiciones de los anchors en un archivo de configuración."""
         try:
             config = {}
+            if os.path.exists(self.config_file):
+                # Conservar el resto del config (field_settings: solver, alturas de tags, max_anchors...)
+                with open(self.config_file, 'r') as f:
+                    config = {key: value for key, value in json.load(f).items() if key in CONFIG_SECTIONS}
             for anchor_id, data in self.anchors.items():
                 config[str(anchor_id)] = {'position': data['position'][:3]} # Save X,Y,Z
             
@@ -177,31 +194,30 @@ class TagReplay:
             df['TagID'] = df['TagID'].astype(int)
             df['Timestamp(ms)'] = df['Timestamp(ms)'].astype(int)
 
-            # Ordenar por timestamp (aunque ya debería estarlo)
-            df.sort_values(by='Timestamp(ms)', inplace=True)
+            # Ordenar por sesión y timestamp: tras un reinicio del tag millis() vuelve a empezar
+            sort_keys = ['SessionID', 'Timestamp(ms)'] if 'SessionID' in df.columns else ['Timestamp(ms)']
+            df.sort_values(by=sort_keys, inplace=True)
             df.reset_index(drop=True, inplace=True)
 
-            # Agrupar por Tag ID y convertir a formato de lista de diccionarios
-            self.all_data = {}
-            for tag_id, group in df.groupby('TagID'):
-                tag_data_list = []
-                for _, row in group.iterrows():
-                    distances = {aid: row.get(f'FilteredDistance_{aid}', np.nan) / 100.0 
-                                 for aid in self.anchors.keys()} # Convertir a metros
-                    rssis = {aid: row.get(f'RSSI_{aid}', np.nan) 
-                             for aid in self.anchors.keys()}
-                    # La posición ya está calculada
-                    position_3d = [row['Position_X'], row['Position_Y'], row['Position_Z']]
-                    
-                    tag_data_list.append({
-                        'timestamp': row['Timestamp(ms)'],
-                        'position': position_3d, # Almacenar [X, Y, Z]
-                        'distances': distances, # Distancias en metros
-                        'rssis': rssis,
-                        # Podríamos añadir AnchorStatus si esa columna se mantiene en el procesado
-                        # 'statuses': {aid: row.get(f'AnchorStatus_{aid}', 0) for aid in self.anchors.keys()} 
-                    })
-                self.all_data[tag_id] = tag_data_list
+            session_ids = {}
+            if 'SessionID' in df.columns:
+                df['SessionID'] = df['SessionID'].astype(int)
+                tag_sessions = df.groupby('TagID')['SessionID'].unique()
+                session_tag = {int(sid): int(tag) for tag, sids in tag_sessions.items() for sid in sids}
+                if self.session_to_show is not None:
+                    if self.session_to_show in session_tag:
+                        session_ids[session_tag[self.session_to_show]] = self.session_to_show
+                    else:
+                        print(f"Advertencia: La sesión {self.session_to_show} no está en el archivo. Sesiones: {sorted(session_tag)}")
+                        self.session_to_show = None
+                for tag, sids in tag_sessions.items():
+                    if len(sids) > 1:
+                        shown = session_ids.get(int(tag), int(sids[0]))
+                        print(f"El Tag {tag} tiene {len(sids)} sesiones {sorted(int(x) for x in sids)}; "
+                              f"mostrando la {shown} (elige otra con --session).")
+
+            # Agrupar por Tag ID (una sesión por tag) en trayectorias de arrays tipados (distancias en metros)
+            self.all_data = trajectories_from_processed(df, self.anchors.keys(), session_ids)
             
             self.tag_ids_available = sorted(list(self.all_data.keys()))
 
@@ -210,6 +226,8 @@ class TagReplay:
                 return False
 
             self.selected_tag_id = self.tag_ids_available[0]
+            if session_ids:
+                self.selected_tag_id = next(iter(session_ids))
             self.total_frames = len(self.all_data[self.selected_tag_id])
             self.current_frame = 0 
             
@@ -265,9 +283,10 @@ class TagReplay:
         # --- Plot inicial para el tag y su rastro --- 
         if self.selected_tag_id and self.selected_tag_id in self.all_data:
             initial_pos = [np.nan, np.nan]
-            if len(self.all_data[self.selected_tag_id]) > 0:
-                first_valid_pos = next((p['position'] for p in self.all_data[self.selected_tag_id] if not np.isnan(p['position'][0])), None)
-                if first_valid_pos: initial_pos = first_valid_pos[:2] # Usar X,Y
+            trajectory = self.all_data[self.selected_tag_id]
+            first_valid = trajectory.first_valid_index()
+            if first_valid is not None:
+                initial_pos = trajectory.positions[first_valid, :2] # Usar X,Y
             
             # Plot del tag
             self.tag_plots[self.selected_tag_id] = self.ax.plot(initial_pos[0], initial_pos[1], 'X', markersize=12, color='black', label=f'Tag {self.selected_tag_id}')[0]
@@ -318,11 +337,11 @@ class TagReplay:
              print(f"Frame {frame} fuera de rango para tag {self.selected_tag_id}")
              return []
              
-        current_data = self.all_data[self.selected_tag_id][frame]
-        position_3d = current_data['position'] # Leer [X, Y, Z] directamente
-        distances = current_data['distances']
-        # statuses = current_data['statuses'] # Si añadimos status al procesado
-        timestamp_ms = current_data['timestamp']
+        trajectory = self.all_data[self.selected_tag_id]
+        current_data = trajectory[frame]
+        position_3d = current_data.position # Leer [X, Y, Z] directamente
+        distances = current_data.distances # Distancias (m), columna por ancla
+        timestamp_ms = current_data.timestamp
 
         position_xy = [np.nan, np.nan] # Posición 2D para plotear
         position_z = np.nan # Coordenada Z
@@ -361,7 +380,7 @@ class TagReplay:
 
         # Actualizar círculos de radio y estado de anchors
         for anchor_id, props in self.anchors.items():
-            dist = distances.get(anchor_id, np.nan)
+            dist = float(distances[trajectory.anchor_column(anchor_id)])
             # Necesitamos leer el status si está disponible
             # status = statuses.get(anchor_id, 0) 
             status = 1 if pd.notna(dist) and dist > 0 else 0 # Asumir OK si hay distancia válida
@@ -384,7 +403,7 @@ class TagReplay:
         self.info_text.set_text(info_str)
         
         # Actualizar tiempo
-        elapsed_time_s = (timestamp_ms - self.all_data[self.selected_tag_id][0]['timestamp']) / 1000.0
+        elapsed_time_s = (timestamp_ms - trajectory.timestamps[0]) / 1000.0
         self.time_text.set_text(f'Tiempo: {elapsed_time_s:.2f} s')
 
         # Devolver los elementos modificados para blitting
@@ -449,7 +468,7 @@ class TagReplay:
         file_path = filedialog.askopenfilename(
             title="Seleccione un archivo CSV PROCESADO (con posiciones)",
             initialdir=initial_dir,
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+            filetypes=[("CSV files", "*.csv"), ("Compressed CSV", "*.csv.gz *.csv.zst"), ("All files", "*.*")]
         )
         
         root.destroy()
@@ -468,9 +487,7 @@ class TagReplay:
             return
         
         # Extraer posiciones X,Y válidas directamente
-        positions_array = np.array([p['position'][:2] 
-                                 for p in self.all_data[self.selected_tag_id] 
-                                 if p['position'] is not None and not np.isnan(p['position'][0])])
+        positions_array = self.all_data[self.selected_tag_id].valid_xy()
         
         if positions_array.shape[0] == 0:
              print("No hay posiciones válidas...")
@@ -548,6 +565,10 @@ class TagReplay:
         plt.show()
 
 if __name__ == "__main__":
-    replay = TagReplay()
+    parser = argparse.ArgumentParser(description='Replay de un archivo procesado (con posiciones).')
+    parser.add_argument('--session', type=int, default=None,
+                        help='SessionID a mostrar (por defecto la primera de cada tag; ver session_segments.py).')
+    args = parser.parse_args()
+    replay = TagReplay(session_to_show=args.session)
     # replay.setup_anchors() # Descomentar si quieres configurar anchors al inicio
     replay.run()
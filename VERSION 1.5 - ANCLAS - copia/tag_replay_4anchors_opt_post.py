@@ -6,32 +6,52 @@ import matplotlib.image as mpimg
 import os
 import json
 from tkinter import Tk, filedialog
-from scipy.optimize import minimize
 import datetime
 import time
+from uwb_loader import RawLogTable, load_raw_log
+from position_solvers import available_solvers, get_solver
+from anchor_selection import AnchorSelector
+from post_process_data import ANCHOR_COLORS, ANCHOR_CONFIG_FILE, load_anchor_map
+from session_cache import SessionCache, file_digest
+from trajectory_store import TagTrajectory
+
+KEYFRAME_INTERVAL = 50 # Frames entre checkpoints del estado del solver (coste máximo de un salto)
+RAW_USECOLS = ['TagID', 'Timestamp(ms)', 'AnchorID', 'FilteredDistance(cm)', 'RSSI(dBm)']
+DEFAULT_REPLAY_SOLVER = 'tag_z0_2d' # Tag en Z=0 (position_solvers.py), salvo que el config elija otro
 
 class TagReplay:
-    def __init__(self, tag_id_to_show=None):
+    def __init__(self, tag_id_to_show=None, raw_source=None, session_to_show=None, solver=None, max_anchors=None):
         # Configuración del espacio experimental
         self.field_length = 5.1   # metros (largo, eje Y)
         self.field_width = 3.45   # metros (ancho, eje X)
         self.anchor_height = 1.5 
         self.time_window_ms = 100 # Ventana de tiempo en ms para agrupar lecturas
+        self.trail_length = 200 # Frames del rastro (un frame por lectura: ~50 epochs con 4 anclas)
         
-        # Posiciones de los anchors (x, y, z) en metros
-        self.anchors = {
-            10: {'position': np.array([0.0, 1.10, self.anchor_height]), 'color': 'red', 'label': 'Anchor 10'},
-            20: {'position': np.array([0.0, 4.55, self.anchor_height]), 'color': 'green', 'label': 'Anchor 20'},
-            30: {'position': np.array([3.45, 4.55, self.anchor_height]), 'color': 'blue', 'label': 'Anchor 30'},
-            40: {'position': np.array([3.45, 1.10, self.anchor_height]), 'color': 'purple', 'label': 'Anchor 40'},
-        }
+        # Posiciones de los anchors (x, y, z) en metros: todas las del config; si no hay, las predeterminadas
+        anchor_map = load_anchor_map(ANCHOR_CONFIG_FILE)
+        if len(anchor_map) < 3:
+            anchor_map = {10: [0.0, 1.10, self.anchor_height], 20: [0.0, 4.55, self.anchor_height],
+                          30: [3.45, 4.55, self.anchor_height], 40: [3.45, 1.10, self.anchor_height]}
+        self.anchors = {aid: {'position': np.array(pos, dtype=np.float64), 'color': ANCHOR_COLORS[i % len(ANCHOR_COLORS)],
+                              'label': f'Anchor {aid}'}
+                        for i, (aid, pos) in enumerate(sorted(anchor_map.items()))}
         self.anchor_ids = list(self.anchors.keys())
+        # El área cubre todas las anclas (p. ej. una pista completa)
+        self.field_width = max(self.field_width, max(props['position'][0] for props in self.anchors.values()))
+        self.field_length = max(self.field_length, max(props['position'][1] for props in self.anchors.values()))
+        self.selector = AnchorSelector({aid: props['position'] for aid, props in self.anchors.items()}, max_anchors,
+                                       config_file=ANCHOR_CONFIG_FILE)
         self.anchor_coords_array = np.array([self.anchors[aid]['position'] for aid in self.anchor_ids])
 
         self.tag_id_to_show = tag_id_to_show
+        self.session_to_show = session_to_show # SessionID (session_segments.py); por defecto la primera del tag
         self.filepath = None
-        self.df_all = None # DataFrame con todos los datos crudos
-        self.tag_data_raw = None # DataFrame con datos crudos del tag seleccionado
+        self.raw_source = raw_source # (descripción, función que devuelve el DataFrame crudo), p. ej. una consulta SQLite
+        self.df_all = None # DataFrame con todos los datos crudos (ordenado por TagID, Timestamp)
+        self.raw_table = None # RawLogTable sobre df_all (vistas por tag)
+        self.tag_data_raw = None # Vista (no copia) de los datos crudos del tag seleccionado
+        self.tag_timestamps_raw = None # Timestamps (ms) de tag_data_raw como array NumPy ordenado
         self.timestamps = [] # Lista de timestamps únicos para los frames de la animación
         # self.positions = [] # Ya no precalculamos
         # self.position_qualities = [] 
@@ -50,63 +70,103 @@ class TagReplay:
         self.tag_select_menu = None
         self.legend = None
         self.last_valid_position = None # Para mostrar si falla el cálculo actual
+        self.keyframe_interval = KEYFRAME_INTERVAL
+        self.keyframes = [] # keyframes[k]: estado del solver justo antes del frame k * keyframe_interval
+        self.solved_frame = -1 # Último frame resuelto; el estado actual corresponde a él
+        self.trajectory = None # TagTrajectory con los frames resueltos (se rellena en la pasada de precálculo)
+        self.path_line = None
+        self.solver = get_solver(solver, default=DEFAULT_REPLAY_SOLVER) # Por nombre (position_solvers.py)
 
-    def _error_function(self, tag_pos_xy, anchor_positions, measured_distances):
-        """Función de error para la optimización (diferencia cuadrática de distancias)."""
-        tag_pos_3d = np.array([tag_pos_xy[0], tag_pos_xy[1], 0.0]) # Asumir Z=0
-        error = 0.0
-        valid_measurements = 0
-        for i in range(len(anchor_positions)):
-            if measured_distances[i] is not None and not np.isnan(measured_distances[i]): # Check for None too
-                calculated_distance = np.linalg.norm(tag_pos_3d - anchor_positions[i])
-                error += (calculated_distance - measured_distances[i])**2
-                valid_measurements += 1
-        return error / valid_measurements if valid_measurements > 0 else np.inf
-
-    def calculate_position(self, measured_distances):
-        """Calcula la posición 2D usando optimización (minimize)."""
+    def calculate_position(self, measured_distances, measured_rssi=None):
+        """Calcula la posición 2D con el solver elegido, arrancando desde la última posición válida.
+
+        measured_rssi (dict ancla -> dBm) entra en la selección de anclas igual que en post_process_data.
+        """
         valid_indices = [i for i, d in enumerate(measured_distances) if d is not None and not np.isnan(d) and d > 0.01] # Añadir d > 0.01
         
         if len(valid_indices) < 3:
             return None, None, np.inf 
+        if len(valid_indices) > self.selector.max_anchors > 0:
+            # Muchas anclas: solo las K mejores por geometría y señal
+            selected = self.selector.select_map({self.anchor_ids[i]: measured_distances[i] for i in valid_indices},
+                                                measured_rssi, self.tag_id_to_show)
+            valid_indices = [i for i in valid_indices if self.anchor_ids[i] in selected]
             
         anchors_subset = self.anchor_coords_array[valid_indices]
-        distances_subset = np.array([measured_distances[i] for i in valid_indices]) # Use list comprehension
-        
-        # Usar última posición válida como estimación inicial si existe
-        if self.last_valid_position is not None:
-             initial_guess = self.last_valid_position[:2]
-        else: # Si no, usar centroide
-             initial_guess = np.mean(anchors_subset, axis=0)[:2] 
+        distances_subset = np.array([measured_distances[i] for i in valid_indices], dtype=np.float64) # Use list comprehension
         
+        # Usar última posición válida como estimación inicial si existe (si no, el solver usa el centroide)
         bounds = [(0, self.field_width), (0, self.field_length)]
+        result = self.solver.solve(distances_subset, anchors_subset, initial_guess=self.last_valid_position, bounds=bounds,
+                                   tag_id=self.tag_id_to_show)
 
-        result = minimize(
-            self._error_function, 
-            initial_guess, 
-            args=(anchors_subset, distances_subset),
-            method='L-BFGS-B', 
-            bounds=bounds,
-            options={'maxiter': 50, 'ftol': 1e-7} # Ajustar opciones de optimización
-        )
-
-        if result.success and result.fun < 0.5: # Añadir umbral de calidad (ajustar 0.5)
-            pos_xy = result.x[:2]
-            self.last_valid_position = np.array([pos_xy[0], pos_xy[1], 0.0]) # Guardar como última válida
-            return pos_xy[0], pos_xy[1], result.fun 
+        if result.accepted: # Umbral de calidad propio de cada solver
+            pos = result.position
+            self.last_valid_position = np.array([pos[0], pos[1], pos[2]]) # Guardar como última válida
+            return pos[0], pos[1], result.error
         else:
-            # print(f"Optimización fallida o calidad pobre: {result.message}, fun: {result.fun}")
-            return None, None, result.fun # Devolver calidad aunque falle
+            # print(f"Optimización fallida o calidad pobre: fun: {result.error}")
+            return None, None, result.error # Devolver calidad aunque falle
+
+    def _solver_state(self):
+        """Estado del que depende el resultado del siguiente frame (arranque en caliente del solver)."""
+        return None if self.last_valid_position is None else self.last_valid_position.copy()
+
+    def _restore_solver_state(self, state):
+        self.last_valid_position = None if state is None else state.copy()
+
+    def build_keyframes(self):
+        """Prepara los checkpoints: solo el del frame 0; el resto se guarda al llegar a cada intervalo.
+
+        Así la ventana se abre sin resolver la sesión entera. Un salto a cualquier frame restaura el
+        checkpoint anterior y repite como mucho keyframe_interval frames (o, la primera vez que se salta
+        hacia delante, los frames hasta allí), así que el resultado es el mismo que reproduciendo desde
+        el principio.
+        """
+        self.keyframes = [None] # Estado inicial: sin posición válida previa
+        self.trajectory = TagTrajectory.empty(self.tag_id_to_show, self.anchor_ids, self.total_frames)
+        self.trajectory.session_id = self.session_to_show
+        self._restore_solver_state(None)
+        self.solved_frame = -1
+
+    def _advance(self, frame):
+        """Resuelve frame en orden, guardando antes el checkpoint si es el primero de un intervalo nuevo."""
+        if frame % self.keyframe_interval == 0 and frame // self.keyframe_interval == len(self.keyframes):
+            self.keyframes.append(self._solver_state())
+        return self._solve_frame(frame)
+
+    def seek(self, frame):
+        """Resuelve 'frame' dejando el estado del solver como si se hubiera reproducido desde el inicio.
+
+        Si frame es el siguiente al último resuelto se continúa sin más; si no (o si es el frame 0),
+        se restaura el checkpoint más cercano anterior que exista y se avanza hasta frame.
+        """
+        if frame == 0 or frame != self.solved_frame + 1:
+            k = min(frame // self.keyframe_interval, len(self.keyframes) - 1)
+            self._restore_solver_state(self.keyframes[k])
+            replay_start = time.perf_counter()
+            for replay_frame in range(k * self.keyframe_interval, frame):
+                self._advance(replay_frame)
+            if frame - k * self.keyframe_interval > self.keyframe_interval:
+                print(f"Salto al frame {frame}: {frame - k * self.keyframe_interval} frames resueltos en "
+                      f"{time.perf_counter() - replay_start:.2f} s (checkpoints: {len(self.keyframes)})")
+        result = self._advance(frame)
+        self.solved_frame = frame
+        return result
 
     def load_data(self):
-        """Carga los datos desde un archivo CSV **CRUDO** seleccionado."""
+        """Carga los datos desde un archivo CSV **CRUDO** seleccionado (o desde raw_source)."""
         options = {
             'initialdir': os.path.join(os.getcwd(), 'uwb_logs_mqtt'),
             'title': 'Selecciona archivo CSV **CRUDO** (log_*.csv)',
             # Ajustar filtro para logs crudos
-            'filetypes': (('Raw Log CSV files', 'log_*.csv'), ('CSV files', '*.csv'), ('all files', '*.*'))
+            'filetypes': (('Raw Log CSV files', 'log_*.csv'), ('CSV files', '*.csv'),
+                          ('Compressed logs', '*.csv.gz *.csv.zst'), ('Binary logs', '*.bin'), ('all files', '*.*'))
         }
-        filepath = filedialog.askopenfilename(**options)
+        if self.raw_source is not None:
+            filepath, raw_reader = self.raw_source
+        else:
+            filepath, raw_reader = filedialog.askopenfilename(**options), None
         if not filepath:
             print("No se seleccionó ningún archivo.")
             return False
@@ -115,12 +175,25 @@ class TagReplay:
         self.filepath = filepath
 
         try:
-            # Leer CSV crudo
-            self.df_all = pd.read_csv(filepath)
+            # Leer CSV crudo con dtypes compactos, limpio y ordenado por (TagID, Timestamp).
+            # Se reutiliza de la caché si ya se abrió un archivo con el mismo contenido
+            if raw_reader is not None:
+                # Consulta por rango de tiempo (sqlite_store.py): ya viene ordenada por (TagID, Timestamp)
+                raw = raw_reader()
+                self.df_all = raw[RAW_USECOLS + [col for col in ('SessionID',) if col in raw.columns]]
+            else:
+                cache = SessionCache()
+                cache_key = cache.key('raw-sorted', file_digest(filepath), RAW_USECOLS)
+                self.df_all = cache.get(cache_key)
+                if self.df_all is None:
+                    self.df_all = load_raw_log(filepath, usecols=RAW_USECOLS)
+                    cache.put(cache_key, self.df_all)
+                else:
+                    print("Datos crudos recuperados de la caché.")
             print(f"Leídas {len(self.df_all)} filas.")
             
             # Verificar columnas esperadas del formato CRUDO
-            # Asegúrate que estos nombres coinciden EXACTAMENTE con tu CSV crudo
+            # Se aceptan la cabecera del receptor MQTT (Tag_ID, Timestamp_ms...) y la canónica
             expected_cols = ['Timestamp(ms)', 'TagID', 'AnchorID', 'FilteredDistance(cm)', 'RSSI(dBm)']
             if not all(col in self.df_all.columns for col in expected_cols):
                 print("Error: El archivo CSV no parece tener el formato crudo esperado.")
@@ -128,15 +201,8 @@ class TagReplay:
                 print(f"Columnas encontradas: {self.df_all.columns.tolist()}")
                 return False
 
-            # Limpieza inicial (convertir tipos, quitar NaNs en columnas clave)
-            for col in ['Timestamp(ms)', 'TagID', 'AnchorID', 'FilteredDistance(cm)', 'RSSI(dBm)']:
-                 self.df_all[col] = pd.to_numeric(self.df_all[col], errors='coerce')
-            self.df_all.dropna(subset=['Timestamp(ms)', 'TagID', 'AnchorID', 'FilteredDistance(cm)'], inplace=True)
-            self.df_all['TagID'] = self.df_all['TagID'].astype(int)
-            self.df_all['AnchorID'] = self.df_all['AnchorID'].astype(int)
-            self.df_all.sort_values(by='Timestamp(ms)', inplace=True)
-            
-            self.unique_tags = sorted(self.df_all['TagID'].unique())
+            self.raw_table = RawLogTable(self.df_all)
+            self.unique_tags = self.raw_table.tag_ids
 
             if not self.unique_tags:
                 print("Error: No se encontraron IDs de Tag válidos en el archivo.")
@@ -148,19 +214,33 @@ class TagReplay:
             else:
                  print(f"Mostrando Tag ID: {self.tag_id_to_show}")
 
-            # Filtrar datos crudos para el tag seleccionado
-            self.tag_data_raw = self.df_all[self.df_all['TagID'] == self.tag_id_to_show].copy()
+            # Vista de los datos crudos del tag seleccionado (sin copia), de una sola sesión:
+            # si el tag se reinició, sus millis() se solapan y no se pueden reproducir juntos
+            sessions = self.raw_table.session_ids(self.tag_id_to_show)
+            if sessions:
+                if self.session_to_show not in sessions:
+                    if self.session_to_show is not None:
+                        print(f"Advertencia: La sesión {self.session_to_show} no es del Tag {self.tag_id_to_show}.")
+                    self.session_to_show = sessions[0]
+                if len(sessions) > 1:
+                    print(f"El Tag {self.tag_id_to_show} tiene {len(sessions)} sesiones {sessions}; "
+                          f"mostrando la {self.session_to_show} (elige otra con --session).")
+                self.tag_data_raw = self.raw_table.session_view(self.session_to_show)
+                self.tag_timestamps_raw = self.raw_table.session_column(self.session_to_show, 'Timestamp(ms)')
+            else:
+                self.tag_data_raw = self.raw_table.view(self.tag_id_to_show)
+                self.tag_timestamps_raw = self.raw_table.column(self.tag_id_to_show, 'Timestamp(ms)')
             # Crear lista de timestamps únicos para los frames de la animación
-            self.timestamps = sorted(self.tag_data_raw['Timestamp(ms)'].unique())
+            self.timestamps = np.unique(self.tag_timestamps_raw)
             self.total_frames = len(self.timestamps)
 
             if self.total_frames == 0:
                 print(f"Advertencia: No hay datos para el Tag ID {self.tag_id_to_show}.")
                 return False
 
-            # --- NO SE PRECALCULAN POSICIONES --- 
+            # --- NO SE PRECALCULAN POSICIONES: los checkpoints del solver se guardan al reproducir --- 
             print(f"Datos crudos cargados para Tag ID {self.tag_id_to_show}. Total frames (timestamps únicos): {self.total_frames}")
-            self.last_valid_position = None # Resetear última posición válida
+            self.build_keyframes()
             return True
 
         except FileNotFoundError:
@@ -196,6 +276,7 @@ class TagReplay:
 
         # Elementos dinámicos
         self.lines = [self.ax.plot([], [], linestyle='--', color=self.anchors[aid]['color'], alpha=0.7)[0] for aid in self.anchor_ids]
+        self.path_line, = self.ax.plot([], [], '-', color='tab:blue', alpha=0.3, linewidth=1) # Rastro hasta el frame
         tag_point, = self.ax.plot([], [], 'bo', markersize=8, label='Tag') 
         self.points = [tag_point]
         self.time_text = self.ax.text(0.02, 0.95, '', transform=self.ax.transAxes)
@@ -254,46 +335,32 @@ class TagReplay:
         self.playing = False
         self.animation.pause()
         self.current_frame = 0
-        self.last_valid_position = None # Resetear última posición
+        self.solved_frame = -1 # El siguiente frame resuelto partirá del checkpoint 0
         self.frame_slider.set_val(0)
         self.update(0) 
         self.fig.canvas.draw_idle()
         print("Animación reseteada")
 
-    def update(self, frame):
-        """Actualiza la animación para el cuadro actual, calculando posición sobre la marcha."""
-        if not self.tag_data_raw or frame >= self.total_frames or frame < 0:
-            return self.lines + self.points + [self.time_text]
-        
-        # Actualizar slider si está reproduciendo
-        if self.playing:
-             self.current_frame = frame
-             # Evitar error si el slider no está listo o el frame es inválido
-             try:
-                 if self.frame_slider and 0 <= frame < self.total_frames:
-                     self.frame_slider.set_val(frame)
-             except Exception as e:
-                 print(f"Error actualizando slider: {e}") # Debug raro
-        
-        target_frame_index = frame 
-        current_time_ms = self.timestamps[target_frame_index]
-        self.time_text.set_text(f'Time: {current_time_ms / 1000.0:.2f} s')
-
+    def _solve_frame(self, frame):
+        """Posición del frame con la ventana de tiempo que termina en su timestamp (actualiza el estado del solver)."""
+        current_time_ms = self.timestamps[frame]
         # --- Lógica de Ventana de Tiempo --- 
         window_start_time_ms = current_time_ms - self.time_window_ms
-        # Seleccionar datos crudos dentro de la ventana
-        window_data = self.tag_data_raw[
-            (self.tag_data_raw['Timestamp(ms)'] > window_start_time_ms) & 
-            (self.tag_data_raw['Timestamp(ms)'] <= current_time_ms)
-        ]
+        # Seleccionar datos crudos dentro de la ventana (búsqueda binaria sobre timestamps ordenados)
+        lo = np.searchsorted(self.tag_timestamps_raw, window_start_time_ms, side='right')
+        hi = np.searchsorted(self.tag_timestamps_raw, current_time_ms, side='right')
+        window_data = self.tag_data_raw.iloc[lo:hi]
         
         latest_distances_cm = {} # Guardar la última distancia de cada ancla en la ventana
+        latest_rssi = {} # Y su RSSI (dBm), para la selección de anclas
         if not window_data.empty:
              # Agrupar por AnchorID y obtener el índice del último timestamp para cada uno
             latest_indices = window_data.groupby('AnchorID')['Timestamp(ms)'].idxmax()
             latest_readings = window_data.loc[latest_indices]
             # Crear diccionario AnchorID -> Distancia(cm)
             latest_distances_cm = latest_readings.set_index('AnchorID')['FilteredDistance(cm)'].to_dict()
+            if 'RSSI(dBm)' in latest_readings.columns:
+                latest_rssi = latest_readings.set_index('AnchorID')['RSSI(dBm)'].to_dict()
             
         # Preparar lista de distancias en METROS para calculate_position
         measured_distances_m = []
@@ -302,8 +369,38 @@ class TagReplay:
              measured_distances_m.append(dist_cm / 100.0 if not pd.isna(dist_cm) else np.nan)
         # --- Fin Lógica Ventana --- 
 
-        # Calcular posición para este frame/ventana
-        pos_x, pos_y, quality = self.calculate_position(measured_distances_m)
+        pos_x, pos_y, quality = self.calculate_position(measured_distances_m, latest_rssi)
+        if self.trajectory is not None:
+            self.trajectory.timestamps[frame] = current_time_ms
+            self.trajectory.distances[frame] = measured_distances_m
+            self.trajectory.rssis[frame] = [latest_rssi.get(anchor_id, np.nan) for anchor_id in self.anchor_ids]
+            self.trajectory.positions[frame] = ((pos_x, pos_y, self.last_valid_position[2]) if pos_x is not None
+                                                else np.nan)
+        return pos_x, pos_y, quality, measured_distances_m
+
+    def update(self, frame):
+        """Actualiza la animación para el cuadro actual, calculando posición sobre la marcha."""
+        if self.tag_data_raw is None or frame >= self.total_frames or frame < 0:
+            return self.lines + self.points + [self.time_text]
+        
+        # Actualizar slider si está reproduciendo
+        if self.playing:
+             self.current_frame = frame
+             # Evitar error si el slider no está listo o el frame es inválido
+             try:
+                 if self.frame_slider and 0 <= frame < self.total_frames:
+                     self.frame_slider.set_val(frame)
+             except Exception as e:
+                 print(f"Error actualizando slider: {e}") # Debug raro
+        
+        current_time_ms = self.timestamps[frame]
+        self.time_text.set_text(f'Time: {current_time_ms / 1000.0:.2f} s')
+
+        # Calcular posición para este frame/ventana (restaurando el checkpoint si es un salto)
+        pos_x, pos_y, quality, measured_distances_m = self.seek(frame)
+        if self.trajectory is not None and self.path_line is not None:
+            path = self.trajectory[max(0, frame + 1 - self.trail_length):frame + 1].valid_xy() # Vista, coste acotado
+            self.path_line.set_data(path[:, 0], path[:, 1])
 
         # Actualizar punto del tag
         if pos_x is not None and pos_y is not None:
@@ -350,8 +447,43 @@ class TagReplay:
 
 # --- Punto de entrada --- 
 if __name__ == "__main__":
-    tag_id = None
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay de un log crudo calculando posiciones al vuelo.')
+    parser.add_argument('--tag', type=int, default=None, help='Tag a mostrar (por defecto el primero).')
+    parser.add_argument('--session', type=int, default=None,
+                        help='SessionID a mostrar si el tag se reinició durante el log (por defecto la primera).')
+    parser.add_argument('--input', default=None, help='Log crudo a abrir sin diálogo (.csv, .bin o comprimido).')
+    parser.add_argument('--db', default=None, help='Abrir una sesión de una base sqlite_store.py en vez de elegir un archivo.')
+    parser.add_argument('--from', dest='start', default=None,
+                        help="Inicio del clip ('2025-05-04 17:05:00' hora local o epoch ms; con --clock device, millis() del tag).")
+    parser.add_argument('--to', dest='end', default=None, help='Fin del clip (mismo formato que --from).')
+    parser.add_argument('--clock', choices=('host', 'device'), default='host',
+                        help='Reloj de --from/--to: hora del host o millis() del tag.')
+    parser.add_argument('--max-anchors', type=int, default=None,
+                        help='Anclas por frame como mucho, elegidas por DOP (por defecto field_settings.max_anchors o 6; 0 = todas).')
+    parser.add_argument('--solver', choices=available_solvers(), default=None,
+                        help=f'Solver de posición (por defecto field_settings.solver o {DEFAULT_REPLAY_SOLVER}).')
+    args = parser.parse_args()
+    if args.input and args.db:
+        parser.error('Indica --input o --db, no ambos.')
+
+    raw_source = None
+    window = f"({args.start or 'inicio'} -> {args.end or 'fin'})"
+    if args.db:
+        from sqlite_store import UwbDatabase
+        db = UwbDatabase(args.db)
+        raw_source = (f"{args.db} {window}", lambda: db.load_raw_frame(args.tag, args.start, args.end, args.clock))
+    elif args.input and (args.start is not None or args.end is not None):
+        # Solo se leen los bloques del log que cubren el clip (índice log_index.py junto al archivo)
+        from log_index import read_log_window
+        raw_source = (f"{args.input} {window}",
+                      lambda: read_log_window(args.input, args.tag, args.start, args.end, args.clock, usecols=RAW_USECOLS))
+    elif args.input:
+        raw_source = (args.input, lambda: load_raw_log(args.input, usecols=RAW_USECOLS))
+    elif args.start is not None or args.end is not None:
+        parser.error('--from/--to necesitan --input o --db.')
     root = Tk()
     root.withdraw()
-    replay = TagReplay(tag_id_to_show=tag_id)
+    replay = TagReplay(tag_id_to_show=args.tag, raw_source=raw_source, session_to_show=args.session, solver=args.solver,
+                       max_anchors=args.max_anchors)
     replay.run()
@@ -0,0 +1,138 @@
+# trajectory_store.py
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Un frame de la trayectoria. position/distances/rssis son vistas sobre los arrays del contenedor
+TrajectoryFrame = namedtuple('TrajectoryFrame', ['timestamp', 'position', 'distances', 'rssis'])
+
+
+class TagTrajectory:
+    """Trayectoria de un tag en arrays contiguos tipados.
+
+    - timestamps: int64 (N,) en ms
+    - positions:  float64 (N, 3) en metros (NaN si no hubo posición)
+    - distances:  float32 (N, A) en metros, columna i <-> anchor_ids[i] (NaN si no respondió)
+    - rssis:      float32 (N, A) en dBm
+
+    El acceso a un frame es O(1) y el slicing devuelve otra TagTrajectory con vistas (sin copias).
+    session_id es la sesión (session_segments.py) de la trayectoria, o None si el origen no las tiene.
+    """
+
+    def __init__(self, tag_id, anchor_ids, timestamps, positions, distances, rssis, session_id=None):
+        self.tag_id = tag_id
+        self.session_id = session_id
+        self.anchor_ids = tuple(int(aid) for aid in anchor_ids)
+        self._anchor_index = {aid: i for i, aid in enumerate(self.anchor_ids)}
+        self.timestamps = np.ascontiguousarray(timestamps, dtype=np.int64)
+        self.positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.distances = np.ascontiguousarray(distances, dtype=np.float32).reshape(-1, len(self.anchor_ids))
+        self.rssis = np.ascontiguousarray(rssis, dtype=np.float32).reshape(-1, len(self.anchor_ids))
+        n = len(self.timestamps)
+        if not (len(self.positions) == len(self.distances) == len(self.rssis) == n):
+            raise ValueError("Todos los arrays de la trayectoria deben tener la misma longitud.")
+
+    @classmethod
+    def empty(cls, tag_id, anchor_ids, num_frames=0):
+        """Trayectoria de num_frames frames rellena de NaN (para precálculos que la completan in situ)."""
+        num_anchors = len(tuple(anchor_ids))
+        return cls(tag_id, anchor_ids,
+                   np.zeros(num_frames, dtype=np.int64),
+                   np.full((num_frames, 3), np.nan),
+                   np.full((num_frames, num_anchors), np.nan, dtype=np.float32),
+                   np.full((num_frames, num_anchors), np.nan, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TagTrajectory._from_views(self, index)
+        return TrajectoryFrame(int(self.timestamps[index]), self.positions[index],
+                               self.distances[index], self.rssis[index])
+
+    @staticmethod
+    def _from_views(parent, index):
+        # Evita ascontiguousarray (que copiaría con pasos != 1) construyendo el objeto a mano
+        view = TagTrajectory.__new__(TagTrajectory)
+        view.tag_id = parent.tag_id
+        view.session_id = parent.session_id
+        view.anchor_ids = parent.anchor_ids
+        view._anchor_index = parent._anchor_index
+        view.timestamps = parent.timestamps[index]
+        view.positions = parent.positions[index]
+        view.distances = parent.distances[index]
+        view.rssis = parent.rssis[index]
+        return view
+
+    def anchor_column(self, anchor_id):
+        """Índice de columna de un ancla en distances/rssis."""
+        return self._anchor_index[int(anchor_id)]
+
+    def distances_for(self, anchor_id):
+        """Serie de distancias (m) de un ancla, como vista."""
+        return self.distances[:, self.anchor_column(anchor_id)]
+
+    def valid_mask(self):
+        """Máscara de frames con posición X válida."""
+        return ~np.isnan(self.positions[:, 0])
+
+    def valid_xy(self):
+        """Posiciones XY válidas, (M, 2)."""
+        return self.positions[self.valid_mask(), :2]
+
+    def first_valid_index(self):
+        """Índice del primer frame con posición válida, o None."""
+        idx = np.flatnonzero(self.valid_mask())
+        return int(idx[0]) if idx.size else None
+
+    def frame_at_time(self, timestamp_ms):
+        """Índice del último frame con timestamp <= timestamp_ms (búsqueda binaria)."""
+        return max(0, int(np.searchsorted(self.timestamps, timestamp_ms, side='right')) - 1)
+
+    def nbytes(self):
+        return self.timestamps.nbytes + self.positions.nbytes + self.distances.nbytes + self.rssis.nbytes
+
+
+def trajectories_from_processed(df, anchor_ids, session_ids=None):
+    """Construye {tag_id: TagTrajectory} a partir de un DataFrame procesado (salida de post_process_data).
+
+    Las distancias se convierten de cm a m. Columnas de ancla ausentes quedan como NaN.
+    Si df tiene SessionID, cada trayectoria es una sola sesión del tag (los millis() de dos arranques
+    no se pueden mezclar): la de session_ids[tag_id] o, si no se indica, la primera del tag.
+    """
+    anchor_ids = [int(aid) for aid in anchor_ids]
+    session_ids = session_ids or {}
+    has_sessions = 'SessionID' in df.columns
+    keys = ['TagID', 'SessionID', 'Timestamp(ms)'] if has_sessions else ['TagID', 'Timestamp(ms)']
+    df = df.sort_values(keys, kind='stable')
+    tags = df['TagID'].to_numpy()
+    sessions = df['SessionID'].to_numpy(dtype=np.int64) if has_sessions else np.zeros(len(df), dtype=np.int64)
+    timestamps = df['Timestamp(ms)'].to_numpy(dtype=np.int64)
+    positions = df[['Position_X', 'Position_Y', 'Position_Z']].to_numpy(dtype=np.float64)
+    n = len(df)
+
+    def _anchor_matrix(prefix, scale):
+        out = np.full((n, len(anchor_ids)), np.nan, dtype=np.float32)
+        for i, aid in enumerate(anchor_ids):
+            col = f'{prefix}_{aid}'
+            if col in df.columns:
+                out[:, i] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64) * scale
+        return out
+
+    distances = _anchor_matrix('FilteredDistance', 0.01)
+    rssis = _anchor_matrix('RSSI', 1.0)
+
+    trajectories = {}
+    starts = np.flatnonzero(np.concatenate(([True], (tags[1:] != tags[:-1]) | (sessions[1:] != sessions[:-1])))) if n else []
+    stops = list(starts[1:]) + [n]
+    for start, stop in zip(starts, stops):
+        tag_id, session_id = int(tags[start]), int(sessions[start])
+        wanted = session_ids.get(tag_id)
+        if tag_id in trajectories or (wanted is not None and session_id != wanted):
+            continue
+        trajectories[tag_id] = TagTrajectory(tag_id, anchor_ids, timestamps[start:stop], positions[start:stop],
+                                             distances[start:stop], rssis[start:stop],
+                                             session_id if has_sessions else None)
+    return trajectories
@@ -0,0 +1,219 @@
+# udp_presence.py
+import argparse
+import asyncio
+import re
+import socket
+import threading
+import time
+
+from receiver_metrics import MetricsRegistry, start_metrics_server
+
+# --- Configuración ---
+UDP_HOST = "0.0.0.0"
+UDP_PORT = 5555               # UDP_PORT del firmware (broadcastUDP en dw3000_wireless_opt.ino)
+BATCH_INTERVAL_S = 0.1        # Los datagramas se acumulan y se parsean en lote cada BATCH_INTERVAL_S
+STALE_AFTER_S = 3.0           # Un tag sin datagramas durante este tiempo se considera ausente
+REPORT_INTERVAL_S = 1.0
+RECV_BUFFER_BYTES = 4 * 1024 * 1024 # Buffer del socket para absorber ráfagas entre dos lotes
+METRICS_HOST = "127.0.0.1"
+# "Tag: <id>, LastAnchor: <id>" (una línea por datagrama al unirlos para el parseo en lote)
+DATAGRAM_RE = re.compile(rb'^Tag:\s*(\d+),\s*LastAnchor:\s*(-?\d+)\s*$', re.MULTILINE)
+
+
+class PresenceTable:
+    """Último ancla y última vez visto de cada tag (reloj monotónico del host)."""
+
+    def __init__(self, stale_after_s=STALE_AFTER_S):
+        self.stale_after_s = stale_after_s
+        self.tags = {} # tag_id -> {'last_anchor', 'last_seen', 'packets', 'address'}
+
+    def update(self, tag_id, last_anchor, now, address=None, count=1):
+        entry = self.tags.get(tag_id)
+        if entry is None:
+            entry = self.tags[tag_id] = {'last_anchor': last_anchor, 'last_seen': now, 'packets': 0, 'address': address}
+        entry['last_anchor'] = last_anchor
+        entry['last_seen'] = now
+        entry['packets'] += count
+        if address is not None:
+            entry['address'] = address
+
+    def is_alive(self, tag_id, now=None):
+        entry = self.tags.get(tag_id)
+        now = time.monotonic() if now is None else now
+        return entry is not None and now - entry['last_seen'] <= self.stale_after_s
+
+    def alive_tags(self, now=None):
+        now = time.monotonic() if now is None else now
+        return sorted(tag_id for tag_id in self.tags if self.is_alive(tag_id, now))
+
+    def snapshot(self, now=None):
+        """{tag_id: {'last_anchor', 'age_s', 'alive', 'packets'}} para consumidores externos."""
+        now = time.monotonic() if now is None else now
+        return {tag_id: {'last_anchor': e['last_anchor'], 'age_s': round(now - e['last_seen'], 3),
+                         'alive': now - e['last_seen'] <= self.stale_after_s, 'packets': e['packets']}
+                for tag_id, e in self.tags.items()}
+
+
+def parse_datagram_batch(datagrams):
+    """Parsea una lista de (payload, address) de una vez.
+
+    Devuelve ({tag_id: (last_anchor, address, n_datagramas)}, n_malformados). Solo se conserva el
+    último datagrama de cada tag del lote, que es lo único que necesita la tabla de presencia.
+    """
+    if not datagrams:
+        return {}, 0
+    payloads = [payload.replace(b'\n', b' ').strip() for payload, _ in datagrams]
+    addresses = [address for _, address in datagrams]
+    matches = DATAGRAM_RE.findall(b'\n'.join(payloads))
+    malformed = len(datagrams) - len(matches)
+    if malformed:
+        # Hay que saber qué datagramas fallaron para asociar cada tag con su dirección
+        pairs = [(match.groups(), address) for match, address in
+                 ((DATAGRAM_RE.match(payload), address) for payload, address in zip(payloads, addresses)) if match]
+    else:
+        pairs = zip(matches, addresses)
+    latest = {}
+    for (tag_str, anchor_str), address in pairs:
+        tag_id = int(tag_str)
+        count = latest[tag_id][2] + 1 if tag_id in latest else 1
+        latest[tag_id] = (int(anchor_str), address, count)
+    return latest, malformed
+
+
+class PresenceProtocol(asyncio.DatagramProtocol):
+    """Recibe los datagramas de los tags. datagram_received solo encola; el parseo va en lote."""
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, addr):
+        self.listener.pending.append((data, addr))
+
+
+class UdpPresenceListener:
+    """Escucha el broadcast UDP de los tags y mantiene la tabla de presencia y los contadores."""
+
+    def __init__(self, host=UDP_HOST, port=UDP_PORT, stale_after_s=STALE_AFTER_S, registry=None, on_update=None):
+        self.host = host
+        self.port = port
+        self.table = PresenceTable(stale_after_s)
+        self.pending = []
+        self.on_update = on_update
+        self.transport = None
+        self.packets_total = 0
+        self.malformed_total = 0
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.packets_counter = r.counter('uwb_udp_packets_total', 'Datagramas UDP recibidos.')
+        self.malformed_counter = r.counter('uwb_udp_malformed_total', 'Datagramas UDP con formato inválido.')
+        self.tag_packets = r.counter('uwb_udp_tag_packets_total', 'Datagramas válidos por tag.', ('tag',))
+        r.gauge('uwb_udp_tags_alive', 'Tags vistos en los últimos segundos.', func=lambda: len(self.table.alive_tags()))
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: PresenceProtocol(self), local_addr=(self.host, self.port), allow_broadcast=True)
+        self.port = self.transport.get_extra_info('sockname')[1]
+        try:
+            self.transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+        except OSError as e:
+            print(f"Advertencia: No se pudo ampliar el buffer de recepción UDP: {e}")
+        print(f"Escuchando telemetría UDP en {self.host}:{self.port}")
+
+    def process_pending(self, now=None):
+        """Parsea en lote lo recibido desde la última llamada y actualiza tabla y contadores."""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        now = time.monotonic() if now is None else now
+        latest, malformed = parse_datagram_batch(batch)
+        self.packets_total += len(batch)
+        self.malformed_total += malformed
+        self.packets_counter.inc(len(batch))
+        if malformed:
+            self.malformed_counter.inc(malformed)
+        for tag_id, (last_anchor, address, count) in latest.items():
+            self.table.update(tag_id, last_anchor, now, address, count)
+            self.tag_packets.inc(count, tag=tag_id)
+            if self.on_update:
+                self.on_update(tag_id, last_anchor)
+        return len(batch)
+
+    async def run(self, duration=None, report=True):
+        await self.start()
+        start = last_report = time.monotonic()
+        last_packets = 0
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                await asyncio.sleep(BATCH_INTERVAL_S)
+                self.process_pending()
+                now = time.monotonic()
+                if report and now - last_report >= REPORT_INTERVAL_S:
+                    rate = (self.packets_total - last_packets) / (now - last_report)
+                    print(self.format_report(rate, now))
+                    last_report, last_packets = now, self.packets_total
+        finally:
+            self.process_pending()
+            self.transport.close()
+
+    def format_report(self, packets_per_s, now=None):
+        tags = ', '.join(f"{tag}->A{e['last_anchor']}" + ('' if e['alive'] else ' (ausente)')
+                         for tag, e in sorted(self.table.snapshot(now).items()))
+        return (f"{packets_per_s:8.0f} pkt/s | total {self.packets_total} | malformados {self.malformed_total} | "
+                f"tags: {tags or '-'}")
+
+
+def _blast(port, num_packets, num_tags=8, rate_pps=50000):
+    """Envía num_packets datagramas (uno de cada 100 malformado) a localhost:port a ~rate_pps."""
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.perf_counter()
+    for i in range(num_packets):
+        payload = b'garbage' if i % 100 == 99 else f"Tag: {i % num_tags + 1}, LastAnchor: {10 * (i % 4 + 1)}".encode()
+        sender.sendto(payload, ('127.0.0.1', port))
+        if i % 1000 == 999:
+            delay = (i + 1) / rate_pps - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+    sender.close()
+
+
+async def self_test(num_packets, rate_pps):
+    listener = UdpPresenceListener(host='127.0.0.1', port=0)
+    await listener.start()
+    sender = threading.Thread(target=_blast, args=(listener.port, num_packets), kwargs={'rate_pps': rate_pps})
+    start = time.perf_counter()
+    sender.start()
+    while sender.is_alive():
+        await asyncio.sleep(BATCH_INTERVAL_S)
+        listener.process_pending()
+    await asyncio.sleep(BATCH_INTERVAL_S)
+    listener.process_pending()
+    elapsed = time.perf_counter() - start
+    listener.transport.close()
+    print(f"Enviados {num_packets}, recibidos {listener.packets_total} ({listener.packets_total / elapsed:.0f} pkt/s), "
+          f"malformados {listener.malformed_total}")
+    print(listener.format_report(listener.packets_total / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Escucha la telemetría UDP ("Tag: <id>, LastAnchor: <id>") de los tags.')
+    parser.add_argument('--host', default=UDP_HOST)
+    parser.add_argument('--port', type=int, default=UDP_PORT)
+    parser.add_argument('--stale-after', type=float, default=STALE_AFTER_S, help='Segundos sin datagramas para dar un tag por ausente.')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Puerto del endpoint Prometheus /metrics (0 para desactivar).')
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--self-test', type=int, default=0, metavar='N',
+                        help='Envía N datagramas a un listener local y muestra el rendimiento.')
+    parser.add_argument('--self-test-rate', type=int, default=50000, help='Datagramas por segundo del auto-test.')
+    args = parser.parse_args()
+
+    if args.self_test:
+        asyncio.run(self_test(args.self_test, args.self_test_rate))
+    else:
+        listener = UdpPresenceListener(args.host, args.port, stale_after_s=args.stale_after)
+        if args.metrics_port:
+            start_metrics_server(listener.registry, METRICS_HOST, args.metrics_port)
+        try:
+            asyncio.run(listener.run(args.duration))
+        except KeyboardInterrupt:
+            print("\nListener UDP detenido por el usuario (Ctrl+C).")
@@ -0,0 +1,267 @@
+# uwb_loader.py
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from binary_records import BINARY_SUFFIX, binary_log_to_frame
+from compressed_logs import open_log
+from session_segments import add_session_columns, session_table
+
+# Nombres canónicos de las columnas del log crudo (los mismos que usa post_process_data.py)
+RAW_COLUMN_NAMES = [
+    'TagID', 'Timestamp(ms)', 'AnchorID',
+    'RawDistance(cm)', 'FilteredDistance(cm)',
+    'RSSI(dBm)', 'AnchorStatus'
+]
+# Equivalencias con la cabecera que escribe log_receiver_opt.py
+HEADER_ALIASES = {
+    'Tag_ID': 'TagID',
+    'Timestamp_ms': 'Timestamp(ms)',
+    'Anchor_ID': 'AnchorID',
+    'Raw_Distance_cm': 'RawDistance(cm)',
+    'Filtered_Distance_cm': 'FilteredDistance(cm)',
+    'Signal_Power_dBm': 'RSSI(dBm)',
+    'Anchor_Status': 'AnchorStatus',
+}
+# Tipos compactos por columna: IDs uint16, millis() en int64 (permite restas), distancias/RSSI float32
+RAW_DTYPES = {
+    'TagID': np.uint16,
+    'Timestamp(ms)': np.int64,
+    'AnchorID': np.uint16,
+    'RawDistance(cm)': np.float32,
+    'FilteredDistance(cm)': np.float32,
+    'RSSI(dBm)': np.float32,
+    'AnchorStatus': 'category',
+}
+# Columnas sin las que un registro no sirve
+CRITICAL_COLUMNS = ['Timestamp(ms)', 'TagID', 'AnchorID', 'FilteredDistance(cm)']
+# Columnas que se cargan por defecto (RawDistance no la usa ningún consumidor actual)
+DEFAULT_USECOLS = ['TagID', 'Timestamp(ms)', 'AnchorID', 'FilteredDistance(cm)', 'RSSI(dBm)', 'AnchorStatus']
+
+
+def _detect_layout(path):
+    """Devuelve (tiene_cabecera, nombres_canónicos) mirando la primera línea del archivo."""
+    with open_log(path) as f: # .csv, .csv.gz o .csv.zst
+        first_line = f.readline().strip()
+    fields = [field.strip() for field in first_line.split(',')] if first_line else []
+    try:
+        float(fields[0])
+        has_header = False
+    except (IndexError, ValueError):
+        has_header = bool(fields)
+    num_cols = len(fields) if fields else len(RAW_COLUMN_NAMES)
+    if has_header:
+        names = [HEADER_ALIASES.get(name, name) for name in fields]
+        if len(set(names)) != len(names):
+            # Cabecera rota (p. ej. '\n' literales que juntan todo el log en una línea): columnas por defecto
+            print(f"Advertencia: La cabecera de {path} repite nombres de columna. Usando las columnas por defecto.")
+            names = list(RAW_COLUMN_NAMES)
+    else:
+        names = RAW_COLUMN_NAMES[:num_cols]
+    return has_header, names
+
+
+def read_raw_log(path, usecols=None):
+    """Lee un log crudo con columnas y dtypes explícitos.
+
+    Acepta la cabecera del receptor MQTT, la cabecera canónica o ninguna. Si el archivo tiene
+    filas corruptas o valores vacíos en columnas enteras y la lectura tipada falla, se lee como
+    texto y se devuelve sin convertir (coerce_raw_columns se encarga después). Los logs binarios
+    (.bin) del receptor se leen directamente con sus tipos.
+    """
+    if path.endswith(BINARY_SUFFIX):
+        return binary_log_to_frame(path, usecols or DEFAULT_USECOLS)
+    has_header, names = _detect_layout(path)
+    return read_csv_typed(path, has_header, names, usecols)
+
+
+def read_csv_typed(source, has_header, names, usecols=None):
+    """pd.read_csv de un archivo o buffer con las columnas de names, tipado y con vuelta a texto si falla."""
+    wanted = [col for col in (usecols or DEFAULT_USECOLS) if col in names]
+    dtypes = {col: RAW_DTYPES[col] for col in wanted if col in RAW_DTYPES}
+    read_kwargs = dict(header=0 if has_header else None, names=names, usecols=wanted, on_bad_lines='warn')
+    try:
+        # Camino rápido: conversión directa en el parser C (falla si hay texto o enteros vacíos)
+        return pd.read_csv(source, dtype=dtypes, **read_kwargs)
+    except (ValueError, TypeError):
+        print("Advertencia: Lectura tipada fallida (valores no numéricos). Usando conversión tolerante.")
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_csv(source, dtype=str, **read_kwargs)
+
+
+def coerce_raw_columns(df):
+    """Convierte a numérico las columnas que no lo sean (valores inválidos -> NaN)."""
+    for col in df.columns:
+        if col == 'AnchorStatus' or pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def drop_invalid_rows(df):
+    """Elimina filas sin valores críticos y aplica los dtypes compactos definitivos."""
+    critical = [col for col in CRITICAL_COLUMNS if col in df.columns]
+    df = df.dropna(subset=critical)
+    for col in df.columns:
+        target = RAW_DTYPES.get(col)
+        if target is None or target == 'category':
+            continue
+        if np.issubdtype(np.dtype(target), np.integer):
+            df[col] = df[col].astype(np.int64).astype(target)
+        else:
+            df[col] = df[col].astype(target)
+    if 'AnchorStatus' in df.columns and not isinstance(df['AnchorStatus'].dtype, pd.CategoricalDtype):
+        df['AnchorStatus'] = df['AnchorStatus'].astype('category')
+    return df
+
+
+def load_raw_log(path, usecols=None):
+    """Lee, convierte, limpia, separa en sesiones y ordena por (TagID, SessionID, Timestamp) un log crudo.
+
+    La segmentación (session_segments.py) se hace en orden de llegada, antes de ordenar: así dos
+    arranques del mismo tag con millis() solapados no se mezclan.
+    """
+    df = read_raw_log(path, usecols=usecols)
+    df = coerce_raw_columns(df)
+    df = drop_invalid_rows(df)
+    df = add_session_columns(df)
+    return sort_by_tag_and_time(df)
+
+
+def sort_by_tag_and_time(df):
+    """Ordena por (TagID, [SessionID,] Timestamp(ms)) con orden estable y reinicia el índice."""
+    keys = ['TagID', 'SessionID', 'Timestamp(ms)'] if 'SessionID' in df.columns else ['TagID', 'Timestamp(ms)']
+    return df.sort_values(keys, kind='stable').reset_index(drop=True)
+
+
+class RawLogTable:
+    """Tabla cruda ordenada por (TagID, Timestamp) con acceso por tag mediante vistas (sin copias).
+
+    Si la tabla tiene SessionID (load_raw_log), sessions es el índice de sesiones y cada sesión es
+    también un tramo contiguo accesible con session_view/session_column.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        tags = df['TagID'].to_numpy()
+        if len(tags) > 1 and np.any(tags[1:] < tags[:-1]):
+            raise ValueError("RawLogTable requiere un DataFrame ordenado por TagID (usa sort_by_tag_and_time).")
+        self.tag_ids = [int(t) for t in np.unique(tags)]
+        starts = np.searchsorted(tags, self.tag_ids, side='left')
+        stops = np.searchsorted(tags, self.tag_ids, side='right')
+        self._bounds = {tag: (int(a), int(b)) for tag, a, b in zip(self.tag_ids, starts, stops)}
+        self.sessions = session_table(df) if 'SessionID' in df.columns else None
+        self._session_bounds = {} if self.sessions is None else {
+            int(sid): (int(a), int(b)) for sid, a, b in self.sessions[['SessionID', 'RowStart', 'RowStop']].itertuples(index=False)}
+
+    @classmethod
+    def from_file(cls, path, usecols=None):
+        return cls(load_raw_log(path, usecols=usecols))
+
+    def __len__(self):
+        return len(self.df)
+
+    def bounds(self, tag_id):
+        """Rango [inicio, fin) de filas del tag en la tabla ordenada."""
+        return self._bounds.get(int(tag_id), (0, 0))
+
+    def view(self, tag_id):
+        """Filas del tag como slice posicional (vista sobre la tabla ordenada, no copia)."""
+        start, stop = self.bounds(tag_id)
+        return self.df.iloc[start:stop]
+
+    def column(self, tag_id, col):
+        """Array NumPy (vista) de una columna para un tag."""
+        start, stop = self.bounds(tag_id)
+        return self.df[col].to_numpy()[start:stop]
+
+    def session_ids(self, tag_id=None):
+        """SessionID de la tabla (o de un tag) en orden de aparición."""
+        if self.sessions is None:
+            return []
+        table = self.sessions if tag_id is None else self.sessions[self.sessions['TagID'] == int(tag_id)]
+        return [int(sid) for sid in table['SessionID']]
+
+    def session_view(self, session_id):
+        start, stop = self._session_bounds.get(int(session_id), (0, 0))
+        return self.df.iloc[start:stop]
+
+    def session_column(self, session_id, col):
+        start, stop = self._session_bounds.get(int(session_id), (0, 0))
+        return self.df[col].to_numpy()[start:stop]
+
+
+# --- Benchmark de memoria ---
+
+def _legacy_load(path):
+    """Reproduce la carga anterior: todo float64/object, to_numeric y .copy() por tag."""
+    has_header, names = _detect_layout(path)
+    df = pd.read_csv(path, header=0 if has_header else None, names=names, on_bad_lines='warn')
+    for col in df.columns:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df.dropna(subset=[col for col in CRITICAL_COLUMNS if col in df.columns], inplace=True)
+    df.sort_values(by='Timestamp(ms)', inplace=True)
+    per_tag = {tag: df[df['TagID'] == tag].copy() for tag in df['TagID'].unique()}
+    return df, per_tag
+
+
+def _write_synthetic_log(path, num_rows, num_tags=4, anchor_ids=(10, 20, 30, 40)):
+    """Genera un log sintético con el formato del receptor MQTT."""
+    rng = np.random.default_rng(0)
+    tags = np.repeat(np.arange(1, num_tags + 1), -(-num_rows // num_tags))[:num_rows]
+    anchors = np.tile(np.array(anchor_ids), -(-num_rows // len(anchor_ids)))[:num_rows]
+    timestamps = 60000 + np.arange(num_rows) * 6
+    filtered = rng.uniform(50, 600, num_rows)
+    raw = filtered + rng.normal(0, 3, num_rows)
+    rssi = rng.uniform(-95, -60, num_rows)
+    df = pd.DataFrame({
+        'Tag_ID': tags, 'Timestamp_ms': timestamps, 'Anchor_ID': anchors,
+        'Raw_Distance_cm': raw.round(2), 'Filtered_Distance_cm': filtered.round(2),
+        'Signal_Power_dBm': rssi.round(2), 'Anchor_Status': 1,
+    })
+    df.to_csv(path, index=False)
+
+
+def benchmark(path):
+    """Compara memoria y tiempo de la carga anterior frente a la carga tipada."""
+    t0 = time.perf_counter()
+    legacy_df, legacy_tags = _legacy_load(path)
+    t_legacy = time.perf_counter() - t0
+    legacy_bytes = legacy_df.memory_usage(deep=True).sum()
+    legacy_tag_bytes = sum(part.memory_usage(deep=True).sum() for part in legacy_tags.values())
+
+    t0 = time.perf_counter()
+    table = RawLogTable.from_file(path)
+    views = {tag: table.view(tag) for tag in table.tag_ids}
+    t_typed = time.perf_counter() - t0
+    typed_bytes = table.df.memory_usage(deep=True).sum()
+
+    print(f"Archivo: {path} ({os.path.getsize(path) / 1e6:.1f} MB, {len(table)} filas válidas, {len(views)} tags)")
+    print(f"  Carga anterior: {t_legacy:.3f} s, tabla {legacy_bytes / 1e6:.2f} MB + copias por tag {legacy_tag_bytes / 1e6:.2f} MB")
+    print(f"  Carga tipada:   {t_typed:.3f} s, tabla {typed_bytes / 1e6:.2f} MB + vistas por tag 0 MB")
+    total_legacy = legacy_bytes + legacy_tag_bytes
+    if typed_bytes > 0:
+        print(f"  Reducción de memoria: {total_legacy / typed_bytes:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cargador tipado de logs UWB crudos y benchmark de memoria.')
+    parser.add_argument('--input', help='Log crudo a medir.')
+    parser.add_argument('--synthetic-rows', type=int, default=0,
+                        help='Genera un log sintético de N filas para el benchmark (ignora --input).')
+    args = parser.parse_args()
+
+    if args.synthetic_rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            synthetic_path = os.path.join(tmp_dir, 'synthetic_log.csv')
+            _write_synthetic_log(synthetic_path, args.synthetic_rows)
+            benchmark(synthetic_path)
+    elif args.input:
+        benchmark(args.input)
+    else:
+        parser.error('Indica --input o --synthetic-rows.')
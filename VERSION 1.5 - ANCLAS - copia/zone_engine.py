@@ -0,0 +1,298 @@
+# zone_engine.py
+import argparse
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from live_engine import BROKER_ADDRESS, BROKER_PORT, POSITION_TOPIC_FMT
+
+# --- Configuración ---
+ZONES_CONFIG_FILE = 'zones.json'
+GRID_CELL_M = 0.5                # Lado de celda del índice espacial
+ZONE_EVENT_TOPIC_FMT = "uwb/tag/{}/zone"
+# Zonas del firmware (zones[] en dw3000_wireless_opt.ino): id = índice, círculo, minStayTime en ms
+DEFAULT_ZONES = [
+    {'id': 0, 'type': 'circle', 'x': 0.5, 'y': 0.5, 'radius': 0.3, 'min_stay_ms': 3000},
+    {'id': 1, 'type': 'circle', 'x': 2.5, 'y': 2.5, 'radius': 0.4, 'min_stay_ms': 5000},
+    {'id': 2, 'type': 'circle', 'x': 1.5, 'y': 4.0, 'radius': 0.5, 'min_stay_ms': 10000},
+]
+
+ZoneEvent = namedtuple('ZoneEvent', ['kind', 'tag_id', 'zone_id', 'timestamp_ms']) # kind: 'enter', 'exit', 'dwell'
+
+
+def load_zones(config_file=ZONES_CONFIG_FILE):
+    """Lista de zonas desde JSON ([{id, type: circle|polygon, ...}]); las del firmware si no existe."""
+    if not os.path.exists(config_file):
+        print(f"Archivo de zonas '{config_file}' no encontrado. Usando las zonas del firmware.")
+        return [dict(zone) for zone in DEFAULT_ZONES]
+    with open(config_file, 'r') as f:
+        zones = json.load(f)
+    print(f"{len(zones)} zonas cargadas desde {config_file}")
+    return zones
+
+
+class ZoneIndex:
+    """Zonas (círculos y polígonos) indexadas en una rejilla uniforme.
+
+    Cada celda guarda las zonas cuyo rectángulo envolvente la toca, en formato CSR
+    (cell_start/cell_zones), para obtener los pares (tag, zona) candidatos sin bucles en Python.
+    """
+
+    def __init__(self, zones, cell_size=GRID_CELL_M):
+        if not zones:
+            raise ValueError("Se necesita al menos una zona.")
+        self.zones = zones
+        self.zone_ids = [zone['id'] for zone in zones]
+        self.cell_size = cell_size
+        num_zones = len(zones)
+        self.min_stay_ms = np.array([int(zone.get('min_stay_ms', 0)) for zone in zones], dtype=np.int64)
+        self.is_circle = np.array([zone.get('type', 'circle') == 'circle' for zone in zones])
+        self.center = np.zeros((num_zones, 2))
+        self.radius_sq = np.zeros(num_zones)
+        bbox = np.zeros((num_zones, 4)) # xmin, ymin, xmax, ymax
+        edges = []
+        edge_counts = np.zeros(num_zones, dtype=np.int64)
+        for z, zone in enumerate(zones):
+            if self.is_circle[z]:
+                x, y, r = float(zone['x']), float(zone['y']), float(zone['radius'])
+                self.center[z] = (x, y)
+                self.radius_sq[z] = r * r
+                bbox[z] = (x - r, y - r, x + r, y + r)
+            else:
+                points = np.asarray(zone['points'], dtype=np.float64)
+                if len(points) < 3:
+                    raise ValueError(f"La zona {zone['id']} necesita al menos 3 vértices.")
+                edges.append(np.hstack([points, np.roll(points, -1, axis=0)])) # (x1, y1, x2, y2)
+                edge_counts[z] = len(points)
+                bbox[z] = (*points.min(axis=0), *points.max(axis=0))
+        # Aristas de todos los polígonos seguidas; edge_start[z] es la primera arista de la zona z
+        self.edges = np.vstack(edges) if edges else np.zeros((0, 4))
+        self.edge_counts = edge_counts
+        self.edge_start = np.concatenate(([0], np.cumsum(edge_counts)[:-1]))
+
+        self.origin = bbox[:, :2].min(axis=0)
+        cell_min = np.floor((bbox[:, :2] - self.origin) / cell_size).astype(np.int64)
+        cell_max = np.floor((bbox[:, 2:] - self.origin) / cell_size).astype(np.int64)
+        self.grid_shape = tuple(cell_max.max(axis=0) + 1)
+        buckets = [[] for _ in range(self.grid_shape[0] * self.grid_shape[1])]
+        for z in range(num_zones):
+            for cx in range(cell_min[z, 0], cell_max[z, 0] + 1):
+                for cy in range(cell_min[z, 1], cell_max[z, 1] + 1):
+                    buckets[cx * self.grid_shape[1] + cy].append(z)
+        counts = np.array([len(b) for b in buckets], dtype=np.int64)
+        self.cell_start = np.concatenate(([0], np.cumsum(counts)))
+        self.cell_zones = np.array([z for b in buckets for z in b], dtype=np.int64)
+
+    def candidates(self, xy):
+        """Pares (fila, zona) cuyas celdas coinciden. xy: (T, 2) sin NaN."""
+        cells = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+        in_grid = np.all((cells >= 0) & (cells < np.array(self.grid_shape)), axis=1)
+        rows = np.flatnonzero(in_grid)
+        flat = cells[rows, 0] * self.grid_shape[1] + cells[rows, 1]
+        starts = self.cell_start[flat]
+        counts = self.cell_start[flat + 1] - starts
+        pair_rows = np.repeat(rows, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_zones = self.cell_zones[np.repeat(starts, counts) + offsets]
+        return pair_rows, pair_zones
+
+    def contains(self, xy):
+        """Matriz (T, Z) de pertenencia de cada posición a cada zona."""
+        inside = np.zeros((len(xy), len(self.zones)), dtype=bool)
+        if len(xy) == 0:
+            return inside
+        rows, zones = self.candidates(xy)
+        circle = self.is_circle[zones]
+        if np.any(circle):
+            r, z = rows[circle], zones[circle]
+            d = xy[r] - self.center[z]
+            inside[r, z] = np.einsum('ij,ij->i', d, d) <= self.radius_sq[z]
+        if not np.all(circle):
+            r, z = rows[~circle], zones[~circle]
+            counts = self.edge_counts[z]
+            pair = np.repeat(np.arange(len(z)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            e = self.edges[np.repeat(self.edge_start[z], counts) + offsets]
+            px, py = xy[r[pair], 0], xy[r[pair], 1]
+            # Ray casting: aristas que cruzan la horizontal del punto a su derecha
+            straddle = (e[:, 1] > py) != (e[:, 3] > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = e[:, 0] + (py - e[:, 1]) * (e[:, 2] - e[:, 0]) / (e[:, 3] - e[:, 1])
+            crossings = np.bincount(pair, weights=(straddle & (px < x_cross)), minlength=len(z))
+            inside[r, z] = (crossings.astype(np.int64) % 2) == 1
+        return inside
+
+
+class ZoneEngine:
+    """Estado por (tag, zona) con la misma semántica que checkZones del firmware.
+
+    - Al entrar: tagInside = true y entryTime = ahora (evento 'enter').
+    - Dentro, cuando ahora - entryTime >= minStayTime por primera vez: evento 'dwell'.
+    - Al salir: se borran ambos flags (evento 'exit').
+    Las posiciones NaN no cambian el estado (el tag no se ha medido en ese tick).
+    """
+
+    def __init__(self, zones, cell_size=GRID_CELL_M, on_event=None):
+        self.index = ZoneIndex(zones, cell_size)
+        self.on_event = on_event
+        self.tag_rows = {}
+        num_zones = len(zones)
+        self.inside = np.zeros((0, num_zones), dtype=bool)
+        self.dwell_reached = np.zeros((0, num_zones), dtype=bool)
+        self.entry_time = np.zeros((0, num_zones), dtype=np.int64)
+
+    def _rows_for(self, tag_ids):
+        new_tags = [tag_id for tag_id in dict.fromkeys(tag_ids) if tag_id not in self.tag_rows]
+        if new_tags:
+            for tag_id in new_tags:
+                self.tag_rows[tag_id] = len(self.tag_rows)
+            extra = len(new_tags)
+            num_zones = self.inside.shape[1]
+            self.inside = np.vstack([self.inside, np.zeros((extra, num_zones), dtype=bool)])
+            self.dwell_reached = np.vstack([self.dwell_reached, np.zeros((extra, num_zones), dtype=bool)])
+            self.entry_time = np.vstack([self.entry_time, np.zeros((extra, num_zones), dtype=np.int64)])
+        return np.array([self.tag_rows[tag_id] for tag_id in tag_ids], dtype=np.int64)
+
+    def tick(self, tag_ids, xy, timestamp_ms):
+        """Evalúa las posiciones de varios tags a la vez.
+
+        tag_ids: lista (T,) sin repetidos; xy: (T, 2) en metros; timestamp_ms: escalar o (T,).
+        Devuelve la lista de ZoneEvent generados (ordenados por tag y zona).
+        """
+        tag_ids = list(tag_ids)
+        xy = np.asarray(xy, dtype=np.float64).reshape(len(tag_ids), 2)
+        now = np.broadcast_to(np.asarray(timestamp_ms, dtype=np.int64), (len(tag_ids),))
+        rows = self._rows_for(tag_ids)
+        valid = ~np.isnan(xy).any(axis=1)
+        rows, xy, now = rows[valid], xy[valid], now[valid]
+        ids = [tag_id for tag_id, ok in zip(tag_ids, valid) if ok]
+
+        new_inside = self.index.contains(xy)
+        was_inside = self.inside[rows]
+        entered = new_inside & ~was_inside
+        exited = was_inside & ~new_inside
+        entry_time = np.where(entered, now[:, None], self.entry_time[rows])
+        dwell_before = self.dwell_reached[rows] & ~exited
+        dwell = new_inside & ~dwell_before & ((now[:, None] - entry_time) >= self.index.min_stay_ms)
+
+        self.inside[rows] = new_inside
+        self.entry_time[rows] = entry_time
+        self.dwell_reached[rows] = (dwell_before | dwell) & new_inside
+
+        events = []
+        for kind, mask in (('enter', entered), ('dwell', dwell), ('exit', exited)):
+            for i, z in zip(*np.nonzero(mask)):
+                events.append(ZoneEvent(kind, ids[i], self.index.zone_ids[z], int(now[i])))
+        order = {'enter': 0, 'dwell': 1, 'exit': 2}
+        events.sort(key=lambda e: (e.tag_id, e.zone_id, order[e.kind]))
+        if self.on_event:
+            for event in events:
+                self.on_event(event)
+        return events
+
+    def update(self, tag_id, x, y, timestamp_ms):
+        """Una sola posición (p. ej. desde LivePositionEngine)."""
+        return self.tick([tag_id], [[x, y]], timestamp_ms)
+
+    def zones_of(self, tag_id):
+        """IDs de las zonas en las que está el tag ahora mismo."""
+        row = self.tag_rows.get(tag_id)
+        if row is None:
+            return []
+        return [self.index.zone_ids[z] for z in np.flatnonzero(self.inside[row])]
+
+
+def replay_processed(engine, processed_file):
+    """Pasa un CSV procesado (Timestamp(ms), TagID, Position_X/Y) por el motor, tick a tick."""
+    import pandas as pd
+
+    df = pd.read_csv(processed_file, usecols=['Timestamp(ms)', 'TagID', 'Position_X', 'Position_Y'])
+    df = df.sort_values(['Timestamp(ms)', 'TagID'], kind='stable')
+    events = []
+    for timestamp_ms, group in df.groupby('Timestamp(ms)', sort=True):
+        group = group.drop_duplicates('TagID', keep='last')
+        events.extend(engine.tick(group['TagID'].tolist(), group[['Position_X', 'Position_Y']].to_numpy(), timestamp_ms))
+    return events
+
+
+def benchmark(num_zones=500, num_tags=50, num_ticks=200, seed=0):
+    """Mide ticks/s con num_zones zonas mixtas (círculos y polígonos) y num_tags tags moviéndose."""
+    rng = np.random.default_rng(seed)
+    zones = []
+    for z in range(num_zones):
+        cx, cy = rng.uniform(0, 50, 2)
+        if z % 2:
+            zones.append({'id': z, 'type': 'circle', 'x': cx, 'y': cy, 'radius': rng.uniform(0.3, 2.0), 'min_stay_ms': 1000})
+        else:
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 6))
+            radii = rng.uniform(0.5, 2.0, 6)
+            points = np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)]).tolist()
+            zones.append({'id': z, 'type': 'polygon', 'points': points, 'min_stay_ms': 1000})
+    engine = ZoneEngine(zones, cell_size=2.0)
+    xy = rng.uniform(0, 50, (num_tags, 2))
+    tag_ids = list(range(1, num_tags + 1))
+    num_events = 0
+    start = time.perf_counter()
+    for tick in range(num_ticks):
+        xy += rng.normal(0, 0.3, xy.shape)
+        num_events += len(engine.tick(tag_ids, xy, tick * 100))
+    elapsed = time.perf_counter() - start
+    print(f"{num_zones} zonas, {num_tags} tags: {num_ticks / elapsed:.0f} ticks/s "
+          f"({elapsed / num_ticks * 1000:.2f} ms/tick), {num_events} eventos")
+
+
+def run_mqtt(engine, broker, port):
+    """Evalúa las posiciones publicadas por live_engine.py y publica los eventos en uwb/tag/<id>/zone."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(client_id=f"zone-engine-{os.getpid()}-{time.time()}")
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(POSITION_TOPIC_FMT.format('+'))
+            print(f"Motor de zonas suscrito a {POSITION_TOPIC_FMT.format('+')} en {broker}:{port}")
+        else:
+            print(f"Fallo al conectar, código de error: {rc}")
+
+    def on_message(client, userdata, msg):
+        try:
+            position = json.loads(msg.payload.decode("utf-8"))
+            engine.update(position['tag_id'], position['x'], position['y'], position['timestamp_ms'])
+        except Exception as e:
+            print(f"Error procesando mensaje MQTT: {e}")
+
+    def publish_event(event):
+        print(f"Tag {event.tag_id}: {event.kind} zona {event.zone_id} ({event.timestamp_ms} ms)")
+        client.publish(ZONE_EVENT_TOPIC_FMT.format(event.tag_id), json.dumps(event._asdict()))
+
+    engine.on_event = publish_event
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker, port, 60)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        print("\nMotor de zonas detenido por el usuario (Ctrl+C).")
+    finally:
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Motor de zonas (geofencing) para todos los tags.')
+    parser.add_argument('--zones', default=ZONES_CONFIG_FILE, help='JSON con las zonas (por defecto, las del firmware).')
+    parser.add_argument('--processed', default=None, help='Evalúa un CSV procesado y lista los eventos.')
+    parser.add_argument('--benchmark', action='store_true', help='Mide el rendimiento con cientos de zonas y decenas de tags.')
+    parser.add_argument('--broker', default=BROKER_ADDRESS)
+    parser.add_argument('--port', type=int, default=BROKER_PORT)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+    elif args.processed:
+        for event in replay_processed(ZoneEngine(load_zones(args.zones)), args.processed):
+            print(f"{event.timestamp_ms:>10} ms  Tag {event.tag_id}: {event.kind} zona {event.zone_id}")
+    else:
+        run_mqtt(ZoneEngine(load_zones(args.zones)), args.broker, args.port)